@@ -1,6 +1,7 @@
 from .file import File
 from .lines import LazyLineObject
 from .array import OneIndexedArray
+from .bond_graph import BondGraph
 from .molecule import Molecule
 from .ensemble import Ensemble, ConformationalEnsemble
 from .group import Group
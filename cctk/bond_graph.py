@@ -0,0 +1,272 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse
+import scipy.sparse.csgraph
+
+class BondGraph:
+    """
+    Compact bond graph stored as CSR adjacency arrays -- a lightweight alternative to ``networkx.Graph`` for large molecules and ensembles.
+    Atoms are 1-indexed, as in ``Molecule``.
+
+    The arrays are the source of truth: ``to_networkx(view=True)`` returns a cached, frozen ``networkx.Graph`` for read access,
+    and edits (through ``set_bond_order()``, e.g. via ``Molecule.add_bond()``) replace the arrays in place, so every molecule sharing the graph sees them.
+
+    The neighbors of atom ``i`` are ``indices[indptr[i-1]:indptr[i]]`` (sorted), with bond orders ``orders[indptr[i-1]:indptr[i]]``.
+    Every bond is stored in both directions.
+
+    Attributes:
+        num_atoms (int): number of atoms
+        indptr (np.ndarray): row pointers, shape ``(num_atoms + 1,)``
+        indices (np.ndarray): 1-indexed neighbor atom numbers
+        orders (np.ndarray): bond order of each adjacency entry
+        version (int): incremented by every edit, so that cached topology can tell when it's out of date
+    """
+
+    def __init__(self, num_atoms, edges=None, orders=None):
+        """
+        Args:
+            num_atoms (int): number of atoms
+            edges (np.ndarray): 1-indexed bonded pairs, shape ``(k, 2)``
+            orders (np.ndarray): bond orders, shape ``(k,)`` (defaults to all 1)
+        """
+        self.version = 0
+        self._set_edges(num_atoms, edges, orders)
+
+    def _set_edges(self, num_atoms, edges=None, orders=None):
+        """
+        Helper method which (re)builds the CSR arrays from an edge list, discarding the cached ``networkx`` view.
+        """
+        assert isinstance(num_atoms, (int, np.integer)) and num_atoms >= 0, "num_atoms must be a non-negative integer"
+        if edges is None:
+            edges = np.zeros(shape=(0, 2), dtype=np.int64)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        if orders is None:
+            orders = np.ones(len(edges), dtype=np.int8)
+        orders = np.asarray(orders, dtype=np.int8)
+        assert orders.shape == (len(edges),), f"expected {len(edges)} bond orders, but got shape {orders.shape}"
+
+        if len(edges):
+            assert np.min(edges) >= 1 and np.max(edges) <= num_atoms, f"atom numbers must be between 1 and {num_atoms}"
+            assert np.all(edges[:, 0] != edges[:, 1]), "self-bonds are not allowed"
+
+        #### store both directions, sorted by atom and then by neighbor (duplicate bonds keep the last order)
+        rows = np.concatenate([edges[:, 0], edges[:, 1]])
+        cols = np.concatenate([edges[:, 1], edges[:, 0]])
+        orders = np.concatenate([orders, orders])
+        keys = rows * (num_atoms + 1) + cols
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - last
+
+        self.num_atoms = int(num_atoms)
+        self.indices = cols[keep].astype(np.int32)
+        self.orders = orders[keep]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[keep] - 1, minlength=num_atoms))]).astype(np.int32)
+        self._freeze_arrays()
+        self._networkx = None
+
+    def _freeze_arrays(self):
+        """
+        Helper method which makes the arrays read-only: edits replace the arrays rather than writing into them, so copies can share them.
+        """
+        for array in (self.indptr, self.indices, self.orders):
+            array.flags.writeable = False
+
+    def __getstate__(self):
+        #### the networkx view is cheap to rebuild, so don't pickle it
+        state = self.__dict__.copy()
+        state["_networkx"] = None
+        return state
+
+    def __setstate__(self, state):
+        #### unpickled arrays are writeable again
+        self.__dict__.update(state)
+        self._freeze_arrays()
+
+    def copy(self):
+        """
+        Returns an independent copy of the graph. The (read-only) arrays are shared, since edits to either graph replace them instead of writing into them.
+        """
+        new = BondGraph.__new__(BondGraph)
+        new.num_atoms = self.num_atoms
+        new.indptr, new.indices, new.orders = self.indptr, self.indices, self.orders
+        new.version = 0
+        new._networkx = None
+        return new
+
+    def set_bond_order(self, atom1, atom2, order):
+        """
+        Adds, changes, or (if ``order`` is 0) removes the bond between ``atom1`` and ``atom2``, in place.
+        """
+        current = self.bond_order(atom1, atom2)
+        if current == order:
+            return
+        edges, orders = self.edges()
+        keep = ~(((edges[:, 0] == atom1) & (edges[:, 1] == atom2)) | ((edges[:, 0] == atom2) & (edges[:, 1] == atom1)))
+        edges, orders = edges[keep], orders[keep]
+        if order > 0:
+            edges = np.concatenate([edges, [[atom1, atom2]]])
+            orders = np.concatenate([orders, [order]])
+        self._set_edges(self.num_atoms, edges, orders)
+        self.version += 1
+
+    @classmethod
+    def from_networkx(cls, graph, num_atoms=None):
+        """
+        Builds a ``BondGraph`` from a ``networkx.Graph`` with 1-indexed nodes and bond orders stored as ``weight``.
+
+        Args:
+            graph (nx.Graph): bond graph
+            num_atoms (int): number of atoms (defaults to the number of nodes)
+
+        Returns:
+            new ``BondGraph``
+        """
+        if num_atoms is None:
+            num_atoms = graph.number_of_nodes()
+        edges = np.array([(i, j) for i, j in graph.edges()], dtype=np.int64).reshape(-1, 2)
+        orders = np.array([w for _, _, w in graph.edges(data="weight", default=1)], dtype=np.int8)
+        return cls(num_atoms, edges, orders)
+
+    def __len__(self):
+        return self.num_atoms
+
+    def number_of_nodes(self):
+        return self.num_atoms
+
+    def number_of_edges(self):
+        return len(self.indices) // 2
+
+    def neighbors(self, atom):
+        """
+        Returns the 1-indexed neighbors of ``atom``, as an array.
+        """
+        return self.indices[self.indptr[atom-1]:self.indptr[atom]]
+
+    def degree(self, atom):
+        return int(self.indptr[atom] - self.indptr[atom-1])
+
+    def bond_order(self, atom1, atom2):
+        """
+        Returns the bond order between ``atom1`` and ``atom2`` (0 if they aren't bonded).
+        """
+        start, stop = self.indptr[atom1-1], self.indptr[atom1]
+        idx = start + np.searchsorted(self.indices[start:stop], atom2)
+        if idx < stop and self.indices[idx] == atom2:
+            return int(self.orders[idx])
+        return 0
+
+    def has_edge(self, atom1, atom2):
+        return self.bond_order(atom1, atom2) > 0
+
+    def edges(self):
+        """
+        Returns every bond once.
+
+        Returns:
+            1-indexed bonded pairs (``atom1 < atom2``), shape ``(k, 2)``, and bond orders, shape ``(k,)``
+        """
+        rows = np.repeat(np.arange(1, self.num_atoms + 1, dtype=np.int32), np.diff(self.indptr))
+        mask = rows < self.indices
+        return np.stack([rows[mask], self.indices[mask]], axis=-1), self.orders[mask]
+
+    def to_csr(self):
+        """
+        Returns the bond orders as a 0-indexed ``scipy.sparse.csr_matrix`` of shape ``(num_atoms, num_atoms)``.
+        """
+        return scipy.sparse.csr_matrix((self.orders.copy(), self.indices - 1, self.indptr.copy()), shape=(self.num_atoms, self.num_atoms))
+
+    def connected_components(self, ignore_bond=None):
+        """
+        Labels every atom with the index of its connected component.
+
+        Args:
+            ignore_bond (tuple): optionally, a pair of atom numbers whose bond is treated as broken
+
+        Returns:
+            number of components, and an array of labels of shape ``(num_atoms,)`` (0-indexed, so ``labels[atom-1]``)
+        """
+        csr = self.to_csr()
+        if ignore_bond is not None:
+            atom1, atom2 = ignore_bond
+            csr[atom1-1, atom2-1] = 0
+            csr[atom2-1, atom1-1] = 0
+            csr.eliminate_zeros()
+        return scipy.sparse.csgraph.connected_components(csr, directed=False)
+
+    def bridges_and_blocks(self):
+        """
+        Finds the bridges (bonds whose removal splits a fragment) and the biconnected blocks, with one iterative depth-first search (Tarjan's algorithm).
+        An atom is in a ring exactly when it belongs to a block of three or more atoms.
+
+        Returns:
+            list of bridges (as ``(atom1, atom2)`` tuples), list of blocks (as sets of atom numbers)
+        """
+        indptr, indices = self.indptr.tolist(), self.indices.tolist()
+        discovered = [0] * (self.num_atoms + 1)
+        low = [0] * (self.num_atoms + 1)
+        bridges, blocks = list(), list()
+        time = 1
+
+        for root in range(1, self.num_atoms + 1):
+            if discovered[root]:
+                continue
+            discovered[root] = low[root] = time
+            time += 1
+            stack = [[root, 0, indptr[root-1]]]
+            edge_stack = list()
+
+            while stack:
+                frame = stack[-1]
+                atom, parent, position = frame
+                if position < indptr[atom]:
+                    frame[2] += 1
+                    neighbor = indices[position]
+                    if neighbor == parent:
+                        continue
+                    if not discovered[neighbor]:
+                        discovered[neighbor] = low[neighbor] = time
+                        time += 1
+                        edge_stack.append((atom, neighbor))
+                        stack.append([neighbor, atom, indptr[neighbor-1]])
+                    elif discovered[neighbor] < discovered[atom]:
+                        edge_stack.append((atom, neighbor))
+                        low[atom] = min(low[atom], discovered[neighbor])
+                else:
+                    stack.pop()
+                    if parent:
+                        low[parent] = min(low[parent], low[atom])
+                        if low[atom] > discovered[parent]:
+                            bridges.append((parent, atom))
+                        if low[atom] >= discovered[parent]:
+                            #### everything above (parent, atom) on the edge stack forms one block
+                            block = set()
+                            while True:
+                                edge = edge_stack.pop()
+                                block.update(edge)
+                                if edge == (parent, atom):
+                                    break
+                            blocks.append(block)
+
+        return bridges, blocks
+
+    def to_networkx(self, view=False):
+        """
+        Returns an equivalent ``networkx.Graph``, with bond orders stored as ``weight``.
+
+        Args:
+            view (bool): if True, returns a cached, frozen graph (shared by every caller until the arrays change) instead of a new one
+
+        Returns:
+            ``networkx.Graph``
+        """
+        if view:
+            if self._networkx is None:
+                self._networkx = nx.freeze(self.to_networkx())
+                self._networkx._compact_source = self
+            return self._networkx
+
+        graph = nx.Graph()
+        graph.add_nodes_from(range(1, self.num_atoms + 1))
+        edges, orders = self.edges()
+        graph.add_weighted_edges_from(zip(edges[:, 0].tolist(), edges[:, 1].tolist(), orders.tolist()))
+        return graph
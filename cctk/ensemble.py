@@ -1,8 +1,13 @@
 import numpy as np
+import scipy.sparse
+import heapq
+import weakref
+import concurrent.futures
 from copy import deepcopy
 
 import cctk
-from cctk.helper_functions import align_matrices
+from cctk.bond_graph import BondGraph
+from cctk.helper_functions import compute_internal_coordinates, compute_kabsch_rotations, compute_RMSDs, compute_pairwise_RMSDs, compute_grid_volume, compute_periodic_centering, get_vdw_radius
 
 
 class Ensemble:
@@ -20,10 +25,24 @@ class Ensemble:
     - To access ``Molecule`` objects, use ``ensemble.molecule``: ``ensemble.molecule[0]`` will return the first object, whereas ``ensemble.molecule[1:3]`` will return a list.
     - ``ensemble.items()`` will return a list of (molecule, property) pairs.
     - ``ensemble.molecule_list()`` and ``ensemble.properties_list()`` return lists of molecules and properties, respectively.
+    - ``ensemble.get_column("energy")`` returns a typed ``np.ndarray`` of one property (plus a mask of missing entries),
+        and ``ensemble.to_dataframe()`` exports properties to ``pandas``.
+    - ``ensemble.query(energy=(None, -100.0), rms_force=(None, 1e-4))`` returns the molecules within the given ranges,
+        using sorted indexes on properties registered with ``ensemble.create_index()``.
+
+    Properties are stored in ``dict`` subclasses which keep track of modifications, so that numeric columns can be built once
+    and reused by sorting, filtering, and averaging until something changes. (Modifying an array-valued property in place is not tracked.)
+    As a consequence, a plain ``dict`` passed to ``add_molecule()`` is copied: use ``get_properties_dict()`` to get the stored dict back.
 
     Attributes:
         name (str): name, for identification
         _items (dict): keys: ``Molecule`` objects; values: dictionaries containing properties from each molecule, variable. should always be one layer deep.
+        _molecules (list): the keys of ``_items`` in order, for constant-time positional access
+        _index (dict): position of each molecule in ``_molecules``
+        _columns (dict): cached columns built by ``get_column()``, keyed by property name
+        _exact_columns (set): names of cached columns whose values can be returned by ``get_property()`` without changing their type
+        _properties_version (int): incremented whenever one of this ensemble's property dicts is modified
+        _indexes (dict): sorted indexes created by ``create_index()``, keyed by property name (``None`` if out of date)
         molecules (``MoleculeIndexer``): special object that accesses the keys
     """
 
@@ -36,35 +55,81 @@ class Ensemble:
         """
         self.name = name
         self._items = {}
+        self._molecules = []
+        self._index = {}
+        self._columns = {}
+        self._exact_columns = set()
+        self._columns_version = None
+        self._properties_version = 0
+        self._indexes = {}
         self.molecules = self._MoleculeIndexer(self)
 
+    def __getstate__(self):
+        #### property dicts don't remember their owners across copies, so cached columns can't be trusted afterwards
+        state = self.__dict__.copy()
+        state["_columns"] = {}
+        state["_exact_columns"] = set()
+        state["_columns_version"] = None
+        state["_indexes"] = dict.fromkeys(self._indexes)
+        return state
+
     def __str__(self):
         name = "None" if self.name is None else self.name
         return f"Ensemble (name={name}, {len(self._items)} molecules)"
 
     def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.get_property(key[0], key[1])
+        elif key is None:
+            return self
+
+        return self._subset(self._positions(key))
+
+    def _subset(self, positions):
+        """
+        Helper method which returns a new ensemble containing the molecules at ``positions``.
+        Molecules and property dicts are shared with this ensemble, not copied, and are not checked again.
+        """
+        new = type(self)(name=self.name) # will return either Ensemble or subclass thereof
+        for i in positions:
+            mol = self._molecules[i]
+            new._index[mol] = len(new._molecules)
+            new._molecules.append(mol)
+            new._items[mol] = self._items[mol]
+        return new
+
+    def _positions(self, key):
+        """
+        Helper method which returns the positions selected by ``key`` (an index, ``Molecule``, slice, or list/array thereof), in order.
+        Each molecule is only returned once, even if it's selected several times.
+        """
         if isinstance(key, (int, np.integer)):
-            mol = self.molecule_list()[key]
-            prop = self.properties_list()[key]
-            new = type(self)(name=self.name) # will return either Ensemble or subclass thereof
-            new.add_molecule(mol, properties=prop)
-            return new
+            n = len(self._molecules)
+            if not -n <= key < n:
+                raise IndexError(f"index {key} out of range for ensemble with {n} molecules")
+            return [int(key) % n]
         elif isinstance(key, cctk.Molecule):
-            idx = self.molecule_list().index(key)
-            return self[idx]
+            if key not in self._index:
+                raise ValueError(f"{key} is not in this ensemble")
+            return [self._index[key]]
         elif isinstance(key, (list, np.ndarray)):
-            new_list = [self[k] for k in key]
-            return self.join_ensembles(new_list, name=self.name)
+            selected = dict()
+            for k in key:
+                selected.update(dict.fromkeys(self._positions(k)))
+            return list(selected)
         elif isinstance(key, slice):
-            start, stop, step = key.indices(len(self))
-            return self[list(range(start, stop, step))]
-        elif isinstance(key, tuple):
-            return self.get_property(key[0], key[1])
+            return list(range(*key.indices(len(self._molecules))))
         elif key is None:
-            return self
+            return list(range(len(self._molecules)))
         else:
             raise KeyError(f"not a valid datatype for Ensemble key: {type(key)}")
 
+    def _select(self, key):
+        """
+        Helper method which returns the molecules selected by ``key`` (see ``_positions()``), in order.
+        """
+        return [self._molecules[i] for i in self._positions(key)]
+
     def __setitem__(self, key, item):
         assert isinstance(key, tuple), "need two indexes to set a value in an ensemble!"
         idx = key[0]
@@ -81,7 +146,7 @@ class Ensemble:
             for k in idx:
                 self[k, name] = item
         elif isinstance(idx, (int, np.integer)):
-            mol = self.molecule_list()[idx]
+            mol = self._molecules[idx]
             self[mol, name] = item
         elif isinstance(idx, cctk.Molecule):
             if isinstance(name, (list, np.ndarray)):
@@ -109,13 +174,13 @@ class Ensemble:
         """
         Returns a list of the constituent molecules.
         """
-        return list(self.keys())
+        return list(self._molecules)
 
     def properties_list(self):
         """
         Returns a list of dictionaries. One dictionary per geometry. Each dictionary contains the property names and property values for each geometry in the ensemble. 
         """
-        return list(self.values())
+        return [self._items[mol] for mol in self._molecules]
 
     def has_property(self, idx, prop):
         """
@@ -139,9 +204,22 @@ class Ensemble:
     def get_property(self, idx, prop):
         """
         """
-        ensemble = self[idx]
+        positions = self._positions(idx)
+        if isinstance(prop, str) and len(positions) > 1:
+            values, missing = self.get_column(prop)
+
+            #### only take the fast path if the column holds the original values (e.g. not ints converted to floats)
+            if values.ndim == 1 and prop in self._exact_columns:
+                if np.all(missing[positions]):
+                    return None
+                result = values[positions].astype(object)
+                result[missing[positions]] = None
+                return result.tolist()
+
+        molecules = [self._molecules[i] for i in positions]
         result = []
-        for m, p in ensemble.items():
+        for m in molecules:
+            p = self._items[m]
             if isinstance(prop, list):
                 row = []
                 for x in prop:
@@ -155,7 +233,7 @@ class Ensemble:
                     result.append(p[prop])
                 else:
                     result.append(None)
-        if len(ensemble) == 1:
+        if len(molecules) == 1:
             if result[0] is None:
                 return None
             return result[0]
@@ -182,9 +260,9 @@ class Ensemble:
                 the property dict corresponding to this Molecule
         """
         assert isinstance(idx, (int, np.integer, cctk.Molecule)), "index must be int or Molecule"
-        ensemble = self[idx]
-        assert len(ensemble) == 1, "idx returned too many ensembles"
-        return ensemble.properties_list()[0]
+        molecules = self._select(idx)
+        assert len(molecules) == 1, "idx returned too many ensembles"
+        return self._items[molecules[0]]
 
     def items(self):
         """
@@ -208,7 +286,7 @@ class Ensemble:
             self.ensemble = ensemble
 
         def __getitem__(self, key):
-            items_list = list(self.ensemble._items.keys())
+            items_list = self.ensemble._molecules
             n_items = len(items_list)
             if isinstance(key, (int, np.integer)):
                 self._check_key(key, n_items)
@@ -235,7 +313,7 @@ class Ensemble:
             assert -n_items <= key < n_items, f"key {key} is out of range...must be between {-n_items} and {n_items-1} inclusive"
 
         def __iter__(self):
-            return iter(self.ensemble.molecule_list())
+            return iter(self.ensemble._molecules)
 
     def properties(self, num=None):
         """
@@ -259,24 +337,253 @@ class Ensemble:
         Returns:
             new Ensemble (current ensemble is not modified)
         """
-        property_list = self[:,property_name]
-        if property_list is None:
+        new_indices = np.argsort(self._sortable_column(property_name), kind="stable")
+        if not ascending:
+            new_indices = np.flip(new_indices)
+        return self[[new_indices]]
+
+    def _sortable_column(self, property_name):
+        """
+        Helper method which returns the column for ``property_name``, raising an error if any entries are missing.
+        """
+        values, missing = self.get_column(property_name)
+        if np.all(missing):
             raise ValueError(f"property '{property_name}' not found in ensemble")
-        property_list = np.asarray(property_list)
-        n_missing_entries = np.count_nonzero(property_list==None)
+        n_missing_entries = np.count_nonzero(missing)
         if n_missing_entries > 0:
             error = "---sorting error---\n"
-            error += str(property_list)
+            error += str(self[:,property_name])
             raise ValueError(f"{error}\nproperty '{property_name}' has {n_missing_entries} missing entries and cannot be sorted")
-        new_indices = np.argsort(property_list)
-        if not ascending:
-            new_indices = np.flip(new_indices)
-        return self[[new_indices]]
+        assert values.ndim == 1, f"property '{property_name}' is not a scalar and cannot be sorted"
+        return values
+
+    def get_column(self, property_name):
+        """
+        Returns every value of one property as a typed ``np.ndarray``.
+
+        Numeric scalars give a ``float64`` column (or ``int64``/``bool``, if every entry is present and of that type),
+        and numeric arrays of the same shape give a ``float64`` column of shape ``(n_molecules, *shape)``; missing entries are ``nan``.
+        Anything else gives an ``object`` column, with ``None`` for missing entries.
+
+        Columns are cached until a property or the ensemble is modified, so repeated queries are cheap.
+        The returned arrays are read-only.
+
+        Args:
+            property_name (str): the name of the property
+
+        Returns:
+            ``np.ndarray`` of values, boolean ``np.ndarray`` which is ``True`` for missing entries
+        """
+        if self._columns_version != self._properties_version:
+            self._columns = {}
+            self._indexes = dict.fromkeys(self._indexes)
+            self._columns_version = self._properties_version
+
+        if not self._columns:
+            #### (re)register with every property dict, so that modifying any of them invalidates this ensemble's cache
+            self._exact_columns = set()
+            for properties in self._items.values():
+                if isinstance(properties, _PropertyDict):
+                    properties._add_owner(self)
+
+        if property_name not in self._columns:
+            values = [self._items[mol].get(property_name) for mol in self._molecules]
+            column, missing, exact = _build_column(values)
+            column.flags.writeable = False
+            missing.flags.writeable = False
+            self._columns[property_name] = (column, missing)
+            if exact:
+                self._exact_columns.add(property_name)
+
+        return self._columns[property_name]
+
+    def create_index(self, property_name):
+        """
+        Registers a sorted index on a numeric, scalar property, so that ``query()``, ``top_k()``, and ``property_range()``
+        can answer range questions with binary search instead of scanning every molecule.
+
+        The index is rebuilt lazily (in O(n log n)) the first time it's needed after the ensemble or any property changes.
+
+        Args:
+            property_name (str): the name of the property to index
+        """
+        self._indexes[property_name] = None
+        self._get_index(property_name)
+
+    def drop_index(self, property_name):
+        """
+        Removes an index created by ``create_index()``.
+        """
+        self._indexes.pop(property_name, None)
+
+    def _get_index(self, property_name):
+        """
+        Helper method which returns the up-to-date index for ``property_name``:
+        positions of every molecule with the property defined, sorted by value, and the sorted values themselves.
+        """
+        values, missing = self.get_column(property_name)
+        if self._indexes[property_name] is None:
+            assert values.ndim == 1 and values.dtype != object, f"can only index numeric scalar properties, but '{property_name}' is not"
+            positions = np.nonzero(~missing)[0]
+            order = positions[np.argsort(values[positions], kind="stable")]
+            self._indexes[property_name] = (order, values[order])
+        return self._indexes[property_name]
+
+    def query(self, **ranges):
+        """
+        Returns a new ensemble with the molecules whose properties fall within the given (inclusive) ranges.
+        Molecules missing any of the properties are never included. The molecules themselves are not copied.
+
+        For example, ``ensemble.query(energy=(None, emin + 3 / 627.509), rms_force=(None, 1e-4))`` finds all conformers within
+        3 kcal/mol of ``emin`` which are converged to within 1e-4 in RMS force.
+
+        If any of the properties has an index (see ``create_index()``), candidates are found by binary search on the narrowest indexed range,
+        and only they are checked against the remaining conditions. Otherwise, every molecule is scanned.
+
+        Args:
+            **ranges: ``property_name=(minimum, maximum)``, where either bound can be ``None``
+
+        Returns:
+            new Ensemble, in the original order
+        """
+        assert len(ranges) > 0, "need at least one condition to query!"
+        for name, bounds in ranges.items():
+            assert isinstance(bounds, (tuple, list)) and len(bounds) == 2, f"range for '{name}' must be a (minimum, maximum) tuple"
+
+        candidates = None
+        indexed = [name for name in ranges if name in self._indexes]
+        for name in indexed:
+            found = self._index_range(name, *ranges[name])
+            if candidates is None or len(found) < len(candidates):
+                candidates = found
+
+        if candidates is None:
+            candidates = np.arange(len(self))
+        candidates = np.sort(candidates)
+
+        for name, (minimum, maximum) in ranges.items():
+            values, missing = self.get_column(name)
+            mask = ~missing[candidates]
+            with np.errstate(invalid="ignore"):
+                if minimum is not None:
+                    mask &= values[candidates] >= minimum
+                if maximum is not None:
+                    mask &= values[candidates] <= maximum
+            candidates = candidates[mask]
+
+        return self._subset(candidates)
+
+    def _index_range(self, property_name, minimum=None, maximum=None):
+        """
+        Helper method which returns the positions of the molecules with ``minimum <= property <= maximum``, using binary search on the index.
+        """
+        order, values = self._get_index(property_name)
+        start = 0 if minimum is None else np.searchsorted(values, minimum, side="left")
+        stop = len(values) if maximum is None else np.searchsorted(values, maximum, side="right")
+        return order[start:stop]
+
+    def top_k(self, property_name, k, largest=False):
+        """
+        Returns a new ensemble with the ``k`` molecules having the lowest (or highest) values of a property, in sorted order.
+        Uses the index on this property if there is one (see ``create_index()``).
+
+        Args:
+            property_name (str): the name of the property
+            k (int): how many molecules to return
+            largest (bool): whether to return the highest values instead of the lowest
+
+        Returns:
+            new Ensemble
+        """
+        assert isinstance(k, (int, np.integer)) and k > 0, f"k must be a positive integer, got {k}"
+        if property_name in self._indexes:
+            order, _ = self._get_index(property_name)
+            return self._subset(order[::-1][:k] if largest else order[:k])
+
+        values, missing = self.get_column(property_name)
+        positions = np.nonzero(~missing)[0]
+        keys = -values[positions] if largest else values[positions]
+        if k < len(positions):
+            selected = np.argpartition(keys, k - 1)[:k]
+            selected = selected[np.argsort(keys[selected], kind="stable")]
+        else:
+            selected = np.argsort(keys, kind="stable")
+        return self._subset(positions[selected])
+
+    def property_range(self, property_name):
+        """
+        Returns the minimum and maximum values of a property (ignoring missing entries), in constant time if the property is indexed.
+        """
+        if property_name in self._indexes:
+            _, values = self._get_index(property_name)
+            if len(values):
+                return values[0], values[-1]
+        else:
+            values, missing = self.get_column(property_name)
+            values = values[~missing]
+            if len(values):
+                return np.min(values), np.max(values)
+        raise ValueError(f"property '{property_name}' not found in ensemble")
+
+    def filter_by(self, property_name, condition):
+        """
+        Returns a new ensemble with the molecules for which ``condition`` is true. Molecules missing the property are never included.
+
+        Args:
+            property_name (str): the name of the property to filter on
+            condition (function): maps the column of values (see ``get_column()``) to a boolean array, e.g. ``lambda e: e < -100``
+
+        Returns:
+            new Ensemble (current ensemble is not modified)
+        """
+        values, missing = self.get_column(property_name)
+        with np.errstate(invalid="ignore"):
+            mask = np.asarray(condition(values), dtype=bool)
+        assert mask.shape == missing.shape, f"condition must return one boolean per molecule, but got shape {mask.shape}"
+        return self[np.nonzero(mask & ~missing)[0]]
+
+    def to_dataframe(self, property_names=None, copy=True):
+        """
+        Exports properties to a ``pandas.DataFrame``, one row per molecule. Scalar columns come from ``get_column()``; other properties are stored as objects.
+
+        By default the columns are copied, so the frame can be edited freely. With ``copy=False`` the frame wraps the cached columns without copying them:
+        these are read-only, so writing to such a column raises an error instead of corrupting the ensemble's cache.
+
+        Args:
+            property_names (list): which properties to export (defaults to every property of every molecule)
+            copy (bool): whether to copy the columns (otherwise, export zero-copy read-only columns)
+
+        Returns:
+            ``pandas.DataFrame``
+        """
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("pandas is required to export to a DataFrame!")
+
+        if property_names is None:
+            property_names = list(self.combined_properties().keys())
+
+        columns = dict()
+        for name in property_names:
+            values, missing = self.get_column(name)
+            if values.ndim > 1:
+                #### arrays go in as one object per row
+                values = np.empty(len(self), dtype=object)
+                for i, mol in enumerate(self._molecules):
+                    values[i] = self._items[mol].get(name)
+            columns[name] = values
+
+        return pd.DataFrame(columns, columns=property_names, copy=copy)
 
     def add_molecule(self, molecule, properties=None, copy=False):
         """
         Adds a molecule to the ensemble.
 
+        Property dicts taken from an ensemble (e.g. from ``get_properties_dict()``) are stored as-is, so they stay shared between ensembles.
+        A plain ``dict`` is copied into a tracked ``dict`` (see ``get_column()``), so later changes to the caller's own dict are *not* seen by the ensemble:
+        edit ``self.get_properties_dict(molecule)`` or set ``self[molecule, name]`` instead.
+
         Args:
             molecule (Molecule): the molecule to be added
             properties (dict): property name (str) to property value
@@ -289,13 +596,20 @@ class Ensemble:
             molecule = deepcopy(molecule)
 
         if properties is None:
-            #### empty dicts all point to the same memory address by default, so need to prevent that behavior by initializing non-empty dict
-            properties = {"placeholder": 1}
-            del properties["placeholder"]
+            properties = _PropertyDict()
 
         assert isinstance(properties, dict), f"properties must be a dict and not type {type(properties)}"
 
+        #### property dicts are wrapped so that changes can be tracked (see ``get_column()``)
+        if not isinstance(properties, _PropertyDict):
+            properties = _PropertyDict(properties)
+
+        if molecule not in self._items:
+            self._index[molecule] = len(self._molecules)
+            self._molecules.append(molecule)
         self._items[molecule] = properties
+        self._columns = {}
+        self._indexes = dict.fromkeys(self._indexes)
 
     def _check_molecule_number(self, number):
         """
@@ -325,10 +639,30 @@ class Ensemble:
             assert isinstance(ensemble, Ensemble), "can't join an object that isn't an Ensemble!"
 
         for ensemble in ensembles:
-            new_ensemble._items.update(ensemble.items())
+            new_ensemble._extend(ensemble._molecules, ensemble.properties_list())
 
         return new_ensemble
 
+    def _extend(self, molecules, properties):
+        """
+        Helper method which adds many molecules at once, without any checks. Molecules already in the ensemble keep their position
+        but get the new properties, as in ``add_molecule()``.
+
+        Args:
+            molecules (list): ``Molecule`` objects
+            properties (list): property dicts, one per molecule
+        """
+        for molecule, props in zip(molecules, properties):
+            if not isinstance(props, _PropertyDict):
+                props = _PropertyDict(props)
+            if molecule not in self._index:
+                self._index[molecule] = len(self._molecules)
+                self._molecules.append(molecule)
+            self._items[molecule] = props
+
+        self._columns = {}
+        self._indexes = dict.fromkeys(self._indexes)
+
     def lowest_molecules(self, property_name, num=1):
         """
         Retrieves the molecules with the lowest values of the specified property.
@@ -342,20 +676,157 @@ class Ensemble:
         """
         assert isinstance(num, (int, np.integer)), f"num must be an integer, got {type(num)}"
         assert num > 0, f"num must be > 0, got {num}"
-        sorted_ensemble = self.sort_by(property_name)
+        values = self._sortable_column(property_name)
+
+        #### only the lowest ``num`` values need to be sorted
+        if num < len(values):
+            lowest = np.argpartition(values, num - 1)[:num]
+            lowest = lowest[np.argsort(values[lowest], kind="stable")]
+        else:
+            lowest = np.argsort(values, kind="stable")
+
         if num > 1:
-            return sorted_ensemble.molecules[0:num]
-        return sorted_ensemble.molecules[0]
+            return [self._molecules[i] for i in lowest]
+        return self._molecules[lowest[0]]
+
+class _PropertyDict(dict):
+    """
+    ``dict`` which notifies the ensembles it belongs to when it is modified, so that they can tell when their cached property columns are out of date.
+    Ensembles are held by weak references and registered by ``Ensemble.get_column()``.
+    """
+    __slots__ = ("_owners",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._owners = []
+
+    def __reduce__(self):
+        #### owners aren't copied or pickled
+        return (_PropertyDict, (dict(self),))
+
+    def _add_owner(self, ensemble):
+        if not any(ref() is ensemble for ref in self._owners):
+            self._owners.append(weakref.ref(ensemble))
+
+    def _modified(self):
+        alive = []
+        for ref in self._owners:
+            ensemble = ref()
+            if ensemble is not None:
+                ensemble._properties_version += 1
+                alive.append(ref)
+        self._owners = alive
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._modified()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._modified()
+
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self._modified()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._modified()
+
+    def setdefault(self, key, default=None):
+        self._modified()
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        self._modified()
+        return super().pop(*args)
+
+    def popitem(self):
+        self._modified()
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self._modified()
+
+    def copy(self):
+        return _PropertyDict(self)
+
+def _build_column(values):
+    """
+    Converts a list of property values (``None`` for missing entries) to a typed column -- see ``Ensemble.get_column()``.
+
+    Returns:
+        ``np.ndarray`` of values, boolean ``np.ndarray`` which is ``True`` for missing entries,
+        and whether the column's entries are the same numbers and types as the original values (so they can be handed back directly)
+    """
+    missing = np.array([v is None for v in values], dtype=bool)
+    present = [v for v in values if v is not None]
+
+    if all(isinstance(v, (bool, np.bool_)) for v in present) and len(present) == len(values) and len(values):
+        return np.array(values, dtype=bool), missing, True
+
+    if all(isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, (bool, np.bool_)) for v in present):
+        if len(present) == len(values) and all(isinstance(v, (int, np.integer)) for v in present):
+            try:
+                return np.array(values, dtype=np.int64), missing, True
+            except OverflowError:
+                pass
+        column = np.full(len(values), np.nan)
+        column[~missing] = present
+        return column, missing, all(isinstance(v, (float, np.float64)) for v in present)
+
+    #### fixed-shape numeric arrays
+    if len(present) and all(isinstance(v, (np.ndarray, list, tuple)) for v in present):
+        try:
+            arrays = [np.asarray(v, dtype=np.float64) for v in present]
+            if len(set(a.shape for a in arrays)) == 1 and arrays[0].ndim > 0:
+                column = np.full((len(values), *arrays[0].shape), np.nan)
+                column[~missing] = arrays
+                return column, missing, False
+        except (ValueError, TypeError):
+            pass
+
+    column = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        column[i] = v
+    return column, missing, True
 
 class ConformationalEnsemble(Ensemble):
     """
     Class that representing a group of conformers. All members must have the same atom types in the same order.
+
+    If ``contiguous`` is ``True``, every geometry is stored in one ``(n_conformers, n_atoms, 3)`` array,
+    and the ``geometry`` of each member ``Molecule`` is a view into that array. This allows batched linear algebra over
+    the whole ensemble without stacking (see ``geometries()``). In-place edits to ``molecule.geometry`` are automatically shared;
+    if ``molecule.geometry`` is reassigned, the new coordinates are copied back into the shared array whenever it is accessed.
+
+    Attributes:
+        contiguous (bool): whether geometries are stored in one shared array
+        _geometry_array (np.ndarray): shared coordinate storage, shape ``(capacity, n_atoms, 3)`` (only if ``contiguous``)
+        _geometry_views (list): the view of ``_geometry_array`` given to each molecule, in order (only if ``contiguous``)
+        _symmetry_classes (dict): cached classes of symmetry-equivalent comparison atoms and the bonds between them, keyed by comparison atoms and bonds
     """
 
+    def __init__(self, name=None, contiguous=False):
+        """
+        Create new instance.
+
+        Args:
+            name (str): name of ConformationalEnsemble
+            contiguous (bool): whether to store all geometries in one shared array
+        """
+        super().__init__(name=name)
+        self.contiguous = contiguous
+        self._geometry_array = None
+        self._geometry_views = []
+        self._symmetry_classes = {}
+
     def __str__(self):
         n_atoms = 0
         if len(self._items) > 0:
-            first_molecule = self.molecule_list()[0]
+            first_molecule = self._molecules[0]
             n_atoms = first_molecule.num_atoms()
         if self.name is not None:
             return f"ConformationalEnsemble (name={self.name}, {len(self._items)} molecules, {n_atoms} atoms)"
@@ -366,8 +837,11 @@ class ConformationalEnsemble(Ensemble):
         """
         Checks that the molecule contains the same atom types in the same order as existing molecules, and that the molecule has the same charge/multiplicity.
         """
+        if copy:
+            molecule = deepcopy(molecule)
+
         if len(self._items) > 0:
-            initial_mol = self.molecule_list()[0]
+            initial_mol = self._molecules[0]
             if molecule.num_atoms() != initial_mol.num_atoms():
                 raise ValueError("wrong number of atoms for this ensemble")
 
@@ -384,29 +858,241 @@ class ConformationalEnsemble(Ensemble):
             molecule.bonds = initial_mol.bonds
             molecule.atomic_numbers = initial_mol.atomic_numbers
 
-        super().add_molecule(molecule, properties, copy)
+        already_present = molecule in self._items
+        super().add_molecule(molecule, properties)
+
+        if self.contiguous:
+            if already_present:
+                self.geometries()
+            else:
+                self._store_geometry(molecule)
+
+    def _store_geometry(self, molecule):
+        """
+        Copies the geometry of ``molecule`` into the next slot of the shared array and replaces it with a view.
+        The array is grown by doubling, so appends are amortized O(1).
+        """
+        n = len(self._geometry_views)
+        if self._geometry_array is None:
+            self._geometry_array = np.zeros(shape=(4, molecule.num_atoms(), 3), dtype=np.float32)
+        elif n == len(self._geometry_array):
+            self._resize_geometry_array(2 * n)
+
+        self._geometry_array[n] = molecule.geometry.view(np.ndarray)
+        view = self._geometry_array[n].view(cctk.OneIndexedArray)
+        molecule.geometry = view
+        self._geometry_views.append(view)
+
+    def _resize_geometry_array(self, capacity):
+        """
+        Moves the shared array to a new buffer with room for ``capacity`` geometries, re-pointing every molecule that still uses a view.
+        """
+        n = len(self._geometry_views)
+        assert capacity >= n, f"can't shrink geometry storage below {n} geometries"
+        new_array = np.zeros(shape=(capacity, *self._geometry_array.shape[1:]), dtype=np.float32)
+        new_array[:n] = self._geometry_array[:n]
+
+        for i, molecule in zip(range(n), self._molecules):
+            new_view = new_array[i].view(cctk.OneIndexedArray)
+            if molecule.geometry is self._geometry_views[i]:
+                molecule.geometry = new_view
+            self._geometry_views[i] = new_view
+
+        self._geometry_array = new_array
+
+    def _sync_geometries(self):
+        """
+        Copies geometries which are no longer views of the shared array (e.g. because ``molecule.geometry`` was reassigned) back into it.
+        """
+        for i, molecule in enumerate(self._molecules):
+            view = self._geometry_views[i]
+            if molecule.geometry is view and view.base is self._geometry_array:
+                continue
+
+            self._geometry_array[i] = molecule.geometry.view(np.ndarray)
+
+            #### our own view was detached from the buffer (e.g. by ``deepcopy``), so it's safe to reattach the molecule
+            if molecule.geometry is view:
+                view = self._geometry_array[i].view(cctk.OneIndexedArray)
+                molecule.geometry = view
+                self._geometry_views[i] = view
 
     @classmethod
     def join_ensembles(cls, ensembles, name=None, copy=False):
         """
         Creates a new ConformationalEnsemble object from existing ensembles.
-        Both molecules and properties are copied.
+
+        Compatibility is checked once per ensemble (against the first molecule of the first ensemble), not once per molecule,
+        and every molecule ends up sharing the bonds and atomic numbers of that first molecule.
+        Property dicts are shared with the original ensembles.
+
+        If ``copy`` is ``True``, new molecules are created from one concatenated coordinate array (which becomes the contiguous storage
+        of the new ensemble) instead of deep-copying each molecule; they share one new copy of the bonds and atomic numbers.
 
         Args:
             name (str): name of ConformationalEnsemble created
             ensembles (list of ConformationalEnsembles): ConformationalEnsemble objects to join
             copy (bool): whether to make copies of the component molecules
         """
-        new_ensemble = ConformationalEnsemble(name=name)
         for ensemble in ensembles:
             assert isinstance(ensemble, ConformationalEnsemble), "can't join an object that isn't a ConformationalEnsemble!"
+        ensembles = [ensemble for ensemble in ensembles if len(ensemble)]
+
+        new_ensemble = ConformationalEnsemble(name=name, contiguous=copy)
+        if len(ensembles) == 0:
+            return new_ensemble
 
+        initial_mol = ensembles[0]._molecules[0]
         for ensemble in ensembles:
-            for mol, prop in ensemble.items():
-                new_ensemble.add_molecule(mol, prop, copy)
+            molecule = ensemble._molecules[0]
+            if molecule.num_atoms() != initial_mol.num_atoms():
+                raise ValueError("wrong number of atoms for this ensemble")
+            if molecule.charge != initial_mol.charge:
+                raise ValueError("wrong charge for this ensemble")
+            if molecule.multiplicity != initial_mol.multiplicity:
+                raise ValueError("wrong spin multiplicity for this ensemble")
+            if not np.array_equal(molecule.atomic_numbers, initial_mol.atomic_numbers):
+                raise ValueError("wrong atom types for this ensemble")
+
+        properties = [p for ensemble in ensembles for p in ensemble.properties_list()]
+
+        if not copy:
+            molecules = [m for ensemble in ensembles for m in ensemble._molecules]
 
+            #### only save one copy to save space
+            for ensemble in ensembles:
+                if ensemble._molecules[0]._bond_backend() is not initial_mol._bond_backend() or ensemble._molecules[0].atomic_numbers is not initial_mol.atomic_numbers:
+                    for molecule in ensemble._molecules:
+                        molecule.bonds = initial_mol.bonds
+                        molecule.atomic_numbers = initial_mol.atomic_numbers
+
+            new_ensemble._extend(molecules, properties)
+            return new_ensemble
+
+        geometries = np.concatenate([ensemble.geometries() for ensemble in ensembles]).astype(np.float32, copy=False)
+        bonds = initial_mol.bonds.copy()
+        atomic_numbers = initial_mol.atomic_numbers.copy()
+        molecules = list()
+        for old_molecule, geometry in zip((m for ensemble in ensembles for m in ensemble._molecules), geometries):
+            molecule = cctk.Molecule(
+                atomic_numbers,
+                geometry,
+                name=old_molecule.name,
+                bonds=bonds,
+                charge=old_molecule.charge,
+                multiplicity=old_molecule.multiplicity,
+                checks=False,
+            )
+            molecule.geometry = geometry.view(cctk.OneIndexedArray)
+            molecule.atomic_numbers = atomic_numbers
+            if len(old_molecule.vibrational_modes):
+                molecule.vibrational_modes = deepcopy(old_molecule.vibrational_modes)
+            molecules.append(molecule)
+
+        new_ensemble._geometry_array = geometries
+        new_ensemble._geometry_views = [m.geometry for m in molecules]
+        new_ensemble._extend(molecules, properties)
         return new_ensemble
 
+    def _get_comparison_atoms(self, comparison_atoms):
+        """
+        Helper method which parses and validates ``comparison_atoms`` (``"heavy"``, ``"all"``, or a list of 1-indexed atom numbers).
+
+        Returns:
+            ``np.ndarray`` of 0-indexed atom numbers
+        """
+        n_atoms = self.molecules[0].num_atoms()
+        if isinstance(comparison_atoms, str):
+            if comparison_atoms == "all":
+                comparison_atoms = np.arange(1, n_atoms + 1)
+            elif comparison_atoms == "heavy":
+                comparison_atoms = self.molecules[0].get_heavy_atoms()
+        assert isinstance(comparison_atoms, (list, np.ndarray, cctk.OneIndexedArray)), f"unexpected type for comparison_atoms: {str(type(comparison_atoms))}"
+
+        comparison_atoms = np.array(comparison_atoms, dtype=int).ravel()
+        for a in comparison_atoms[(comparison_atoms < 1) | (comparison_atoms > n_atoms)]:
+            assert 1 <= a <= n_atoms, f"atom number out of range: got {a}, but must be between 1 and {n_atoms}"
+        assert len(comparison_atoms) >= 3, f"need at least 3 atoms for alignment, but only got {len(comparison_atoms)}"
+
+        return comparison_atoms - 1
+
+    def _get_symmetry_classes(self, comparison_atoms):
+        """
+        Helper method which returns the classes of symmetry-equivalent comparison atoms and the bonds between them (see ``cctk.topology.get_symmetry_classes()``).
+        These only depend on the shared bond graph, so they're computed once and cached.
+
+        Args:
+            comparison_atoms (np.ndarray): 0-indexed atom numbers
+
+        Returns:
+            list of ``np.ndarray`` positions in ``comparison_atoms``
+            ``np.ndarray`` of bonded pairs of positions in ``comparison_atoms``
+        """
+        molecule = self.molecules[0]
+        key = (tuple(comparison_atoms), frozenset(frozenset(edge) for edge in molecule.bonds.edges()))
+        if key not in self._symmetry_classes:
+            self._symmetry_classes[key] = cctk.topology.get_symmetry_classes(molecule, atoms=comparison_atoms + 1, return_bonds=True)
+        return self._symmetry_classes[key]
+
+    def _new_from_geometries(self, geometries, indices=None, share_properties=False):
+        """
+        Creates a new contiguous ``ConformationalEnsemble`` with new coordinates for (a subset of) the molecules in ``self``.
+        Atomic numbers, bonds, and vibrational modes are shared with the original molecules.
+
+        Args:
+            geometries (np.ndarray): new coordinates, shape ``(n_new, n_atoms, 3)``
+            indices (list): which molecules of ``self`` the new geometries belong to (defaults to all of them, in order)
+            share_properties (bool): whether to share the property dicts with ``self`` (otherwise, they're shallow copies)
+
+        Returns:
+            new ``ConformationalEnsemble``
+        """
+        molecules = self.molecule_list()
+        properties = self.properties_list()
+        if indices is None:
+            indices = range(len(molecules))
+        assert len(indices) == len(geometries), f"got {len(geometries)} geometries for {len(indices)} molecules"
+
+        new_ensemble = ConformationalEnsemble(name=self.name, contiguous=True)
+        new_ensemble._geometry_array = np.zeros(shape=(max(len(geometries), 1), *np.shape(geometries)[1:]), dtype=np.float32)
+
+        for i, geometry in zip(indices, geometries):
+            molecule = molecules[i]
+            new_molecule = cctk.Molecule(
+                molecule.atomic_numbers,
+                geometry,
+                name=molecule.name,
+                bonds=molecule.bonds,
+                charge=molecule.charge,
+                multiplicity=molecule.multiplicity,
+                checks=False,
+            )
+            new_molecule.vibrational_modes = list(molecule.vibrational_modes)
+            new_ensemble.add_molecule(new_molecule, properties[i] if share_properties else _PropertyDict(properties[i]), checks=False)
+
+        return new_ensemble
+
+    def _align_geometries(self, to_geometry, comparison_atoms):
+        """
+        Helper method which aligns the stacked coordinates of every conformer to conformer ``to_geometry``.
+
+        Args:
+            to_geometry (int): the reference geometry to align to (0-indexed)
+            comparison_atoms (np.ndarray): 0-indexed atom numbers to use when computing alignments
+
+        Returns:
+            centered geometries before rotation, aligned geometries (both ``np.ndarray`` of shape ``(n_conformers, n_atoms, 3)``)
+        """
+        # translate all molecules to the origin
+        # with respect to the comparison atoms
+        geometries = self.geometries().astype(np.float64)
+        geometries -= geometries[:, comparison_atoms].mean(axis=1, keepdims=True)
+
+        # perform alignment using Kabsch algorithm
+        partial_geometries = geometries[:, comparison_atoms]
+        rotations = compute_kabsch_rotations(partial_geometries, partial_geometries[int(to_geometry)])
+        return geometries, geometries @ rotations
+
     def align(self, to_geometry=0, comparison_atoms="heavy", compute_RMSD=False):
         """
         Aligns every geometry in this ensemble to the specified geometry,
@@ -417,6 +1103,9 @@ class ConformationalEnsemble(Ensemble):
         The current ensemble will not be altered.  RMSDs will be calculated over the
         comparison atoms only.
 
+        All conformers are aligned at once using the Kabsch algorithm over the stacked coordinates.
+        The new (contiguous) ensemble shares atomic numbers and bonds with this one.
+
         Args:
             to_geometry (int): the reference geometry to align to (0-indexed)
             comparison_atoms (str or list): which atoms to use when computing alignments
@@ -431,170 +1120,530 @@ class ConformationalEnsemble(Ensemble):
         """
         # check inputs
         self._check_molecule_number(to_geometry)
-        n_atoms = self.molecules[0].num_atoms()
-
-        if isinstance(comparison_atoms, str):
-            if comparison_atoms == "all":
-                comparison_atoms = np.arange(1, n_atoms + 1)
-            elif comparison_atoms == "heavy":
-                comparison_atoms = self.molecules[0].get_heavy_atoms()
-        assert isinstance(comparison_atoms, (list, np.ndarray, cctk.OneIndexedArray)), f"unexpected type for comparison_atoms: {str(type(comparison_atoms))}"
-        for a in comparison_atoms:
-            assert 1 <= a <= n_atoms, f"atom number out of range: got {a}, but must be between 1 and {n_atoms}"
-
-        assert len(comparison_atoms) >= 3, f"need at least 3 atoms for alignment, but only got {len(comparison_atoms)}"
+        comparison_atoms = self._get_comparison_atoms(comparison_atoms)
 
-        # duplicate the ensemble
-        new_ensemble = deepcopy(self)
-
-        # translate all molecules to the origin
-        # with respect to the comparison atoms
-        for molecule, _ in new_ensemble:
-            full_geometry = molecule.geometry
-            partial_geometry = full_geometry[comparison_atoms]
-            translation_vector = -partial_geometry.mean(axis=0)
-            molecule.translate_molecule(translation_vector)
-
-        full_template_geometry = new_ensemble.molecules[to_geometry].geometry
-        partial_template_geometry = full_template_geometry[comparison_atoms]
-        before_RMSDs = []
-        after_RMSDs = []
-
-        # perform alignment using Kabsch algorithm
-        for i, (molecule, _) in enumerate(new_ensemble):
-            full_geometry = molecule.geometry
-            partial_geometry = full_geometry[comparison_atoms]
-            if compute_RMSD:
-                before_RMSD = cctk.helper_functions.compute_RMSD(partial_template_geometry, partial_geometry)
-                before_RMSDs.append(before_RMSD)
-            new_geometry = align_matrices(partial_geometry, full_geometry, partial_template_geometry)
-            molecule.geometry = new_geometry
-            if compute_RMSD:
-                partial_geometry = new_geometry[comparison_atoms]
-                after_RMSD = cctk.helper_functions.compute_RMSD(partial_template_geometry, partial_geometry)
-                after_RMSDs.append(after_RMSD)
-            assert len(molecule.geometry) == n_atoms, f"wrong number of geometry elements! expected {n_atoms}, got {len(molecule.geometry)}"
+        geometries, new_geometries = self._align_geometries(to_geometry, comparison_atoms)
+        new_ensemble = self._new_from_geometries(new_geometries)
 
         if compute_RMSD:
-            return new_ensemble, before_RMSDs, after_RMSDs
+            partial_geometries = geometries[:, comparison_atoms]
+            partial_template_geometry = partial_geometries[int(to_geometry)]
+            before_RMSDs = compute_RMSDs(partial_geometries, partial_template_geometry)
+            after_RMSDs = compute_RMSDs(new_geometries[:, comparison_atoms], partial_template_geometry)
+            return new_ensemble, list(before_RMSDs), list(after_RMSDs)
         return new_ensemble
 
-    def eliminate_redundant(self, RMSD_cutoff=0.5, comparison_atoms="heavy", return_RMSD=False):
+    def eliminate_redundant(self, RMSD_cutoff=0.5, comparison_atoms="heavy", return_RMSD=False, energy_window=None, block_size=256, nprocs=1, symmetric=False):
         """
         Aligns every geometry in this ensemble and then creates a new ensemble that contains only the non-redundant conformers.
         If energies are available, the lowest energy conformer will be kept for every redundancy.
         The current ensemble will not be modified.  The resulting ensemble will be sorted by energy (if available).
 
+        Candidates are processed in blocks: each block is compared against every conformer kept so far in one array operation,
+        so the cost is dominated by matrix multiplication rather than by Python loops.
+
         Args:
             RMSD_cutoff (float): remove conformers that are more similar than this threshold
-            to_geometry (int): the reference geometry to align to (0-indexed)
             comparison_atoms (str or list): which atoms to use when computing alignments
                                             "heavy" for all non-hydrogen atoms,
                                             "all" for all atoms, or
                                             a list of 1-indexed atom numbers
             return_RMSD (bool): whether or not to return list of RMSD values
+            energy_window (float): if energies are available, conformers whose energies differ by more than this
+                                   (in the units of the ``energy`` property) are assumed to be distinct and never compared
+            block_size (int): number of candidates to compare against the kept conformers at once
+            nprocs (int): number of threads to split the comparisons over
+            symmetric (bool): whether to compare every pair of conformers after optimal superposition, exchanging
+                              symmetry-equivalent comparison atoms to lower the RMSD (so e.g. rotated methyl groups don't count as different)
 
         Returns:
-            new ``ConformationalEnsemble``, RMSDs to the reference geometry
+            new ``ConformationalEnsemble``, RMSDs to the previously kept conformer (if ``return_RMSD``)
         """
         # check inputs
-        n_atoms = self.molecules[0].num_atoms()
-        if isinstance(comparison_atoms, str):
-            if comparison_atoms == "all":
-                comparison_atoms = np.arange(1, n_atoms + 1)
-            elif comparison_atoms == "heavy":
-                comparison_atoms = self.molecules[0].get_heavy_atoms()
-
-        assert isinstance(comparison_atoms, (list, np.ndarray, cctk.OneIndexedArray)), f"unexpected type for comparison_atoms: {str(type(comparison_atoms))}"
-        for a in comparison_atoms:
-            assert 1 <= a <= n_atoms, f"atom number out of range: got {a}, but must be between 1 and {n_atoms}"
-        assert len(comparison_atoms) >= 3, f"need at least 3 atoms for alignment, but only got {len(comparison_atoms)}"
+        comparison_atoms = self._get_comparison_atoms(comparison_atoms)
 
         assert isinstance(RMSD_cutoff, (float, int)), f"RMSD cutoff must be a float but got {str(type(RMSD_cutoff))}"
         assert RMSD_cutoff > 0.0001, "must use a big enough RMSD cutoff"
+        assert isinstance(block_size, int) and block_size > 0, "block_size must be a positive integer"
+        assert isinstance(nprocs, int) and nprocs > 0, "nprocs must be a positive integer"
 
         # align all molecules
-        old_ensemble = self.align(to_geometry=0, comparison_atoms=comparison_atoms, compute_RMSD=False)
+        _, geometries = self._align_geometries(0, comparison_atoms)
 
         # sort molecules by energy if available
-        energies_available = True
-        for molecule,properties in old_ensemble.items():
-            if "energy" not in properties:
-                energies_available = False
-                break
-
-        n_molecules = len(old_ensemble)
-        sorted_indices = list(range(n_molecules))
+        properties = self.properties_list()
+        energies_available = all("energy" in p for p in properties)
+
+        n_molecules = len(geometries)
+        sorted_indices = np.arange(n_molecules)
+        energies = None
         if energies_available:
-            energies = old_ensemble[:,"energy"]
-            sorted_indices = list(np.argsort(energies))
+            energies = np.array([p["energy"] for p in properties], dtype=np.float64)
+            sorted_indices = np.argsort(energies, kind="stable")
+            energies = energies[sorted_indices]
+        elif energy_window is not None:
+            raise ValueError("can't use energy_window without energies for every conformer")
+
+        #### work with flattened partial geometries, so RMSD^2 = (|a|^2 + |b|^2 - 2 a.b) / n_atoms for every pair at once
+        n_comparison = len(comparison_atoms)
+        partial_geoms = geometries[sorted_indices][:, comparison_atoms].reshape(n_molecules, -1)
+        squared_norms = np.einsum("ij,ij->i", partial_geoms, partial_geoms)
+        cutoff = RMSD_cutoff ** 2 * n_comparison
+
+        # kept conformers are stored in a preallocated array
+        kept_geoms = np.zeros_like(partial_geoms)
+        kept_norms = np.zeros(n_molecules)
+        kept = list()
+        rmsds = list()
 
-        # boolean indexing noticeably faster
-        idxs = np.array(comparison_atoms)
-        mask = np.zeros(old_ensemble.molecules[0].geometry.shape[0], dtype=bool)
-        mask[idxs - 1] = True
+        symmetry_classes, bonds = self._get_symmetry_classes(comparison_atoms) if symmetric else (None, None)
 
-        partial_geoms = [m.geometry[mask] for m in old_ensemble.molecules]
-        new_partial_geoms = []
+        def _squared_distances(candidates, start, stop):
+            if symmetric:
+                candidate_geoms = partial_geoms[candidates].reshape(-1, n_comparison, 3)
+                rmsds = compute_pairwise_RMSDs(candidate_geoms, kept_geoms[start:stop].reshape(-1, n_comparison, 3), symmetry_classes=symmetry_classes, bonds=bonds)
+                return rmsds ** 2 * n_comparison
+            return squared_norms[candidates, np.newaxis] + kept_norms[np.newaxis, start:stop] - 2 * partial_geoms[candidates] @ kept_geoms[start:stop].T
 
-        rmsds = list()
+        def squared_distances(candidates, start, stop):
+            """ squared distances between candidates and kept conformers ``start:stop``, split over threads if worthwhile """
+            if executor is None or stop - start < 2 * block_size:
+                return _squared_distances(candidates, start, stop)
+            bounds = np.linspace(start, stop, nprocs + 1).astype(int)
+            chunks = executor.map(lambda b: _squared_distances(candidates, *b), zip(bounds[:-1], bounds[1:]))
+            return np.hstack(list(chunks))
 
-        # add molecules one by one
-        new_ensemble = ConformationalEnsemble()
-        for i in sorted_indices:
-            ok_to_add = True
+        executor = None
+        if nprocs > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=nprocs)
 
-            candidate_rmsd = 0
-            for existing_molecule in new_partial_geoms:
-                candidate_rmsd = cctk.helper_functions.compute_RMSD(partial_geoms[i], existing_molecule, checks=False)
-                if candidate_rmsd < RMSD_cutoff:
-                    ok_to_add = False
-                    break
+        try:
+            for block_start in range(0, n_molecules, block_size):
+                block = np.arange(block_start, min(block_start + block_size, n_molecules))
+
+                #### oldest kept conformer that is still within the energy window of the block
+                first = 0
+                if energy_window is not None:
+                    first = np.searchsorted(energies[kept], energies[block[0]] - energy_window, side="left")
+
+                n_kept_before = len(kept)
+                min_distances = np.full(len(block), np.inf)
+                if first < n_kept_before:
+                    d = squared_distances(block, first, n_kept_before)
+                    if energy_window is not None:
+                        d[energies[block, np.newaxis] - energies[np.newaxis, kept[first:]] > energy_window] = np.inf
+                    min_distances = d.min(axis=1)
+
+                # conformers kept within this block still have to be checked one by one
+                for i, min_distance in zip(block, min_distances):
+                    if min_distance < cutoff:
+                        continue
+
+                    n_new = len(kept) - n_kept_before
+                    if n_new:
+                        d = _squared_distances([i], n_kept_before, len(kept))[0]
+                        if energy_window is not None:
+                            d[energies[i] - energies[kept[n_kept_before:]] > energy_window] = np.inf
+                        if d.min() < cutoff:
+                            continue
+
+                    #### to match the sequential algorithm, report the RMSD to the most recently kept conformer
+                    if len(kept):
+                        rmsds.append(np.sqrt(max(_squared_distances([i], len(kept) - 1, len(kept))[0, 0], 0) / n_comparison))
+                    else:
+                        rmsds.append(0)
 
-            if ok_to_add:
-                candidate_molecule = old_ensemble.molecules[i]
-                candidate_molecule_properties = old_ensemble.get_properties_dict(candidate_molecule)
+                    kept_geoms[len(kept)] = partial_geoms[i]
+                    kept_norms[len(kept)] = squared_norms[i]
+                    kept.append(i)
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
-                new_ensemble.add_molecule(candidate_molecule, candidate_molecule_properties)
-                new_partial_geoms.append(candidate_molecule.geometry[mask])
-                rmsds.append(candidate_rmsd)
+        kept_indices = sorted_indices[kept]
+        #### unique conformers keep the same property dicts as in ``self``
+        new_ensemble = self._new_from_geometries(geometries[kept_indices], indices=kept_indices, share_properties=True)
 
         if return_RMSD:
             return new_ensemble, rmsds
         else:
             return new_ensemble
 
-    def get_geometric_parameters(self, parameter, atom1, atom2, atom3=None, atom4=None):
+    def rmsd_matrix(self, comparison_atoms="heavy", aligned=True, block_size=512, nprocs=1, symmetric=False):
+        """
+        Computes the RMSD between every pair of conformers.
+
+        The matrix is computed in ``block_size`` x ``block_size`` tiles, so memory use is bounded no matter how big the ensemble is.
+        Tiles can be spread over several processes.
+
+        Args:
+            comparison_atoms (str or list): which atoms to use when computing RMSDs
+                                            "heavy" for all non-hydrogen atoms,
+                                            "all" for all atoms, or
+                                            a list of 1-indexed atom numbers
+            aligned (bool): whether to compute RMSDs after optimal superposition of each pair (otherwise, current coordinates are compared)
+            block_size (int): number of conformers per tile
+            nprocs (int): number of processes to spread tiles over
+            symmetric (bool): whether to exchange symmetry-equivalent comparison atoms to lower the RMSD
+
+        Returns:
+            condensed ``np.ndarray`` (float32) of length ``n * (n - 1) / 2``, in the same order as ``scipy.spatial.distance.pdist``
+            (use ``scipy.spatial.distance.squareform`` to get the square matrix)
+        """
+        comparison_atoms = self._get_comparison_atoms(comparison_atoms)
+        assert isinstance(block_size, int) and block_size > 0, "block_size must be a positive integer"
+        assert isinstance(nprocs, int) and nprocs > 0, "nprocs must be a positive integer"
+
+        geometries = self.geometries()[:, comparison_atoms]
+        n = len(geometries)
+        condensed = np.zeros(n * (n - 1) // 2, dtype=np.float32)
+
+        symmetry_classes, bonds = self._get_symmetry_classes(comparison_atoms) if symmetric else (None, None)
+        for (i, j), rmsds in _rmsd_tiles(geometries, aligned, block_size, nprocs, symmetry_classes, bonds):
+            #### row r of the condensed matrix starts at n*r - r*(r+1)/2 and holds columns r+1 through n-1
+            for r in range(i, min(i + block_size, n)):
+                first_column = max(j, r + 1)
+                last_column = min(j + block_size, n)
+                if first_column >= last_column:
+                    continue
+                offset = n * r - r * (r + 1) // 2 - r - 1
+                condensed[offset + first_column:offset + last_column] = rmsds[r - i, first_column - j:last_column - j]
+
+        return condensed
+
+    def rmsd_neighbors(self, cutoff, comparison_atoms="heavy", aligned=True, block_size=512, nprocs=1, symmetric=False):
+        """
+        Finds every pair of conformers closer than ``cutoff``.
+
+        RMSDs are computed in tiles as in ``rmsd_matrix()``, but only pairs within the cutoff are kept,
+        so memory use scales with the number of neighbors rather than with the square of the ensemble size.
+
+        Args:
+            cutoff (float): RMSD cutoff
+            comparison_atoms (str or list): which atoms to use when computing RMSDs
+                                            "heavy" for all non-hydrogen atoms,
+                                            "all" for all atoms, or
+                                            a list of 1-indexed atom numbers
+            aligned (bool): whether to compute RMSDs after optimal superposition of each pair
+            block_size (int): number of conformers per tile
+            nprocs (int): number of processes to spread tiles over
+            symmetric (bool): whether to exchange symmetry-equivalent comparison atoms to lower the RMSD
+
+        Returns:
+            symmetric ``scipy.sparse.csr_matrix`` of shape ``(n, n)`` holding the RMSDs of neighboring pairs (the diagonal is not stored)
+        """
+        comparison_atoms = self._get_comparison_atoms(comparison_atoms)
+        assert isinstance(cutoff, (float, int)) and cutoff > 0, "cutoff must be a positive number"
+        assert isinstance(block_size, int) and block_size > 0, "block_size must be a positive integer"
+        assert isinstance(nprocs, int) and nprocs > 0, "nprocs must be a positive integer"
+
+        geometries = self.geometries()[:, comparison_atoms]
+        n = len(geometries)
+
+        rows, columns, values = list(), list(), list()
+        symmetry_classes, bonds = self._get_symmetry_classes(comparison_atoms) if symmetric else (None, None)
+        for (i, j), rmsds in _rmsd_tiles(geometries, aligned, block_size, nprocs, symmetry_classes, bonds):
+            r, c = np.nonzero(rmsds < cutoff)
+            r, c = r + i, c + j
+            upper = r < c
+            rows.append(r[upper])
+            columns.append(c[upper])
+            values.append(rmsds[r[upper] - i, c[upper] - j].astype(np.float32))
+
+        rows = np.concatenate(rows + [np.zeros(0, dtype=int)])
+        columns = np.concatenate(columns + [np.zeros(0, dtype=int)])
+        values = np.concatenate(values + [np.zeros(0, dtype=np.float32)])
+
+        return scipy.sparse.csr_matrix(
+            (np.concatenate([values, values]), (np.concatenate([rows, columns]), np.concatenate([columns, rows]))),
+            shape=(n, n),
+        )
+
+    def cluster(self, cutoff=0.5, method="butina", comparison_atoms="heavy", temp=298, energy_unit="hartree", block_size=512, nprocs=1, symmetric=False, return_labels=False):
+        """
+        Clusters the conformers in this ensemble by RMSD and returns a new ensemble of cluster centroids.
+
+        Two methods are available:
+            - ``butina``: Taylor–Butina clustering. Conformers are ranked once by their number of neighbors within ``cutoff``;
+                          in that order, each conformer not yet assigned becomes a centroid, and its unassigned neighbors join its cluster.
+            - ``average``: average-linkage hierarchical clustering, stopping once no two clusters are closer than ``cutoff`` on average.
+                           The centroid is the member with the lowest summed RMSD to the rest of its cluster.
+
+        Only pairs closer than ``cutoff`` are ever stored (see ``rmsd_neighbors()``), so no dense matrix is built.
+        For average linkage, pairs that are not neighbors are counted as being exactly ``cutoff`` apart,
+        which gives the same clusters as a dense calculation whenever no missing pair would have been needed to resolve a merge.
+
+        Each centroid keeps its own properties, plus ``cluster_size`` and ``boltzmann_population``
+        (the summed Boltzmann weight of the cluster members, or the fraction of members if energies are not available).
+
+        Args:
+            cutoff (float): RMSD cutoff
+            method (str): ``butina`` or ``average``
+            comparison_atoms (str or list): which atoms to use when computing RMSDs
+                                            "heavy" for all non-hydrogen atoms,
+                                            "all" for all atoms, or
+                                            a list of 1-indexed atom numbers
+            temp (float): temperature for Boltzmann-weighting, in K
+            energy_unit (str): either ``kcal_mol`` or ``hartree``
+            block_size (int): number of conformers per tile when computing RMSDs
+            nprocs (int): number of processes to spread RMSD tiles over
+            symmetric (bool): whether to exchange symmetry-equivalent comparison atoms to lower the RMSD
+            return_labels (bool): whether to also return the index of the cluster each conformer belongs to
+
+        Returns:
+            new ``ConformationalEnsemble`` of centroids, sorted by cluster size (and cluster labels, if ``return_labels``)
+        """
+        assert method in ["butina", "average"], f"unknown clustering method {method}"
+        neighbors = self.rmsd_neighbors(cutoff, comparison_atoms=comparison_atoms, block_size=block_size, nprocs=nprocs, symmetric=symmetric)
+
+        if method == "butina":
+            centroids, labels = _butina_clustering(neighbors)
+        else:
+            centroids, labels = _average_linkage_clustering(neighbors, cutoff)
+
+        # population of each cluster
+        if not np.any(self.get_column("energy")[1]):
+            weights = self.boltzmann_weights(temps=temp, energy_unit=energy_unit)
+        else:
+            weights = np.ones(len(self))
+        populations = np.bincount(labels, weights=weights) / np.sum(weights)
+        sizes = np.bincount(labels)
+
+        #### relabel so that the biggest clusters come first
+        order = np.argsort(-sizes, kind="stable")
+        centroids, sizes, populations = centroids[order], sizes[order], populations[order]
+        labels = np.argsort(order)[labels]
+
+        new_ensemble = self._new_from_geometries(self.geometries()[centroids], indices=centroids)
+        for (molecule, new_properties), size, population in zip(new_ensemble.items(), sizes, populations):
+            new_properties["cluster_size"] = int(size)
+            new_properties["boltzmann_population"] = float(population)
+
+        if return_labels:
+            return new_ensemble, labels
+        else:
+            return new_ensemble
+
+    def get_geometric_parameters(self, parameter, atom1=None, atom2=None, atom3=None, atom4=None):
         """
         Computes and outputs geometric parameters (bond distances, angles, or dihedral angles) for every member of ``self.molecules.``
 
+        Everything is computed over the stacked coordinates of the ensemble, so any number of parameters can be requested in one call.
+        To do so, pass a list of parameters, each given as a tuple like ``("distance", 1, 2)`` or simply ``(1, 2)``.
+        Tuples without a name are interpreted by length: 2 atoms for a distance, 3 for an angle, and 4 for a dihedral angle.
+
         Args:
-            parameter (str): one of ``angle``, ``distance``, or ``dihedral``
+            parameter (str or list): one of ``angle``, ``distance``, or ``dihedral``, or a list of parameter tuples (see above)
             atom1 (int): number of the atom in question
             atom2 (int): same, but for the second atom
             atom3 (int): same, but for the third atom (only required for parameter ``angle`` or ``dihedral``)
             atom4 (int): same, but for the fourth atom (only required for parameter ``dihedral``)
 
         Returns:
-            a list of the specified parameter's values for each geometry
-        """
-        output = [None] * len(self)
-        for index, molecule in enumerate(self.molecule_list()):
-            if parameter == "distance":
-                output[index] = molecule.get_distance(atom1, atom2)
-            elif parameter == "angle":
-                if atom3 is None:
-                    raise ValueError("need atom3 to calculate angle!")
-                output[index] = molecule.get_angle(atom1, atom2, atom3)
-            elif parameter == "dihedral":
-                if (atom3 is None) or (atom4 is None):
-                    raise ValueError("need atom3 and atom4 to calculate dihedral!")
-                output[index] = molecule.get_dihedral(atom1, atom2, atom3, atom4)
-            else:
+            a list of the specified parameter's values for each geometry, or
+            an ``np.ndarray`` of shape ``(n_conformers, n_parameters)`` if a list of parameters was given
+        """
+        widths = {"distance": 2, "angle": 3, "dihedral": 4}
+
+        if isinstance(parameter, str):
+            if parameter not in widths:
                 raise ValueError(f"Invalid parameter {parameter}!")
+            if parameter == "angle" and atom3 is None:
+                raise ValueError("need atom3 to calculate angle!")
+            if parameter == "dihedral" and ((atom3 is None) or (atom4 is None)):
+                raise ValueError("need atom3 and atom4 to calculate dihedral!")
+            atoms = [atom1, atom2, atom3, atom4][:widths[parameter]]
+            return list(self.get_geometric_parameters([(parameter, *atoms)])[:, 0])
+
+        assert isinstance(parameter, (list, tuple, np.ndarray)), f"parameter must be a string or a list of parameters, not {type(parameter)}"
+
+        #### group parameters by type so that each type only needs one vectorized call
+        groups = {2: ([], []), 3: ([], []), 4: ([], [])}
+        for column, p in enumerate(parameter):
+            p = list(p)
+            if len(p) and isinstance(p[0], str):
+                if p[0] not in widths:
+                    raise ValueError(f"Invalid parameter {p[0]}!")
+                if len(p) - 1 != widths[p[0]]:
+                    raise ValueError(f"parameter {p[0]} needs {widths[p[0]]} atoms, but got {len(p) - 1}")
+                p = p[1:]
+            if len(p) not in groups:
+                raise ValueError(f"can't interpret parameter with {len(p)} atoms: need 2, 3, or 4")
+            groups[len(p)][0].append(column)
+            groups[len(p)][1].append(p)
+
+        output = np.zeros(shape=(len(self), len(parameter)), dtype=np.float64)
+        if len(self) == 0:
+            return output
+
+        geometries = self.geometries()
+        first_molecule = self.molecules[0]
+        for width, (columns, atoms) in groups.items():
+            if len(columns):
+                indices = first_molecule._atom_index_array(atoms, width)
+                output[:, columns] = compute_internal_coordinates(geometries, indices)
 
         return output
 
+    def geometries(self):
+        """
+        Returns the coordinates of every conformer as one array.
+
+        If the ensemble is ``contiguous``, this is a view of the shared storage (so writing to it moves the molecules);
+        otherwise it is a newly stacked copy.
+
+        Returns:
+            ``np.ndarray`` of shape ``(n_conformers, n_atoms, 3)``
+        """
+        if len(self._items) == 0:
+            return np.zeros(shape=(0, 0, 3), dtype=np.float32)
+
+        if self.contiguous:
+            self._sync_geometries()
+            return self._geometry_array[:len(self._geometry_views)]
+
+        return np.stack([m.geometry.view(np.ndarray) for m in self._molecules])
+
+    def get_distances(self, atoms):
+        """
+        Computes many distances for every conformer at once.
+
+        Args:
+            atoms (np.ndarray): 1-indexed atom numbers, shape ``(k, 2)``
+
+        Returns:
+            ``np.ndarray`` of distances in Angstroms, shape ``(n_conformers, k)``
+        """
+        return compute_internal_coordinates(self.geometries(), self.molecules[0]._atom_index_array(atoms, 2))
+
+    def get_angles(self, atoms):
+        """
+        Computes many angles for every conformer at once.
+
+        Args:
+            atoms (np.ndarray): 1-indexed atom numbers, shape ``(k, 3)``
+
+        Returns:
+            ``np.ndarray`` of angles in degrees, shape ``(n_conformers, k)``
+        """
+        return compute_internal_coordinates(self.geometries(), self.molecules[0]._atom_index_array(atoms, 3))
+
+    def get_dihedrals(self, atoms):
+        """
+        Computes many dihedral angles for every conformer at once.
+
+        Args:
+            atoms (np.ndarray): 1-indexed atom numbers, shape ``(k, 4)``
+
+        Returns:
+            ``np.ndarray`` of dihedral angles in degrees, shape ``(n_conformers, k)``
+        """
+        return compute_internal_coordinates(self.geometries(), self.molecules[0]._atom_index_array(atoms, 4))
+
+    def volumes(self, pts_per_angstrom=10, nprocs=1):
+        """
+        Computes the Gavezotti volume of every conformer (see ``Molecule.volume()``).
+
+        Radii are looked up once for the shared topology, and conformers are spread over ``nprocs`` threads
+        (``compute_grid_volume()`` does its work in whole-array numpy operations, which release the GIL).
+
+        Args:
+            pts_per_angstrom (int): how many grid points to use per Å
+            nprocs (int): number of threads to use
+
+        Returns:
+            ``np.ndarray`` of volumes in Å**3, shape ``(n_conformers,)``
+        """
+        assert isinstance(nprocs, int) and nprocs > 0, "nprocs must be a positive integer"
+        if len(self) == 0:
+            return np.zeros(shape=0)
+
+        vdw_radii = {z: get_vdw_radius(z) for z in set(self.molecules[0].atomic_numbers)}
+        radii = np.array([vdw_radii[z] for z in self.molecules[0].atomic_numbers])
+
+        def volume(geometry):
+            return compute_grid_volume(geometry, radii, pts_per_angstrom=pts_per_angstrom)
+
+        geometries = self.geometries()
+        if nprocs > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=nprocs) as executor:
+                return np.array(list(executor.map(volume, geometries)))
+        return np.array([volume(g) for g in geometries])
+
+    def center_periodic(self, center, side_length, unwrap=True):
+        """
+        Applies ``Molecule.center_periodic()`` to every frame in place -- for instance, to post-process an MD trajectory.
+
+        All frames share one topology, so the fragment labels (and the spanning tree used for unwrapping) are computed once, and every frame is wrapped in one array operation.
+
+        Args:
+            center (int): atomic number to center
+            side_length (float or np.ndarray): length of side, in Å -- or the three side lengths of an orthorhombic box, or a 3x3 matrix of box vectors
+            unwrap (bool): whether to first rejoin fragments that are split across the box boundary
+
+        Returns:
+            self
+        """
+        if len(self) == 0:
+            return self
+
+        template = self._molecules[0]
+        template._check_atom_number(center)
+        if isinstance(side_length, (int, float)):
+            assert side_length > 0
+
+        labels = template._get_component_labels()
+        tree = template._get_bond_tree() if unwrap else None
+        new_geometries = compute_periodic_centering(self.geometries(), labels, side_length, center - 1, tree=tree)
+
+        for molecule, geometry in zip(self._molecules, new_geometries):
+            molecule.geometry.view(np.ndarray)[:] = geometry
+
+        return self
+
+    def limit_solvent_shell(self, solute=0, num_atoms=0, num_solvents=10, distance_from_atom=None, return_idxs=False):
+        """
+        Applies ``Molecule.limit_solvent_shell()`` to every frame -- for instance, to extract solvation shells from an MD trajectory.
+
+        All frames share one topology, so the solvent fragments are detected only once (from the first frame) and reused.
+        Since each frame keeps different solvent molecules, the result is a plain ``Ensemble``.
+
+        Args:
+            solute (int): which fragment is the solute, 0-indexed
+            num_atoms (int): remove atoms until there are this number (modulo the size of a solvent molecule)
+            num_solvents (int): remove solvent molecules until there are this number
+            distance_from_atom (int): if you want to find molecules closest to a given atom in the solute, specify the atom number here.
+            return_idxs (bool): if True, the indices of atoms kept in each frame are returned instead
+
+        Returns:
+            new ``Ensemble`` object, with the properties of each frame copied over (or a list of lists of atom indices, if ``return_idxs`` is True)
+        """
+        assert isinstance(num_atoms, int)
+        assert isinstance(num_solvents, int)
+        if len(self) == 0:
+            return [] if return_idxs else Ensemble(name=self.name)
+
+        template = self._molecules[0]
+        assert template._bond_backend().number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
+
+        labels = template._get_component_labels()
+        if distance_from_atom:
+            template._check_atom_number(distance_from_atom)
+            assert labels[distance_from_atom - 1] == solute, f"{distance_from_atom} is not in the solute fragment"
+
+        all_idxs = list()
+        for geometry in self.geometries():
+            keep = template._solvent_shell_mask(geometry, labels, solute=solute, num_atoms=num_atoms, num_solvents=num_solvents, distance_from_atom=distance_from_atom)
+            all_idxs.append(np.flatnonzero(keep) + 1)
+
+        if return_idxs:
+            return [idxs.tolist() for idxs in all_idxs]
+
+        ensemble = Ensemble(name=self.name)
+        for molecule, idxs in zip(self._molecules, all_idxs):
+            ensemble.add_molecule(molecule._slice_atoms(idxs), properties=dict(self._items[molecule]))
+        return ensemble
+
     def assign_connectivity(self, index=0):
         """
         Assigns connectivity for all molecules based on molecule of index ``index``. Much faster than assigning connectivity for each individually -- but assumes all bonding is the same.
@@ -607,40 +1656,51 @@ class ConformationalEnsemble(Ensemble):
 
         return self
 
-    def boltzmann_average(self, which, energies=None, temp=298, energy_unit="hartree", return_weights=False):
+    def compact_bonds(self):
         """
-        Computes the Boltzmann-weighted average of a property over the whole ensemble.
+        Switches every conformer to one shared compact ``BondGraph`` (see ``Molecule.compact_bonds()``), which makes large ensembles much cheaper to store and pickle.
+
+        Returns:
+            self
+        """
+        if len(self) == 0:
+            return self
+
+        bond_graph = BondGraph.from_networkx(self._molecules[0].bonds, self._molecules[0].num_atoms())
+        for molecule in self._molecules:
+            molecule.bonds = bond_graph
+
+        return self
+
+    def boltzmann_weights(self, energies=None, temps=298, energy_unit="hartree"):
+        """
+        Computes Boltzmann weights for every conformer, at one or many temperatures at once.
 
         Args:
-            which (str): which property to compute
-            energy (np.ndarray): list of energies to use for weighting.
-                Will default to ``self[:,"energy"]``, although other strings can be passed as well as shorthand for ``self[:,energy]``.
-            temp (float): temperature for Boltzmann-weighting, in K
+            energies (str or np.ndarray): energies to use for weighting.
+                Will default to the ``energy`` property; other property names or an array of energies can be passed too.
+            temps (float or list): temperature(s) for Boltzmann-weighting, in K
             energy_unit (str): either ``kcal_mol`` or ``hartree``
-            return_weights (bool): whether to return a list of weights too
 
         Returns:
-            weighted property, of the same shape as the individual property
+            normalized weights: ``np.ndarray`` of shape ``(n_conformers,)`` for a single temperature, or ``(n_temps, n_conformers)`` for a list
         """
         if energies is None:
-            energies = self[:,"energy"]
-        elif isinstance(energies, str):
-            energies = self[:,energies]
+            energies = "energy"
+
+        if isinstance(energies, str):
+            energies, missing = self.get_column(energies)
+            assert not np.any(missing), "energy not defined for all molecules"
         elif isinstance(energies, (list, np.ndarray, cctk.OneIndexedArray)):
-            pass
+            assert all([e is not None for e in energies]), "energy not defined for all molecules"
         else:
             raise ValueError(f"invalid energy value {energies} (type {type(energies)})")
 
-        for i, (m, pd) in enumerate(self.items()):
-            assert which in pd, f"molecule #{i} doesn't have property {which} defined!"
-
-        values = np.array(self[:,which], dtype=np.float64)
         energies = np.array(energies, dtype=np.float64)
+        assert energies.shape == (len(self),), f"expected {len(self)} energies, got shape {energies.shape}"
 
-        assert len(energies) == len(self)
-        assert len(values) == len(self)
-        assert all([e is not None for e in energies]), "energy not defined for all molecules"
-        assert all([v is not None for v in values]), f"property {which} not defined for all molecules"
+        temps = np.asarray(temps, dtype=np.float64)
+        assert np.all(temps > 0), "temperatures must be positive"
 
         # perhaps at some point we will need a real unit system like simtk/OpenMM, but not today!
         if energy_unit == "kcal_mol":
@@ -649,15 +1709,199 @@ class ConformationalEnsemble(Ensemble):
 
         R = 3.1668105e-6 # eH/K
 
-        weights = np.exp(-1*energies/(R*temp))
-        weights = weights / np.sum(weights)
+        weights = np.exp(-1 * energies / (R * temps[..., np.newaxis]))
+        return weights / np.sum(weights, axis=-1, keepdims=True)
 
-        try:
-            weighted_value = np.average(values, weights=weights)
-        except Exception as e:
-            raise ValueError(f"error computing Boltzmann average: {e}")
+    def boltzmann_averages(self, which, energies=None, temps=298, energy_unit="hartree", return_weights=False):
+        """
+        Computes Boltzmann-weighted averages of many properties, at one or many temperatures, with a single weight matrix.
+
+        Properties can be scalars or arrays of the same shape for every conformer (e.g. ``isotropic_shielding``);
+        each average is one tensor contraction of the weight matrix with the stacked property values.
+
+        Args:
+            which (str or list): which properties to average
+            energies (str or np.ndarray): energies to use for weighting (see ``boltzmann_weights()``)
+            temps (float or list): temperature(s) for Boltzmann-weighting, in K
+            energy_unit (str): either ``kcal_mol`` or ``hartree``
+            return_weights (bool): whether to return the weights too
+
+        Returns:
+            dict mapping each property name to its average, of shape ``(n_temps, *property_shape)`` if a list of temperatures was given
+            (or ``property_shape`` otherwise), and optionally the weights
+        """
+        if isinstance(which, str):
+            which = [which]
+
+        weights = self.boltzmann_weights(energies=energies, temps=temps, energy_unit=energy_unit)
+
+        averages = dict()
+        for name in which:
+            values, missing = self.get_column(name)
+            assert not np.any(missing), f"molecule #{np.argmax(missing)} doesn't have property {name} defined!"
+            try:
+                values = np.asarray(values, dtype=np.float64)
+            except (ValueError, TypeError) as e:
+                raise ValueError(f"error computing Boltzmann average: property {name} must be numeric with the same shape for every molecule ({e})")
+            averages[name] = np.tensordot(weights, values, axes=(-1, 0))
+
+        if return_weights:
+            return averages, weights
+        else:
+            return averages
+
+    def boltzmann_average(self, which, energies=None, temp=298, energy_unit="hartree", return_weights=False):
+        """
+        Computes the Boltzmann-weighted average of a property over the whole ensemble.
+        To average several properties or use several temperatures, ``boltzmann_averages()`` is faster.
+
+        Args:
+            which (str): which property to compute
+            energy (np.ndarray): list of energies to use for weighting.
+                Will default to ``self[:,"energy"]``, although other strings can be passed as well as shorthand for ``self[:,energy]``.
+            temp (float): temperature for Boltzmann-weighting, in K
+            energy_unit (str): either ``kcal_mol`` or ``hartree``
+            return_weights (bool): whether to return a list of weights too
+
+        Returns:
+            weighted property, of the same shape as the individual property
+        """
+        averages, weights = self.boltzmann_averages(which, energies=energies, temps=temp, energy_unit=energy_unit, return_weights=True)
 
+        #### unwrap 0-d arrays, so scalar properties give scalars
+        average = averages[which][()]
         if return_weights:
-            return weighted_value, weights
+            return average, weights
         else:
-            return weighted_value
+            return average
+
+
+def _rmsd_tiles(geometries, aligned, block_size, nprocs, symmetry_classes=None, bonds=None):
+    """
+    Generator yielding RMSDs between all pairs of geometries, one upper-triangular tile at a time.
+
+    Args:
+        geometries (np.ndarray): shape ``(n, n_atoms, 3)``
+        aligned (bool): whether to compute RMSDs after optimal superposition
+        block_size (int): tile size
+        nprocs (int): number of processes to spread tiles over
+        symmetry_classes (list): optional classes of interchangeable atoms (see ``compute_pairwise_RMSDs()``)
+        bonds (np.ndarray): bonded pairs of atoms, needed with ``symmetry_classes``
+
+    Returns:
+        ``((i, j), rmsds)`` for each tile, where ``rmsds[a, b]`` is the RMSD between geometries ``i + a`` and ``j + b``
+    """
+    starts = range(0, len(geometries), block_size)
+    tiles = [(i, j) for i in starts for j in starts if j >= i]
+
+    if nprocs == 1:
+        for i, j in tiles:
+            yield (i, j), compute_pairwise_RMSDs(geometries[i:i + block_size], geometries[j:j + block_size], align=aligned, symmetry_classes=symmetry_classes, bonds=bonds)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nprocs) as executor:
+            futures = {
+                executor.submit(compute_pairwise_RMSDs, geometries[i:i + block_size], geometries[j:j + block_size], aligned, symmetry_classes, bonds): (i, j)
+                for i, j in tiles
+            }
+            for future in concurrent.futures.as_completed(futures):
+                #### drop finished tiles so results don't pile up in memory
+                yield futures.pop(future), future.result()
+
+def _butina_clustering(neighbors):
+    """
+    Taylor–Butina clustering (*J. Chem. Inf. Comput. Sci.* 1999, 39, 747).
+    As in the original algorithm, candidates are ranked by their total number of neighbors, which isn't updated as neighbors get assigned.
+
+    Args:
+        neighbors (scipy.sparse.csr_matrix): symmetric neighbor matrix
+
+    Returns:
+        array of centroid indices, array of cluster labels (one per item)
+    """
+    n = neighbors.shape[0]
+    indptr, indices = neighbors.indptr, neighbors.indices
+
+    #### most neighbors first; ties broken by original order
+    order = np.argsort(-np.diff(indptr), kind="stable")
+
+    labels = np.full(n, -1, dtype=int)
+    centroids = list()
+    for i in order:
+        if labels[i] >= 0:
+            continue
+        members = indices[indptr[i]:indptr[i+1]]
+        members = members[labels[members] < 0]
+        labels[members] = len(centroids)
+        labels[i] = len(centroids)
+        centroids.append(i)
+
+    return np.array(centroids, dtype=int), labels
+
+def _average_linkage_clustering(neighbors, cutoff):
+    """
+    Average-linkage (UPGMA) agglomerative clustering on a sparse neighbor matrix.
+    Pairs not present in ``neighbors`` are treated as being ``cutoff`` apart; merging stops once no two clusters are closer than ``cutoff``.
+
+    Args:
+        neighbors (scipy.sparse.csr_matrix): symmetric neighbor matrix with RMSDs
+        cutoff (float): distance cutoff
+
+    Returns:
+        array of centroid (medoid) indices, array of cluster labels (one per item), sorted by decreasing cluster size
+    """
+    n = neighbors.shape[0]
+    neighbors = neighbors.tocoo()
+
+    #### links[a][b] = [sum of known distances, number of known pairs] between clusters a and b
+    links = {i: dict() for i in range(n)}
+    for a, b, d in zip(neighbors.row, neighbors.col, neighbors.data):
+        links[int(a)][int(b)] = [float(d), 1]
+    members = {i: [i] for i in range(n)}
+
+    def average(a, b):
+        total, known = links[a][b]
+        n_pairs = len(members[a]) * len(members[b])
+        return (total + (n_pairs - known) * cutoff) / n_pairs
+
+    heap = [(average(a, b), a, b) for a in links for b in links[a] if a < b]
+    heapq.heapify(heap)
+
+    next_cluster = n
+    while heap:
+        distance, a, b = heapq.heappop(heap)
+        if distance >= cutoff:
+            break
+        #### skip stale entries (one of the clusters has since been merged)
+        if a not in members or b not in members:
+            continue
+
+        c = next_cluster
+        next_cluster += 1
+        members[c] = members.pop(a) + members.pop(b)
+        links[c] = dict()
+        for old in (a, b):
+            for other, (total, known) in links.pop(old).items():
+                if other in (a, b):
+                    continue
+                link = links[c].setdefault(other, [0.0, 0])
+                link[0] += total
+                link[1] += known
+                del links[other][old]
+        for other, link in links[c].items():
+            links[other][c] = link
+            heapq.heappush(heap, (average(c, other), min(c, other), max(c, other)))
+
+    clusters = sorted(members.values(), key=lambda m: (-len(m), min(m)))
+    labels = np.zeros(n, dtype=int)
+    centroids = list()
+    neighbors = neighbors.tocsr()
+    for label, cluster in enumerate(clusters):
+        cluster = np.array(sorted(cluster))
+        labels[cluster] = label
+        #### medoid: lowest summed distance to the rest of the cluster (missing pairs count as cutoff)
+        within = neighbors[cluster][:, cluster]
+        known = np.asarray(within.sum(axis=1)).ravel()
+        n_known = np.diff(within.indptr)
+        centroids.append(cluster[np.argmin(known + (len(cluster) - 1 - n_known) * cutoff)])
+
+    return np.array(centroids, dtype=int), labels
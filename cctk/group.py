@@ -59,7 +59,7 @@ class Group(cctk.Molecule):
     @staticmethod
     def add_group_to_molecule(molecule, group, add_to, optimize=True, return_mapping=False):
         """
-        Adds a `Group` object to a `Molecule` at the specified atom, and returns a new `Molecule` object (generated using `copy.deepcopy()`).
+        Adds a `Group` object to a `Molecule` at the specified atom, and returns a new `Molecule` object (generated using `Molecule.clone()`).
         Automatically attempts to prevent clashes by minimizing pairwise atomic distances.
 
         The atom in `group` that replaces `add_to` in `molecule` will inherit the number of `add_to` - however, the other atoms in `group` will be appended to the atom list.
@@ -90,7 +90,7 @@ class Group(cctk.Molecule):
         except:
             raise TypeError("add_to not castable to int")
 
-        molecule = copy.deepcopy(molecule)
+        molecule = molecule.clone()
         molecule._check_atom_number(add_to)
         original_num_atoms = molecule.num_atoms()
 
@@ -111,16 +111,28 @@ class Group(cctk.Molecule):
         new_radius = get_covalent_radius(group.atomic_numbers[group.adjacent])
         delta_rad = new_radius - old_radius
 
-        #### make the swap! (this only adds the atoms, still have to get the geometry right)
+        #### make the swap! (the other atoms are added below, once their geometry is right)
         molecule.atomic_numbers[add_to] = group.atomic_numbers[group.adjacent]
         new_indices = [i + molecule.num_atoms() for i in range(1, np.sum(other_indices) + 1)]
-        molecule.atomic_numbers = np.hstack([molecule.atomic_numbers, group.atomic_numbers[other_indices]])
-        molecule.atomic_numbers = molecule.atomic_numbers.view(cctk.OneIndexedArray)
 
         #### have to keep track of what all the new indices are, to carry over connectivity
         new_indices.insert(group.adjacent - 1, add_to)
         new_indices.insert(attach_to - 1, adjacent_atom)
 
+        #### adjust the bond length by moving add_to
+        molecule.set_distance(adjacent_atom, add_to, molecule.get_distance(adjacent_atom, add_to) + delta_rad)
+
+        #### rotate group to match the new positioning
+        v_g = group.get_vector(group.attach_to, group.adjacent)
+        v_m = molecule.get_vector(add_to, adjacent_atom)
+        theta = compute_angle_between(v_g, v_m)
+
+        #### rotate all the other atoms and add them at once
+        center_pos = molecule.get_vector(add_to)
+        rot = compute_rotation_matrix(np.cross(v_g, v_m), -(180 - theta))
+        new_coordinates = group.geometry.view(np.ndarray)[other_indices.view(np.ndarray)] @ rot.T + center_pos
+        molecule.add_atoms(group.atomic_numbers.view(np.ndarray)[other_indices.view(np.ndarray)], new_coordinates)
+
         #### track atom number mapping
         molecule_to_new = {z : z for z in range(1, molecule.num_atoms() + 1)}
         molecule_to_new[add_to] = None
@@ -135,22 +147,6 @@ class Group(cctk.Molecule):
                 group_to_new[z] = None
         group_to_new[group.adjacent] = add_to
 
-        #### adjust the bond length by moving add_to
-        molecule.set_distance(adjacent_atom, add_to, molecule.get_distance(adjacent_atom, add_to) + delta_rad)
-
-        #### rotate group to match the new positioning
-        v_g = group.get_vector(group.attach_to, group.adjacent)
-        v_m = molecule.get_vector(add_to, adjacent_atom)
-        theta = compute_angle_between(v_g, v_m)
-
-        #### rotate each atom and add it...
-        center_pos = molecule.get_vector(add_to)
-        rot = compute_rotation_matrix(np.cross(v_g, v_m), -(180 - theta))
-        for vector in group.geometry[other_indices]:
-            new_v = np.dot(rot, vector) + center_pos
-            molecule.geometry = np.vstack((molecule.geometry, new_v))
-            molecule.geometry = molecule.geometry.view(cctk.OneIndexedArray)
-
         #### now we have to merge the new bonds
         for (atom1, atom2) in group.bonds.edges():
             molecule.add_bond(new_indices[atom1-1], new_indices[atom2-1])
@@ -201,7 +197,7 @@ class Group(cctk.Molecule):
         except:
             raise TypeError("atom numbers not castable to int")
 
-        molecule = copy.deepcopy(molecule)
+        molecule = molecule.clone()
         molecule._check_atom_number(atom1)
         molecule._check_atom_number(atom2)
 
@@ -3,7 +3,9 @@ Miscellaneous helper functions.
 """
 
 import numpy as np
-import math, re
+import math, re, struct, itertools
+import concurrent.futures
+from scipy.optimize import linear_sum_assignment
 from io import BytesIO
 
 #### python 3.6 or earlier doesn't have importlib.resources, but it's backported as importlib_resources
@@ -212,6 +214,105 @@ def compute_dihedral_between(p0, p1, p2, p3, unit="degree"):
     else:
         raise ValueError(f"invalid unit {unit}: must be 'degree' or 'radian'!")
 
+def compute_unit_vectors(vectors):
+    """
+    Vectorized version of ``compute_unit_vector``: normalizes along the last axis.
+    Zero vectors are returned unchanged.
+    """
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=(norms != 0))
+
+def compute_distances_between(v1, v2):
+    """
+    Vectorized version of ``compute_distance_between``.
+
+    Args:
+        v1 (np.ndarray): array of points, shape ``(..., 3)``
+        v2 (np.ndarray): array of points, same shape as ``v1``
+
+    Returns:
+        ``np.ndarray`` of distances, shape ``(...)``
+    """
+    return np.linalg.norm(v1 - v2, axis=-1)
+
+def compute_angles_between(v1, v2, unit="degree"):
+    """
+    Vectorized version of ``compute_angle_between``.
+
+    Args:
+        v1 (np.ndarray): array of vectors, shape ``(..., 3)``
+        v2 (np.ndarray): array of vectors, same shape as ``v1``
+        unit (str): 'degree' or 'radian'
+
+    Returns:
+        ``np.ndarray`` of angles, shape ``(...)``
+    """
+    cosines = np.sum(compute_unit_vectors(v1) * compute_unit_vectors(v2), axis=-1)
+    angle = np.arccos(np.clip(cosines, -1.0, 1.0))
+    if unit == "degree":
+        return np.degrees(angle) % 360
+    elif unit == "radian":
+        return angle % (2 * math.pi)
+    else:
+        raise ValueError(f"invalid unit {unit}: must be 'degree' or 'radian'!")
+
+def compute_dihedrals_between(p0, p1, p2, p3, unit="degree"):
+    """
+    Vectorized version of ``compute_dihedral_between``.
+
+    Args:
+        p0, p1, p2, p3 (np.ndarray): arrays of points, each of shape ``(..., 3)``
+        unit (str): 'degree' or 'radian'
+
+    Returns:
+        ``np.ndarray`` of dihedral angles, shape ``(...)``
+    """
+    b0 = p0 - p1
+    b1 = compute_unit_vectors(p2 - p1)
+    b2 = p3 - p2
+
+    v = b0 - np.sum(b0 * b1, axis=-1, keepdims=True) * b1
+    w = b2 - np.sum(b2 * b1, axis=-1, keepdims=True) * b1
+
+    x = np.sum(v * w, axis=-1)
+    y = np.sum(np.cross(b1, v) * w, axis=-1)
+
+    angle = np.arctan2(y, x)
+
+    if unit == "degree":
+        return np.degrees(angle) % 360
+    elif unit == "radian":
+        return angle % (2 * math.pi)
+    else:
+        raise ValueError(f"invalid unit {unit}: must be 'degree' or 'radian'!")
+
+def compute_internal_coordinates(geometries, indices):
+    """
+    Computes many distances, angles, or dihedral angles in one call.
+    The type of internal coordinate is determined by the width of ``indices``.
+
+    Args:
+        geometries (np.ndarray): coordinates, shape ``(n_atoms, 3)`` or ``(n_geometries, n_atoms, 3)``
+        indices (np.ndarray): 0-indexed atom numbers, shape ``(k, 2)`` for distances (Å),
+            ``(k, 3)`` for angles (degrees), or ``(k, 4)`` for dihedral angles (degrees)
+
+    Returns:
+        ``np.ndarray`` of shape ``(k,)`` or ``(n_geometries, k)``
+    """
+    geometries = np.asarray(geometries, dtype=np.float64)
+    indices = np.asarray(indices)
+    assert indices.ndim == 2, f"indices must be a 2D array, but got shape {indices.shape}"
+
+    points = [geometries[..., indices[:, i], :] for i in range(indices.shape[1])]
+    if len(points) == 2:
+        return compute_distances_between(points[0], points[1])
+    elif len(points) == 3:
+        return compute_angles_between(points[0] - points[1], points[2] - points[1])
+    elif len(points) == 4:
+        return compute_dihedrals_between(*points)
+    else:
+        raise ValueError(f"need 2, 3, or 4 atoms per internal coordinate, but got {len(points)}")
+
 
 def compute_rotation_matrix(axis, theta):
     """
@@ -249,6 +350,37 @@ def compute_rotation_matrix(axis, theta):
         ]
     )
 
+def compute_rotation_matrices(axes, thetas):
+    """
+    Vectorized version of ``compute_rotation_matrix``: builds many rotation matrices at once, with the same conventions.
+
+    Args:
+        axes (np.ndarray): the vectors to rotate about, shape ``(n, 3)``
+        thetas (np.ndarray): how much to rotate about each axis (in degrees), shape ``(n,)``
+
+    Returns:
+        ``np.ndarray`` of rotation matrices, shape ``(n, 3, 3)``
+    """
+    axes = np.asarray(axes, dtype=np.float64)
+    thetas = np.radians(np.asarray(thetas, dtype=np.float64))
+    assert axes.ndim == 2 and axes.shape[1] == 3, f"axes must have shape (n, 3), but got {axes.shape}"
+    assert thetas.shape == (len(axes),), f"expected {len(axes)} angles, but got shape {thetas.shape}"
+
+    axes = axes / np.linalg.norm(axes, axis=-1, keepdims=True)
+    a = np.cos(thetas / 2.0)
+    b, c, d = (-axes * np.sin(thetas / 2.0)[:, np.newaxis]).T
+
+    aa, bb, cc, dd = a * a, b * b, c * c, d * d
+    bc, ad, ac, ab, bd, cd = b * c, a * d, a * c, a * b, b * d, c * d
+    return np.stack(
+        [
+            np.stack([aa + bb - cc - dd, 2 * (bc + ad), 2 * (bd - ac)], axis=-1),
+            np.stack([2 * (bc - ad), aa + cc - bb - dd, 2 * (cd + ab)], axis=-1),
+            np.stack([2 * (bd + ac), 2 * (cd - ab), aa + dd - bb - cc], axis=-1),
+        ],
+        axis=-2,
+    )
+
 def align_matrices(P_partial, P_full, Q_partial, return_matrix=False):
     """
     Rotates one set of points onto another using the Kabsch algorithm.
@@ -277,6 +409,27 @@ def align_matrices(P_partial, P_full, Q_partial, return_matrix=False):
     rotation = U @ middle @ Vt
     return P_full @ rotation
 
+def compute_kabsch_rotations(P, Q):
+    """
+    Vectorized version of the Kabsch algorithm used in ``align_matrices``: finds every rotation at once with a stacked SVD.
+    Both sets of points should already be centered.
+
+    Args:
+        P (np.ndarray): points to rotate, shape ``(..., n_points, 3)``
+        Q (np.ndarray): points to align to, shape broadcastable against ``P``
+
+    Returns:
+        rotation matrices ``R`` of shape ``(..., 3, 3)``, such that ``P @ R`` is aligned to ``Q``
+    """
+    C = np.einsum("...ki,...kj->...ij", P, Q)
+    U, S, Vt = np.linalg.svd(C)
+
+    #### prevent improper rotations (reflections)
+    d = np.where(np.linalg.det(U @ Vt) < 0, -1.0, 1.0)
+    U[..., :, 2] *= d[..., np.newaxis]
+
+    return U @ Vt
+
 def compute_RMSD(geometry1, geometry2, checks=True):
     """
     Computes the root mean squared difference between two geometries.
@@ -299,6 +452,398 @@ def compute_RMSD(geometry1, geometry2, checks=True):
 
     return np.sqrt( np.sum( ( geometry1.view(np.ndarray) - geometry2.view(np.ndarray) ) ** 2) / len(geometry1) )
 
+def compute_RMSDs(geometries, reference):
+    """
+    Vectorized version of ``compute_RMSD``: computes the root mean squared difference between many geometries and a reference.
+
+    Args:
+        geometries (np.ndarray): geometries, shape ``(..., n_atoms, 3)``
+        reference (np.ndarray): geometry or geometries broadcastable against ``geometries``
+
+    Returns:
+        ``np.ndarray`` of RMSDs with shape ``(...)``
+    """
+    geometries = np.asarray(geometries, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    return np.sqrt(np.mean(np.sum((geometries - reference) ** 2, axis=-1), axis=-1))
+
+def compute_pairwise_RMSDs(P, Q, align=True, symmetry_classes=None, bonds=None):
+    """
+    Computes the RMSD between every geometry in ``P`` and every geometry in ``Q``.
+
+    When aligning, the optimal-superposition RMSD is obtained without rotating anything, using the quaternion characteristic polynomial method
+    (Theobald, *Acta Cryst.* 2005, A61, 478): ``RMSD^2 = 2 * (E0 - lambda_max) / n_atoms``, where ``E0 = (|p|^2 + |q|^2) / 2``
+    and ``lambda_max`` is the largest eigenvalue of Horn's 4x4 key matrix, found by Newton's method starting from ``E0``.
+    This gives the same result as the Kabsch algorithm, but avoids one SVD per pair.
+
+    If ``symmetry_classes`` and ``bonds`` are given (see ``cctk.topology.get_symmetry_classes()``), ``P`` may be renumbered by any automorphism of the bond graph
+    which keeps atoms within their class to lower the RMSD (see ``_compute_symmetric_RMSDs()``).
+
+    Args:
+        P (np.ndarray): geometries, shape ``(n_P, n_atoms, 3)``
+        Q (np.ndarray): geometries, shape ``(n_Q, n_atoms, 3)``
+        align (bool): whether to compute RMSDs after optimal superposition (otherwise, coordinates are compared as-is)
+        symmetry_classes (list): optional list of arrays of interchangeable atom indices
+        bonds (np.ndarray): bonded pairs of atom indices, shape ``(n_bonds, 2)`` (required with ``symmetry_classes``)
+
+    Returns:
+        ``np.ndarray`` of RMSDs with shape ``(n_P, n_Q)``
+    """
+    P = np.asarray(P, dtype=np.float64)
+    Q = np.asarray(Q, dtype=np.float64)
+    assert P.shape[1:] == Q.shape[1:], "can't compare geometries with different numbers of atoms!"
+    n_atoms = P.shape[1]
+
+    if symmetry_classes is not None and len(symmetry_classes) > 0:
+        assert bonds is not None, "need the bonds between atoms to exchange symmetry-equivalent atoms!"
+        #### one rotated copy of P per pair is needed, so work in chunks to keep the intermediate arrays small
+        chunk = max(1, 2 ** 20 // (max(len(Q), 1) * n_atoms * 3))
+        rmsds = np.zeros(shape=(len(P), len(Q)))
+        for start in range(0, len(P), chunk):
+            rmsds[start:start + chunk] = _compute_symmetric_RMSDs(P[start:start + chunk], Q, align, symmetry_classes, bonds)
+        return rmsds
+
+    if align:
+        P = P - P.mean(axis=1, keepdims=True)
+        Q = Q - Q.mean(axis=1, keepdims=True)
+
+    norms_P = np.einsum("ikx,ikx->i", P, P)
+    norms_Q = np.einsum("jkx,jkx->j", Q, Q)
+    E0 = (norms_P[:, np.newaxis] + norms_Q[np.newaxis, :]) / 2
+
+    if not align:
+        overlap = P.reshape(len(P), -1) @ Q.reshape(len(Q), -1).T
+        return np.sqrt(np.maximum(2 * (E0 - overlap) / n_atoms, 0))
+
+    #### covariance matrices for every pair as one matrix multiplication: C[i, j] = P[i].T @ Q[j]
+    C = (P.transpose(0, 2, 1).reshape(-1, n_atoms) @ Q.transpose(1, 0, 2).reshape(n_atoms, -1))
+    C = C.reshape(len(P), 3, len(Q), 3).transpose(0, 2, 1, 3)
+    Sxx, Sxy, Sxz = C[..., 0, 0], C[..., 0, 1], C[..., 0, 2]
+    Syx, Syy, Syz = C[..., 1, 0], C[..., 1, 1], C[..., 1, 2]
+    Szx, Szy, Szz = C[..., 2, 0], C[..., 2, 1], C[..., 2, 2]
+
+    K = np.empty(C.shape[:-2] + (4, 4))
+    K[..., 0, 0] = Sxx + Syy + Szz
+    K[..., 1, 1] = Sxx - Syy - Szz
+    K[..., 2, 2] = -Sxx + Syy - Szz
+    K[..., 3, 3] = -Sxx - Syy + Szz
+    K[..., 0, 1] = K[..., 1, 0] = Syz - Szy
+    K[..., 0, 2] = K[..., 2, 0] = Szx - Sxz
+    K[..., 0, 3] = K[..., 3, 0] = Sxy - Syx
+    K[..., 1, 2] = K[..., 2, 1] = Sxy + Syx
+    K[..., 1, 3] = K[..., 3, 1] = Szx + Sxz
+    K[..., 2, 3] = K[..., 3, 2] = Syz + Szy
+
+    #### K is traceless, so its characteristic polynomial is x^4 + c2 x^2 + c1 x + c0 (coefficients from traces of powers of K)
+    K2 = K @ K
+    trace2 = np.einsum("...ii->...", K2)
+    trace3 = np.einsum("...ij,...ji->...", K2, K)
+    trace4 = np.einsum("...ij,...ji->...", K2, K2)
+    c2 = -trace2 / 2
+    c1 = -trace3 / 3
+    c0 = (trace2 * trace2 / 2 - trace4) / 4
+
+    x = E0.copy()
+    for _ in range(50):
+        x2 = x * x
+        derivative = (4 * x2 + 2 * c2) * x + c1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta = np.where(derivative != 0, ((x2 + c2) * x2 + c1 * x + c0) / derivative, 0)
+        x -= delta
+        if np.all(np.abs(delta) <= 1e-12 * np.abs(x)):
+            break
+
+    return np.sqrt(np.maximum(2 * (E0 - x) / n_atoms, 0))
+
+def _assign_symmetric_atoms(P, Q, symmetry_classes, adjacency):
+    """
+    Finds, for every pair, the renumbering of ``P`` closest to ``Q`` when atoms may only be exchanged within their symmetry class.
+    Each class is a linear assignment problem: small classes are solved by trying every permutation at once, larger ones with the Hungarian algorithm.
+
+    Classes are assigned one at a time, starting with those bonded to atoms already in place, and an atom may only take a position whose placed neighbors
+    are bonded to it (so the hydrogens of a methyl group follow its carbon). The cost of moving an atom includes the best matching of its terminal neighbors,
+    so a whole rotor is placed at once. This doesn't constrain bonds within a class, so the result isn't always an automorphism.
+
+    Args:
+        P (np.ndarray): geometries, shape ``(n_P, n_Q, n_atoms, 3)`` (one copy per pair, already superimposed)
+        Q (np.ndarray): geometries, shape ``(n_Q, n_atoms, 3)``
+        symmetry_classes (list): list of arrays of interchangeable atom indices
+        adjacency (np.ndarray): boolean adjacency matrix, shape ``(n_atoms, n_atoms)``
+
+    Returns:
+        ``np.ndarray`` of shape ``(n_P, n_Q, n_atoms)``, where ``P[p, q][ordering[p, q]]`` is the renumbered geometry
+    """
+    ordering = np.broadcast_to(np.arange(P.shape[2]), P.shape[:3]).copy()
+    placed = np.ones(P.shape[2], dtype=bool)
+    labels = -1 - np.arange(P.shape[2])
+    for label, atoms in enumerate(symmetry_classes):
+        placed[atoms] = False
+        labels[atoms] = label
+    terminal = adjacency.sum(axis=1) == 1
+
+    remaining = list(symmetry_classes)
+    while remaining:
+        atoms = remaining.pop(max(range(len(remaining)), key=lambda i: (adjacency[remaining[i]][:, placed].sum(), -len(remaining[i]))))
+        size = len(atoms)
+        #### cost[p, q, a, b] is the cost of putting atom a of P in place of atom b
+        cost = np.sum((P[:, :, atoms, np.newaxis] - Q[np.newaxis, :, np.newaxis, atoms]) ** 2, axis=-1)
+
+        #### penalize putting atom a in place of atom b unless a is bonded to the atoms now in place of b's placed neighbors
+        neighbors = np.nonzero(placed & adjacency[atoms].any(axis=0))[0]
+        if len(neighbors):
+            unbonded = ~adjacency[atoms][:, ordering[:, :, neighbors]]
+            violations = np.einsum("apqn,bn->pqab", unbonded.astype(np.float64), adjacency[np.ix_(atoms, neighbors)].astype(np.float64))
+            cost += 1e6 * violations
+
+        #### add the cost of the best matching between terminal neighbors with the same labels (equivalent atoms have the same ones)
+        leaves = [np.nonzero(adjacency[atom] & terminal & ~placed)[0] for atom in atoms]
+        leaves = np.array([leaf[np.argsort(labels[leaf], kind="stable")] for leaf in leaves])
+        if 0 < leaves.shape[1] <= 4:
+            leaf_labels = labels[leaves[0]]
+            options = np.array([option for option in itertools.permutations(range(leaves.shape[1])) if np.array_equal(leaf_labels[list(option)], leaf_labels)])
+            #### leaf_cost[p, q, a, i, b, k] is the cost of putting leaf i of atom a in place of leaf k of atom b
+            leaf_cost = np.sum((P[:, :, leaves, np.newaxis, np.newaxis] - Q[np.newaxis, :, np.newaxis, np.newaxis, leaves]) ** 2, axis=-1)
+            #### (the separated advanced indices put the option and leaf axes first)
+            cost += leaf_cost[:, :, :, options, :, np.arange(leaves.shape[1])].sum(axis=1).min(axis=0)
+
+        if size <= 4:
+            options = np.array(list(itertools.permutations(range(size))))
+            best = np.argmin(cost[:, :, options, np.arange(size)].sum(axis=-1), axis=-1)
+            ordering[:, :, atoms] = atoms[options[best]]
+        else:
+            for p, q in np.ndindex(*cost.shape[:2]):
+                rows, cols = linear_sum_assignment(cost[p, q])
+                ordering[p, q, atoms[cols]] = atoms[rows]
+        placed[atoms] = True
+    return ordering
+
+def _compute_symmetric_RMSDs(P, Q, align, symmetry_classes, bonds, max_iterations=5):
+    """
+    Computes the RMSD between every geometry in ``P`` and every geometry in ``Q``, renumbering ``P`` by automorphisms of the bond graph to lower it.
+
+    Candidate renumberings come from exchanging atoms within each symmetry class (see ``_assign_symmetric_atoms()``). Bonds within a class aren't enforced
+    there, so a candidate may not respect them (e.g. when it exchanges two neighboring ring atoms): any candidate which doesn't map every bond
+    onto a bond is rejected, and that pair keeps its previous numbering. Every RMSD considered therefore belongs to a true automorphism,
+    so the result is never below the minimum over the automorphism group and never above the plain RMSD.
+
+    Without alignment, the best exchange is found directly. With alignment, the superposition and the exchange depend on each other,
+    so the two are alternated until the numbering stops changing, starting both from the superposition of the original numbering
+    and from a superposition of the class centroids.
+
+    Args:
+        P (np.ndarray): geometries, shape ``(n_P, n_atoms, 3)``
+        Q (np.ndarray): geometries, shape ``(n_Q, n_atoms, 3)``
+        align (bool): whether to compute RMSDs after optimal superposition
+        symmetry_classes (list): list of arrays of interchangeable atom indices
+        bonds (np.ndarray): bonded pairs of atom indices, shape ``(n_bonds, 2)``
+        max_iterations (int): maximum number of superposition/assignment cycles per starting point
+
+    Returns:
+        ``np.ndarray`` of RMSDs with shape ``(n_P, n_Q)``
+    """
+    n_atoms = P.shape[1]
+    symmetry_classes = [np.asarray(atoms, dtype=np.int64) for atoms in symmetry_classes]
+    if align:
+        P = P - P.mean(axis=1, keepdims=True)
+        Q = Q - Q.mean(axis=1, keepdims=True)
+    pairs = np.broadcast_to(P[:, np.newaxis], (len(P), len(Q), n_atoms, 3))
+    identity = np.broadcast_to(np.arange(n_atoms), pairs.shape[:3])
+
+    bonds = np.asarray(bonds, dtype=np.int64).reshape(-1, 2)
+    adjacency = np.zeros(shape=(n_atoms, n_atoms), dtype=bool)
+    adjacency[bonds[:, 0], bonds[:, 1]] = True
+    adjacency[bonds[:, 1], bonds[:, 0]] = True
+
+    def keep_automorphisms(new_ordering, ordering):
+        """ reverts every pair whose new numbering doesn't map bonds onto bonds to its previous numbering """
+        mapped = new_ordering[..., bonds]
+        valid = adjacency[mapped[..., 0], mapped[..., 1]].all(axis=-1)
+        return np.where(valid[..., np.newaxis], new_ordering, ordering)
+
+    if not align:
+        ordering = keep_automorphisms(_assign_symmetric_atoms(pairs, Q, symmetry_classes, adjacency), identity)
+        renumbered = np.take_along_axis(pairs, ordering[..., np.newaxis], axis=2)
+        return np.sqrt(np.mean(np.sum((renumbered - Q[np.newaxis]) ** 2, axis=-1), axis=-1))
+
+    norms = np.einsum("ikx,ikx->i", P, P)[:, np.newaxis] + np.einsum("jkx,jkx->j", Q, Q)[np.newaxis, :]
+
+    def superimpose(P_pairs, Q):
+        """ Kabsch superposition of every pair at once: returns the RMSDs and the rotations to apply to ``P_pairs`` """
+        U, S, Vt = np.linalg.svd(np.einsum("pqkx,qky->pqxy", P_pairs, Q))
+        sign = np.sign(np.linalg.det(U @ Vt))
+        S[..., -1] *= sign
+        U[..., -1] *= sign[..., np.newaxis]
+        return np.sqrt(np.maximum((norms - 2 * S.sum(axis=-1)) / n_atoms, 0)), U @ Vt
+
+    #### start from the original numbering, and from a superposition in which every class is collapsed onto its centroid (which no exchange can change)
+    rmsds, rotation = superimpose(pairs, Q)
+    collapsed_pairs, collapsed_Q = pairs.copy(), Q.copy()
+    for atoms in symmetry_classes:
+        collapsed_pairs[:, :, atoms] = collapsed_pairs[:, :, atoms].mean(axis=2, keepdims=True)
+        collapsed_Q[:, atoms] = collapsed_Q[:, atoms].mean(axis=1, keepdims=True)
+    starts = [rotation, superimpose(collapsed_pairs, collapsed_Q)[1]]
+
+    for rotation in starts:
+        ordering = identity
+        for _ in range(max_iterations):
+            new_ordering = keep_automorphisms(_assign_symmetric_atoms(pairs @ rotation, Q, symmetry_classes, adjacency), ordering)
+            if np.array_equal(new_ordering, ordering):
+                break
+            ordering = new_ordering
+            new_rmsds, rotation = superimpose(np.take_along_axis(pairs, ordering[..., np.newaxis], axis=2), Q)
+            rmsds = np.minimum(rmsds, new_rmsds)
+
+    return rmsds
+
+def compute_grid_volume(geometry, radii, pts_per_angstrom=10, nprocs=1, max_points=2**24):
+    """
+    Computes the volume enclosed by a set of spheres with the Gavezotti grid algorithm (JACS, 1983, 105, 5220).
+
+    Every sphere covers a contiguous run of grid points along each grid line through it, so occupied points are counted as the union of these runs,
+    without building the grid itself. The grid is split into slabs of about ``max_points`` points along x, which can be spread over threads:
+    each slab is handled by a few whole-array numpy operations, which release the GIL.
+
+    Args:
+        geometry (np.ndarray): atomic coordinates, shape ``(n_atoms, 3)``
+        radii (np.ndarray): sphere radii, shape ``(n_atoms,)``
+        pts_per_angstrom (int): how many grid points to use per Å
+        nprocs (int): number of threads to spread slabs over
+        max_points (int): approximate number of grid points per slab
+
+    Returns:
+        volume in Å**3
+    """
+    assert isinstance(pts_per_angstrom, int), "Need an integer number of pts per Å!"
+    assert pts_per_angstrom > 0, "Need a positive integer of pts per Å!"
+    assert isinstance(nprocs, int) and nprocs > 0, "nprocs must be a positive integer"
+
+    geometry = np.asarray(geometry)
+    radii = np.asarray(radii, dtype=np.float64).ravel()
+    assert len(radii) == len(geometry), "need one radius per atom"
+
+    box_max = np.max(geometry, axis=0) + 4
+    box_min = np.min(geometry, axis=0) - 4
+    box_volume = (box_max[0] - box_min[0]) * (box_max[1] - box_min[1]) * (box_max[2] - box_min[2])
+    axes = [np.linspace(box_min[k], box_max[k], int((box_max[k] - box_min[k]) * pts_per_angstrom)) for k in range(3)]
+    n_x, n_y, n_z = [len(a) for a in axes]
+
+    #### window of grid indices along each axis that can lie inside each atom
+    geometry = geometry.astype(np.float64)
+    lo = np.stack([np.searchsorted(axes[k], geometry[:,k] - radii, side="left") for k in range(3)], axis=-1)
+    hi = np.stack([np.searchsorted(axes[k], geometry[:,k] + radii, side="right") for k in range(3)], axis=-1)
+    radii_squared = radii ** 2
+
+    def count_slab(start, stop):
+        """ counts the occupied grid points with x index in ``[start, stop)`` using whole-array numpy operations, so threads don't hold the GIL """
+        atoms = np.nonzero((lo[:,0] < stop) & (hi[:,0] > start))[0]
+        x0, x1 = np.maximum(lo[atoms,0], start), np.minimum(hi[atoms,0], stop)
+        y0, y1 = lo[atoms,1], hi[atoms,1]
+        widths = np.maximum(y1 - y0, 0)
+        counts = np.maximum(x1 - x0, 0) * widths
+
+        #### one entry per (atom, x, y) grid line crossing the atom's bounding box
+        atom = np.repeat(np.arange(len(atoms)), counts)
+        local = np.arange(len(atom)) - np.repeat(np.cumsum(counts) - counts, counts)
+        xi = x0[atom] + local // widths[atom]
+        yi = y0[atom] + local % widths[atom]
+        atom = atoms[atom]
+
+        #### each sphere covers a contiguous run of z along every grid line: the points strictly within the half-chord of the center
+        half_chord_squared = radii_squared[atom] - (axes[0][xi] - geometry[atom,0]) ** 2 - (axes[1][yi] - geometry[atom,1]) ** 2
+        crossing = half_chord_squared > 0
+        atom, xi, yi = atom[crossing], xi[crossing], yi[crossing]
+        half_chord = np.sqrt(half_chord_squared[crossing])
+        z0 = np.searchsorted(axes[2], geometry[atom,2] - half_chord, side="right")
+        z1 = np.searchsorted(axes[2], geometry[atom,2] + half_chord, side="left")
+
+        #### length of the union of the runs: offset every grid line so runs on different lines can't overlap, then sweep in order of start
+        offset = ((xi - start) * n_y + yi) * (n_z + 1)
+        z0, z1 = z0 + offset, z1 + offset
+        order = np.argsort(z0, kind="stable")
+        z0, z1 = z0[order], z1[order]
+        covered = np.concatenate([[0], np.maximum.accumulate(z1)[:-1]]) if len(z1) else z1
+        return int(np.sum(np.maximum(z1 - np.maximum(z0, covered), 0)))
+
+    slab_width = max(1, max_points // (n_y * n_z))
+    slabs = [(start, min(start + slab_width, n_x)) for start in range(0, n_x, slab_width)]
+    if nprocs > 1 and len(slabs) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nprocs) as executor:
+            occupied = sum(executor.map(lambda s: count_slab(*s), slabs))
+    else:
+        occupied = sum([count_slab(*s) for s in slabs])
+
+    return occupied / (n_x * n_y * n_z) * box_volume
+
+def get_box_matrix(box):
+    """
+    Converts a periodic box to a matrix of box vectors.
+
+    Args:
+        box (float or np.ndarray): the side length of a cube, the three side lengths of an orthorhombic box, or a 3x3 matrix of box vectors (one per row), in Å
+
+    Returns:
+        ``np.ndarray`` of box vectors, shape ``(3, 3)``
+    """
+    box = np.asarray(box, dtype=np.float64)
+    if box.ndim == 0:
+        box = np.full(3, float(box))
+    if box.shape == (3,):
+        box = np.diag(box)
+    assert box.shape == (3, 3), f"box must be a side length, 3 side lengths, or a 3x3 matrix of box vectors -- not shape {box.shape}"
+    assert abs(np.linalg.det(box)) > 0, "box vectors must be linearly independent"
+    return box
+
+def compute_periodic_centering(geometries, labels, box, center, tree=None):
+    """
+    Moves atom ``center`` to the middle of a periodic box and wraps every bonded fragment, as a unit, into the primary cell.
+
+    Fragments are wrapped based on their centroids. If ``tree`` is given, fragments split across the box boundary are first made whole
+    by placing each atom at the periodic image closest to its parent.
+
+    Args:
+        geometries (np.ndarray): coordinates, shape ``(n_atoms, 3)`` or ``(n_frames, n_atoms, 3)``
+        labels (np.ndarray): 0-indexed fragment of every atom, shape ``(n_atoms,)``
+        box (float or np.ndarray): periodic box (see ``get_box_matrix()``)
+        center (int): 0-indexed atom to center
+        tree (list): optionally, a spanning tree of the bonds, as a list of ``(children, parents)`` arrays of 0-indexed atoms, one per depth
+
+    Returns:
+        new coordinates, with the same shape as ``geometries``
+    """
+    box = get_box_matrix(box)
+    inverse = np.linalg.inv(box)
+    geometries = np.array(geometries, dtype=np.float64)
+    single = geometries.ndim == 2
+    if single:
+        geometries = geometries[np.newaxis]
+    n_frames, n_atoms, _ = geometries.shape
+    labels = np.asarray(labels, dtype=np.int64)
+    assert labels.shape == (n_atoms,), "need one label per atom"
+
+    #### unwrap one depth of the tree at a time, using the minimum-image convention
+    if tree is not None:
+        for children, parents in tree:
+            bond_vectors = geometries[:, children] - geometries[:, parents]
+            bond_vectors -= np.round(bond_vectors @ inverse) @ box
+            geometries[:, children] = geometries[:, parents] + bond_vectors
+
+    geometries -= geometries[:, [center]]
+    geometries += 0.5 * box.sum(axis=0)
+
+    #### sum the coordinates of each fragment in every frame with one bincount per dimension
+    n_fragments = int(labels.max()) + 1
+    bins = (np.arange(n_frames)[:, np.newaxis] * n_fragments + labels).ravel()
+    counts = np.bincount(labels, minlength=n_fragments)
+    centroids = np.stack([np.bincount(bins, weights=geometries[..., k].ravel(), minlength=n_frames * n_fragments) for k in range(3)], axis=-1)
+    centroids = centroids.reshape(n_frames, n_fragments, 3) / counts[:, np.newaxis]
+
+    shifts = np.floor(centroids @ inverse) @ box
+    geometries -= shifts[:, labels]
+
+    if single:
+        return geometries[0]
+    return geometries
+
 def get_isotopic_distribution(z):
     """
     For an element with number ``z``, returns two ``np.ndarray`` objects containing that element's weights and relative abundances.
@@ -353,13 +898,72 @@ DEFAULT_NMR_SCALING_FACTORS = {
         "N" : (0.9776, 244.5626)
 }
 
-def scale_nmr_shifts(ensemble, symmetrical_atom_numbers=None, scaling_factors="default", property_name="isotropic_shielding"):
+def _nmr_scaling_plan(atomic_numbers, symmetrical_atom_numbers, scaling_factors):
+    """
+    Builds the linear map from raw shieldings to scaled shifts for one topology.
+
+    Args:
+        atomic_numbers (np.ndarray): atomic numbers of the molecule
+        symmetrical_atom_numbers (list): list of lists of 1-indexed symmetrical atom numbers
+        scaling_factors (dict): atomic symbol --> (slope, intercept)
+
+    Returns:
+        averaging matrix of shape ``(n_atoms, n_shifts)``, slopes, intercepts, and labels (all of length ``n_shifts``)
+    """
+    n_atoms = len(atomic_numbers)
+    atomic_symbols = [get_symbol(n) for n in atomic_numbers]
+
+    # check symmetrical atom numbers make sense
+    symmetrical_groups_dict = {}    # symbol --> [ [list1], [list2], ...] where each list is a group of symmetrical atom numbers
+    symmetrical_atoms = set()
+    for symmetrical_group in symmetrical_atom_numbers:
+        assert len(symmetrical_group) > 1, "must be at least 2 symmetrical nuclei in a group"
+        assert len(symmetrical_group) == len(set(symmetrical_group)), f"check for duplicate atom numbers in {symmetrical_group}"
+        symmetrical_symbol = None
+        for atom_number in symmetrical_group:
+            assert 1 <= atom_number <= n_atoms, f"atom number {atom_number} is out of range"
+            if symmetrical_symbol is None:
+                symmetrical_symbol = atomic_symbols[atom_number-1]
+                assert symmetrical_symbol in scaling_factors, f"no scaling factors available for the element {symmetrical_symbol}"
+            assert atomic_symbols[atom_number-1] == symmetrical_symbol,\
+                   (f"all atoms in a symmetrical group must correspond to the same element\n"
+                    f"expected element {symmetrical_symbol} for atom {atom_number},"
+                    f"but got element {atomic_symbols[atom_number-1]}")
+        symmetrical_groups_dict.setdefault(symmetrical_symbol, []).append(symmetrical_group)
+        symmetrical_atoms.update(symmetrical_group)
+
+    # each output shift is a column: unique atoms first, then symmetry-averaged groups, element by element
+    columns, slopes, intercepts, labels = [], [], [], []
+    for symbol_of_interest, (slope, intercept) in scaling_factors.items():
+        # sanity checks
+        assert isinstance(slope,float), f"expected slope to be float, but got {str(type(slope))}"
+        assert slope != 0, "zero slope not allowed"
+        assert isinstance(intercept,float), f"expected intercept to be float, but got {str(type(intercept))}"
+
+        groups = [[n] for n in range(1, n_atoms+1) if atomic_symbols[n-1] == symbol_of_interest and n not in symmetrical_atoms]
+        groups += symmetrical_groups_dict.get(symbol_of_interest, [])
+        for group in groups:
+            columns.append(group)
+            slopes.append(slope)
+            intercepts.append(intercept)
+            labels.append(symbol_of_interest + "/".join([str(n) for n in group]))
+
+    averaging_matrix = np.zeros(shape=(n_atoms, len(columns)))
+    for j, group in enumerate(columns):
+        averaging_matrix[np.asarray(group) - 1, j] = 1.0 / len(group)
+
+    return averaging_matrix, np.array(slopes), np.array(intercepts), np.array(labels)
+
+def scale_nmr_shifts(ensemble, symmetrical_atom_numbers=None, scaling_factors="default", property_name="isotropic_shielding", boltzmann=False, temp=298, energies=None):
     """
     Apply linear scaling to isotropic shieldings to get chemical shifts.
     Shifts are calculated as (intercept-shielding)/slope.
     If there are no shifts available for a structure, None will be placed in both
     return lists.
 
+    Labels, element masks, and the symmetry-averaging matrix are built once per distinct topology,
+    so scaling a ``ConformationalEnsemble`` is a single matrix product over all conformers.
+
     Args:
         ensemble: an ``Ensemble`` with calculated nmr shifts
         symmetrical_atom_numbers: None to perform no symmetry-averaging, a list of lists
@@ -372,10 +976,17 @@ def scale_nmr_shifts(ensemble, symmetrical_atom_numbers=None, scaling_factors="d
                          which scaling factors are not provided will be ignored.
         property_name:   the key in properties_dict to use to locate the predicted
                          isotropic shieldings (default="isotropic_shielding")
+        boltzmann:       if True, return Boltzmann-weighted average shifts (requires a ``ConformationalEnsemble``
+                         with shieldings for every conformer)
+        temp:            temperature (or list of temperatures) for Boltzmann-weighting, in K
+        energies:        energies for Boltzmann-weighting (see ``ConformationalEnsemble.boltzmann_weights``)
 
     Returns:
         scaled_shifts: np.array (matching the shape of the original shieldings minus symmetry averaging)
         shift_labels: np.array (also matches shape)
+
+        If ``boltzmann`` is True, ``scaled_shifts`` is the averaged shifts (one row per temperature if several
+        temperatures are given) and ``shift_labels`` is a single row of labels.
     """
     # check inputs
     assert isinstance(ensemble, cctk.Ensemble), f"expected Ensemble but got {str(type(ensemble))} instead"
@@ -392,119 +1003,46 @@ def scale_nmr_shifts(ensemble, symmetrical_atom_numbers=None, scaling_factors="d
         assert len(scaling_factors) > 0, "must provide scaling factors"
     assert isinstance(property_name, str) and len(property_name)>0, f"property_name {property_name} is invalid"
 
-    # get shieldings and scale
-    all_scaled_shifts = []
-    all_shift_labels = []
-    for i,(molecule,properties) in enumerate(ensemble.items()):
+    #### group molecules with shieldings by topology, so each plan is built once
+    topologies = {}
+    for i, (molecule, properties) in enumerate(ensemble.items()):
         if property_name in properties:
-            # get atom numbers and atomic elements as OneIndexedArrays
-            atomic_numbers = molecule.atomic_numbers
-            n_atoms = len(atomic_numbers)
-            atomic_symbols = [ get_symbol(n) for n in atomic_numbers ]
-            atomic_symbols = cctk.OneIndexedArray(atomic_symbols)
-            atom_numbers = list(range(1,n_atoms+1))
-#            symbol_dict = dict(zip(atomic_numbers,atomic_symbols))
-            all_labels = [ f"{current_symbol}{atom_number}" for current_symbol,atom_number in zip(atomic_symbols,atom_numbers) ]
-            all_labels = cctk.OneIndexedArray(all_labels)
-
-            # check symmetrical atom numbers make sense
-            n_atoms = len(atomic_numbers)
-            symmetrical_groups_dict = {}    # symbol --> [ [list1], [list2], ...] where each list is a group of symmetrical atom numbers
-            symmetrical_groups_dict2 = {}   # symbol --> [ union of all symmetrical atom numbers for this symbol ]
-#            unique_atoms_dict = {}          # symbol --> [ union of all unique atom numbers for this symbol ]
-            for symmetrical_group in symmetrical_atom_numbers:
-                assert len(symmetrical_group) > 1, "must be at least 2 symmetrical nuclei in a group"
-                assert len(symmetrical_group) == len(set(symmetrical_group)), f"check for duplicate atom numbers in {symmetrical_group}"
-                symmetrical_symbol = None
-                for atom_number in symmetrical_group:
-                    assert 1 <= atom_number <= n_atoms, f"atom number {atom_number} is out of range"
-                    if symmetrical_symbol is None:
-                        symmetrical_symbol = atomic_symbols[atom_number]
-                        assert symmetrical_symbol in scaling_factors, f"no scaling factors available for the element {symmetrical_symbol}"
-                    assert atomic_symbols[atom_number] == symmetrical_symbol,\
-                           (f"all atoms in a symmetrical group must correspond to the same element\n"
-                            f"expected element {symmetrical_symbol} for atom {atom_number},"
-                            f"but got element {atomic_symbols[atom_number]}")
-                if symmetrical_symbol not in symmetrical_groups_dict:
-                    symmetrical_groups_dict[symmetrical_symbol] = []
-                symmetrical_groups_dict[symmetrical_symbol].append(symmetrical_group)
-                if symmetrical_symbol not in symmetrical_groups_dict2:
-                    symmetrical_groups_dict2[symmetrical_symbol] = []
-                symmetrical_groups_dict2[symmetrical_symbol].extend(symmetrical_group)
-
-            # get shieldings
-            all_shieldings = properties[property_name]
-
-            # iterate through requested elements
-            molecule_shifts = []
-            molecule_labels = []
-            for symbol_of_interest,(slope,intercept) in scaling_factors.items():
-                # sanity checks
-                assert isinstance(slope,float), f"expected slope to be float, but got {str(type(slope))}"
-                assert slope != 0, "zero slope not allowed"
-                assert isinstance(intercept,float), f"expected intercept to be float, but got {str(type(intercept))}"
-
-                # determine unique atoms 
-                unique_atom_numbers_list = []
-                for atomic_symbol,atom_number in zip(atomic_symbols,atom_numbers):
-                    if atomic_symbol != symbol_of_interest:
-                        continue
-                    if symbol_of_interest in symmetrical_groups_dict2:
-                        if atom_number in symmetrical_groups_dict2[symbol_of_interest]:
-                            continue
-                    unique_atom_numbers_list.append(atom_number)
-
-                # extract relevant shieldings and labels for unique atoms
-                if len(unique_atom_numbers_list) > 0:
-                    selected_shieldings = list(all_shieldings[unique_atom_numbers_list])
-                    selected_labels = list(all_labels[unique_atom_numbers_list])
-                else:
-                    selected_shieldings = []
-                    selected_labels = []
-
-                # extract relevant shieldings and labels for symmetrical groups
-                symmetrical_groups = []
-                if symbol_of_interest in symmetrical_groups_dict:
-                    symmetrical_groups = symmetrical_groups_dict[symbol_of_interest]
-                for symmetrical_group in symmetrical_groups:
-                    first_atom_number = symmetrical_group[0]
-                    current_atomic_symbol = atomic_symbols[first_atom_number]
-                    if current_atomic_symbol == symbol_of_interest:
-                        group_shieldings = all_shieldings[symmetrical_group]
-                        averaged_shielding = group_shieldings.mean()
-                        selected_shieldings.append(averaged_shielding)
-                        label = f"{current_atomic_symbol}"
-                        for j,atom_number in enumerate(symmetrical_group):
-                            label += f"{atom_number}"
-                            if j < len(symmetrical_group) - 1:
-                                label += "/"
-                        selected_labels.append(label)
-
-                # apply scaling
-                assert len(selected_shieldings) == len(selected_labels), "shieldings and labels should have 1:1 correspondence"
-                selected_shifts = np.array(selected_shieldings)
-                selected_shifts = (intercept-selected_shifts)/slope
-                selected_labels = np.array(selected_labels)
-
-                # update results
-                molecule_shifts.extend(selected_shifts)
-                molecule_labels.extend(selected_labels)
-
-            # update master results if appropriate
-            if len(molecule_shifts) > 0:
-                all_scaled_shifts.append(molecule_shifts)
-                all_shift_labels.append(molecule_labels)
-            else:
-                # assume this means a bug
-                raise ValueError("no relevant shieldings were extracted for this molecule!")
-        else:
-            # there are no shieldings available, so append None
-            all_scaled_shifts.append(None)
-            all_shift_labels.append(None)
+            key = np.asarray(molecule.atomic_numbers).tobytes()
+            topologies.setdefault(key, (molecule.atomic_numbers, []))[1].append(i)
+
+    all_scaled_shifts = [None] * len(ensemble)
+    all_shift_labels = [None] * len(ensemble)
+    properties_list = ensemble.properties_list()
+    for atomic_numbers, positions in topologies.values():
+        averaging_matrix, slopes, intercepts, labels = _nmr_scaling_plan(atomic_numbers, symmetrical_atom_numbers, scaling_factors)
+        if len(labels) == 0:
+            # assume this means a bug
+            raise ValueError("no relevant shieldings were extracted for this molecule!")
+
+        # (n_conformers, n_atoms) @ (n_atoms, n_shifts)
+        shieldings = np.array([np.asarray(properties_list[i][property_name], dtype=np.float64) for i in positions])
+        assert shieldings.shape[1] == len(atomic_numbers), f"expected {len(atomic_numbers)} shieldings per molecule, got {shieldings.shape[1]}"
+        shifts = (intercepts - shieldings @ averaging_matrix) / slopes
+
+        for i, row in zip(positions, shifts):
+            all_scaled_shifts[i] = row
+            all_shift_labels[i] = labels
+
+    if boltzmann:
+        assert isinstance(ensemble, cctk.ConformationalEnsemble), "Boltzmann averaging requires a ConformationalEnsemble"
+        assert all([s is not None for s in all_scaled_shifts]), f"{property_name} not defined for all molecules"
+        weights = ensemble.boltzmann_weights(energies=energies, temps=temp)
+        return weights @ np.array(all_scaled_shifts), all_shift_labels[0]
 
     # return result
-    scaled_shifts = np.array(all_scaled_shifts)
-    shift_labels = np.array(all_shift_labels)
+    if all([s is not None for s in all_scaled_shifts]) and len(set([len(s) for s in all_scaled_shifts])) == 1:
+        return np.array(all_scaled_shifts), np.array(all_shift_labels)
+
+    #### ragged results can't be stacked, so keep one entry per molecule
+    scaled_shifts = np.empty(len(ensemble), dtype=object)
+    shift_labels = np.empty(len(ensemble), dtype=object)
+    for i, (s, l) in enumerate(zip(all_scaled_shifts, all_shift_labels)):
+        scaled_shifts[i], shift_labels[i] = s, l
     return scaled_shifts, shift_labels
 
 def compute_chirality(v1, v2, v3, v4):
@@ -619,6 +1157,101 @@ def bytes_to_numpy(arr_bytes):
     loaded_np = np.load(load_bytes, allow_pickle=True)
     return loaded_np
 
+#### type codes for ``properties_to_bytes``
+_PROPERTY_NONE, _PROPERTY_BOOL, _PROPERTY_INT, _PROPERTY_FLOAT, _PROPERTY_STR, _PROPERTY_ARRAY = range(6)
+
+def properties_to_bytes(properties):
+    """
+    Compact binary encoding of a properties dict, without pickle or YAML.
+    Values can be ``None``, bools, ints, floats, strings, or numeric arrays/lists (stored with their dtype and shape).
+
+    Args:
+        properties (dict): property name (str) to value
+
+    Returns:
+        bytes
+    """
+    chunks = [struct.pack("<I", len(properties))]
+    for key, value in properties.items():
+        assert isinstance(key, str), f"property names must be strings, not {type(key)}"
+        key = key.encode("utf-8")
+        chunks.append(struct.pack("<H", len(key)) + key)
+
+        if value is None:
+            chunks.append(struct.pack("<B", _PROPERTY_NONE))
+        elif isinstance(value, (bool, np.bool_)):
+            chunks.append(struct.pack("<B?", _PROPERTY_BOOL, bool(value)))
+        elif isinstance(value, (int, np.integer)):
+            chunks.append(struct.pack("<Bq", _PROPERTY_INT, int(value)))
+        elif isinstance(value, (float, np.floating)):
+            chunks.append(struct.pack("<Bd", _PROPERTY_FLOAT, float(value)))
+        elif isinstance(value, str):
+            value = value.encode("utf-8")
+            chunks.append(struct.pack("<BI", _PROPERTY_STR, len(value)) + value)
+        else:
+            value = np.asarray(value)
+            if value.dtype.kind not in "biuf":
+                raise TypeError(f"can't encode property {key.decode()} of type {type(value)}")
+            value = value.astype(value.dtype.newbyteorder("<"))
+            dtype = value.dtype.str.encode("ascii")
+            chunks.append(struct.pack("<BB", _PROPERTY_ARRAY, len(dtype)) + dtype)
+            chunks.append(struct.pack(f"<B{value.ndim}I", value.ndim, *value.shape))
+            chunks.append(value.tobytes())
+
+    return b"".join(chunks)
+
+def bytes_to_properties(data, offset=0):
+    """
+    Decodes a properties dict written by ``properties_to_bytes``.
+
+    Args:
+        data (bytes): encoded properties
+        offset (int): where the encoded properties start in ``data``
+
+    Returns:
+        dict of properties, and the offset just past the end of the encoded properties
+    """
+    properties = dict()
+    (count,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    for _ in range(count):
+        (key_length,) = struct.unpack_from("<H", data, offset)
+        key = bytes(data[offset+2:offset+2+key_length]).decode("utf-8")
+        offset += 2 + key_length
+
+        (code,) = struct.unpack_from("<B", data, offset)
+        offset += 1
+        if code == _PROPERTY_NONE:
+            value = None
+        elif code == _PROPERTY_BOOL:
+            (value,) = struct.unpack_from("<?", data, offset)
+            offset += 1
+        elif code == _PROPERTY_INT:
+            (value,) = struct.unpack_from("<q", data, offset)
+            offset += 8
+        elif code == _PROPERTY_FLOAT:
+            (value,) = struct.unpack_from("<d", data, offset)
+            offset += 8
+        elif code == _PROPERTY_STR:
+            (length,) = struct.unpack_from("<I", data, offset)
+            value = bytes(data[offset+4:offset+4+length]).decode("utf-8")
+            offset += 4 + length
+        elif code == _PROPERTY_ARRAY:
+            (dtype_length,) = struct.unpack_from("<B", data, offset)
+            dtype = np.dtype(bytes(data[offset+1:offset+1+dtype_length]).decode("ascii"))
+            offset += 1 + dtype_length
+            (ndim,) = struct.unpack_from("<B", data, offset)
+            shape = struct.unpack_from(f"<{ndim}I", data, offset + 1)
+            offset += 1 + 4 * ndim
+            size = int(np.prod(shape))
+            value = np.frombuffer(data, dtype=dtype, count=size, offset=offset).reshape(shape).copy()
+            offset += size * dtype.itemsize
+        else:
+            raise ValueError(f"unknown property type code {code}")
+        properties[key] = value
+
+    return properties, offset
+
 def compute_mass_spectrum(formula_dict, **kwargs):
     """
     Computes the expected low-res mass spec ions for a given formula.
@@ -1,6 +1,9 @@
-import math, copy, re
+import math, copy, re, struct, weakref
 import numpy as np
 import networkx as nx
+import scipy.sparse
+import scipy.sparse.csgraph
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 import pkg_resources
 import yaml
@@ -11,17 +14,37 @@ from cctk.helper_functions import (
     get_number,
     get_avg_mass,
     compute_rotation_matrix,
+    compute_rotation_matrices,
     compute_distance_between,
     compute_angle_between,
     compute_dihedral_between,
+    compute_internal_coordinates,
     compute_unit_vector,
+    compute_grid_volume,
+    compute_periodic_centering,
     get_covalent_radius,
     get_vdw_radius,
     numpy_to_bytes,
     bytes_to_numpy,
+    properties_to_bytes,
+    bytes_to_properties,
     _recurse_through_formula,
 )
 import cctk.topology as top
+from cctk.bond_graph import BondGraph
+
+#### topology versions of networkx bond graphs (see ``Molecule._get_topology()``), kept outside the graphs so they don't leak into user data, copies, or pickles
+_graph_versions = weakref.WeakKeyDictionary()
+
+#### clones which still share a networkx bond graph with the molecule they were cloned from, keyed by graph (see ``Molecule._own_bonds()``)
+_graph_clones = weakref.WeakKeyDictionary()
+
+#### binary format for ``Molecule.to_bytes()``: magic, format version, flags, charge, multiplicity, # atoms, # bonds, # modes, name length
+BINARY_MAGIC = b"CCTK"
+BINARY_FORMAT_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHHiiIIII")
+BINARY_HAS_NAME = 1
+BINARY_HAS_PROPERTIES = 2
 
 class Molecule:
     """
@@ -46,7 +69,7 @@ class Molecule:
         """
         Create new Molecule object, and assign connectivity if needed.
 
-        ``bonds`` must be a list of edges (i.e. an n x 2 ``numpy`` array).
+        ``bonds`` must be a list of edges (i.e. an n x 2 ``numpy`` array), a ``networkx.Graph``, or a ``BondGraph``.
 
         If ``checks`` is True, the atomic numbers in bonds will all be checked for consistency.
         This option can be disabled by setting ``checks`` to False, but this is not recommended for external data.
@@ -90,7 +113,7 @@ class Molecule:
 
         self.vibrational_modes = list()
 
-        if isinstance(bonds, nx.Graph):
+        if isinstance(bonds, (nx.Graph, BondGraph)):
             self.bonds = bonds
         elif isinstance(bonds, (list,np.ndarray,nx.classes.reportviews.EdgeView)):
             if checks:
@@ -113,6 +136,125 @@ class Molecule:
         else:
             raise ValueError(f"unexpected type for bonds: {type(bonds)}")
 
+    @property
+    def bonds(self):
+        """
+        The bond graph, as a ``networkx.Graph`` (1-indexed nodes, with bond orders stored as ``weight``).
+
+        If the compact backend is in use (see ``compact_bonds()``), this is a frozen graph cached on the ``BondGraph`` (and shared by every molecule using it);
+        the arrays stay the source of truth, so edit bonds with ``add_bond()`` and ``remove_bond()``.
+        Otherwise the graph itself is returned and may be edited, so cached topology is discarded (for every molecule sharing the graph).
+        """
+        if self._bonds is None:
+            return self._bond_graph.to_networkx(view=True)
+        self._own_bonds()
+        self._invalidate_topology()
+        return self._bonds
+
+    @bonds.setter
+    def bonds(self, bonds):
+        #### assigning another molecule's compact view shares its ``BondGraph`` (e.g. in ``ConformationalEnsemble``)
+        source = getattr(bonds, "_compact_source", None)
+        if isinstance(source, BondGraph) and source._networkx is bonds:
+            bonds = source
+
+        #### a clone which gets a new graph no longer needs a copy of the old one
+        clones = _graph_clones.get(getattr(self, "_bonds", None)) if getattr(self, "_bonds", None) is not None else None
+        if clones:
+            clones.discard(self)
+
+        if isinstance(bonds, BondGraph):
+            self._bonds, self._bond_graph = None, bonds
+        else:
+            self._bonds, self._bond_graph = bonds, None
+
+    def _own_bonds(self):
+        """
+        Helper method which must be called before the ``networkx`` bond graph is edited (or handed out, since the caller may edit it).
+
+        ``clone()`` shares the graph instead of copying it, and the copy is only made here, on the first write.
+        If ``self`` is such a clone, it takes a private copy; otherwise every clone still sharing the graph does, so that molecules which share the graph
+        on purpose (e.g. members of a ``ConformationalEnsemble``) keep sharing it and see the edit.
+        """
+        graph = self._bonds
+        clones = _graph_clones.get(graph) if graph is not None else None
+        if not clones:
+            return
+
+        if self in clones:
+            clones.discard(self)
+            self._bonds = graph.copy()
+        else:
+            for clone in list(clones):
+                if clone._bonds is graph:
+                    clone._bonds = graph.copy()
+            del _graph_clones[graph]
+
+    def __getstate__(self):
+        #### the topology cache is cheap to rebuild, so don't pickle (or deep-copy) it
+        state = self.__dict__.copy()
+        state.pop("_topology_cache", None)
+
+        #### a clone still sharing its graph gets its own copy, so it stays independent of the original after unpickling
+        clones = _graph_clones.get(self._bonds) if self._bonds is not None else None
+        if clones and self in clones:
+            state["_bonds"] = self._bonds.copy()
+        return state
+
+    def __setstate__(self, state):
+        #### molecules pickled before ``bonds`` became a property
+        if "bonds" in state:
+            state["_bonds"] = state.pop("bonds")
+            state["_bond_graph"] = None
+        self.__dict__.update(state)
+
+    def clone(self):
+        """
+        Returns an independent copy of the molecule -- a much cheaper alternative to ``copy.deepcopy()``.
+
+        The bond graph is shared copy-on-write: a ``networkx`` graph is only copied when the clone or the original first edits it (or hands it out through ``bonds``),
+        so the clone is independent even of molecules that share a graph with ``self`` (e.g. members of the same ``ConformationalEnsemble``),
+        and a compact ``BondGraph`` shares its read-only arrays. Coordinates and atomic numbers are edited in place all over ``cctk``, so they're copied (a single array copy each).
+        Vibrational modes are never modified, so the mode objects (and their displacement arrays) are shared. Cached topology isn't carried over.
+
+        Returns:
+            new ``Molecule`` object
+        """
+        new = object.__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        new.atomic_numbers = self.atomic_numbers.copy()
+        new.geometry = self.geometry.copy()
+        new.vibrational_modes = list(self.vibrational_modes)
+        new._topology_cache = None
+
+        if self._bonds is not None:
+            _graph_clones.setdefault(self._bonds, weakref.WeakSet()).add(new)
+        else:
+            new._bond_graph = self._bond_graph.copy()
+
+        return new
+
+    def compact_bonds(self):
+        """
+        Switches the bond graph to the compact ``BondGraph`` backend (CSR adjacency arrays), which uses much less memory and pickles quickly.
+
+        Bond orders, neighbors, connected components, rings, and bridges are read straight from the arrays, and ``add_bond()``/``remove_bond()`` edit them in place.
+        Accessing ``self.bonds`` returns a cached, read-only ``networkx.Graph`` view; ``assign_connectivity()`` switches back to a regular ``networkx.Graph``.
+
+        Returns:
+            the Molecule object
+        """
+        if self._bonds is not None:
+            self.bonds = BondGraph.from_networkx(self._bonds, self.num_atoms())
+        return self
+
+    def _bond_backend(self):
+        """
+        Helper method which returns whichever bond graph is stored (``networkx.Graph`` or ``BondGraph``) without converting it.
+        Both support ``number_of_nodes()``, ``number_of_edges()``, ``has_edge()``, and ``neighbors()``.
+        """
+        return self._bonds if self._bonds is not None else self._bond_graph
+
     def __str__(self):
         if self.name is not None:
             return f"Molecule (name={self.name}, {len(self.atomic_numbers)} atoms)"
@@ -256,14 +398,24 @@ class Molecule:
             assert isinstance(bond_order, int), f"bond order {bond_order} must be an integer"
             assert bond_order >= 0, f"bond order {bond_order} must be positive"
 
-        if self.bonds.has_edge(atom1, atom2):
+        if self._bonds is None:
+            current = self._bond_graph.bond_order(atom1, atom2)
+            if current != bond_order:
+                self._bond_graph.set_bond_order(atom1, atom2, bond_order)
+                if (current == 0) or (bond_order == 0):
+                    self._invalidate_topology()
+        elif self._bonds.has_edge(atom1, atom2):
+            self._own_bonds()
             if bond_order == 0:
-                self.bonds.remove_edge(atom1, atom2)
+                self._bonds.remove_edge(atom1, atom2)
+                self._invalidate_topology()
             else:
-                if self.bonds[atom1][atom2]["weight"] != bond_order:
-                    self.bonds[atom1][atom2]["weight"] = bond_order
+                if self._bonds[atom1][atom2]["weight"] != bond_order:
+                    self._bonds[atom1][atom2]["weight"] = bond_order
         elif bond_order > 0:
-            self.bonds.add_edge(atom1, atom2, weight=bond_order)
+            self._own_bonds()
+            self._bonds.add_edge(atom1, atom2, weight=bond_order)
+            self._invalidate_topology()
 
     def remove_bond(self, atom1, atom2):
         """
@@ -278,6 +430,33 @@ class Molecule:
         assert isinstance(number, int), "atomic number must be integer"
         assert 0 < number <= self.num_atoms(), "atom number {number} too large! (or too small - needs to be >0)"
 
+    def _atom_index_array(self, atoms, width):
+        """
+        Helper method which validates an array of 1-indexed atom tuples all at once.
+
+        Args:
+            atoms (list or np.ndarray): shape ``(k, width)`` (a single tuple of length ``width`` is also accepted)
+            width (int): number of atoms per tuple
+
+        Returns:
+            ``np.ndarray`` of 0-indexed atom numbers, shape ``(k, width)``
+        """
+        try:
+            atoms = np.array(atoms)
+            assert np.issubdtype(atoms.dtype, np.integer)
+        except Exception as e:
+            raise TypeError("atom numbers must be integers!")
+
+        if atoms.ndim == 1:
+            atoms = atoms.reshape(1, -1)
+        if atoms.ndim != 2 or atoms.shape[1] != width:
+            raise ValueError(f"expected array of shape (k, {width}), but got shape {atoms.shape}")
+
+        if atoms.size and ((np.min(atoms) < 1) or (np.max(atoms) > self.num_atoms())):
+            raise ValueError(f"atom numbers must be between 1 and {self.num_atoms()}")
+
+        return atoms - 1
+
     def formula(self, return_dict=False):
         """
         Returns the atomic formula.
@@ -324,6 +503,68 @@ class Molecule:
 
             return formula
 
+    def _get_topology(self):
+        """
+        Helper method which returns the cached topology index (connected components, ring atoms, bridges, and bond fragments).
+
+        The index is keyed on the identity of the bond graph and on its version counter (``BondGraph.version``, or an entry in ``_graph_versions`` for ``networkx`` graphs).
+        ``add_bond``, ``remove_bond``, ``add_atoms``, and ``remove_atoms`` increment the counter, as does handing out the editable ``networkx`` graph through ``self.bonds``,
+        so molecules sharing a bond graph (as in a ``ConformationalEnsemble``) all see the change. Only edits to a graph obtained *before* the topology was last queried go unnoticed.
+
+        Returns:
+            dictionary of cached topology
+        """
+        graph = self._bond_backend()
+        version = graph.version if self._bonds is None else _graph_versions.get(graph, 0)
+        cache = getattr(self, "_topology_cache", None)
+        if (cache is None) or (cache["graph"] is not graph) or (cache["version"] != version):
+            cache = {"graph": graph, "version": version, "fragments": {}}
+            self._topology_cache = cache
+        return cache
+
+    def _invalidate_topology(self):
+        """
+        Helper method which increments the version counter of the bond graph, discarding the cached topology index of every molecule that shares it.
+        """
+        if self._bonds is None:
+            self._bond_graph.version += 1
+        else:
+            _graph_versions[self._bonds] = _graph_versions.get(self._bonds, 0) + 1
+        self._topology_cache = None
+
+    def _get_components(self):
+        """
+        Helper method which returns the cached connected components, as a tuple of frozensets, and a dictionary mapping each atom to the index of its component.
+        """
+        topology = self._get_topology()
+        if "components" not in topology:
+            if self._bonds is None:
+                n_components, labels = self._bond_graph.connected_components()
+                atoms = np.arange(1, len(labels) + 1)
+                components = tuple(frozenset(atoms[labels == idx].tolist()) for idx in range(n_components))
+            else:
+                components = tuple(frozenset(c) for c in nx.connected_components(self._bonds))
+            topology["components"] = components
+            topology["component_of"] = {atom: idx for idx, component in enumerate(components) for atom in component}
+        return topology["components"], topology["component_of"]
+
+    def _get_rings(self):
+        """
+        Helper method which returns the cached bridges (as a frozenset of frozenset edges), biconnected blocks, and the set of atoms in at least one ring.
+        An atom is in a ring exactly when it belongs to a biconnected block of three or more atoms.
+        """
+        topology = self._get_topology()
+        if "bridges" not in topology:
+            if self._bonds is None:
+                bridges, blocks = self._bond_graph.bridges_and_blocks()
+            else:
+                bridges, blocks = nx.bridges(self._bonds), nx.biconnected_components(self._bonds)
+            blocks = tuple(frozenset(b) for b in blocks)
+            topology["blocks"] = blocks
+            topology["bridges"] = frozenset(frozenset(e) for e in bridges)
+            topology["ring_atoms"] = frozenset().union(*[b for b in blocks if len(b) > 2])
+        return topology["bridges"], topology["blocks"], topology["ring_atoms"]
+
     def _get_bond_fragments(self, atom1, atom2):
         """
         Returns the pieces of a molecule that one would obtain by ereaking the bond between two atoms. Will throw ``ValueError`` if the atoms are in a ring.
@@ -342,31 +583,36 @@ class Molecule:
         self._check_atom_number(atom1)
         self._check_atom_number(atom2)
 
-        assert self.bonds.number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
-
-        bond_order = self.get_bond_order(atom1, atom2)
-        if self.bonds.has_edge(atom1, atom2):
-            self.bonds.remove_edge(atom1, atom2)
+        assert self._bond_backend().number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
 
-            fragments = nx.connected_components(self.bonds)
-            fragment1 = []
-            fragment2 = []
-
-            for fragment in fragments:
-                if atom1 in fragment:
-                    if atom2 in fragment:
-                        self.add_bond(atom1, atom2, bond_order) # not adding back this bond causes some pretty pernicious errors
-                        raise ValueError(f"Atom {atom1} and atom {atom2} are in a ring or otherwise connected!")
-                    else:
-                        fragment1 = fragment
-                if atom2 in fragment:
-                    fragment2 = fragment
-
-            self.add_bond(atom1, atom2, bond_order)
-            return list(fragment1), list(fragment2)
-        else:
+        if not self._bond_backend().has_edge(atom1, atom2):
             raise ValueError(f"No bond between atom {atom1} and atom {atom2}!")
 
+        fragments = self._get_topology()["fragments"]
+        if (atom1, atom2) not in fragments and self._bonds is None:
+            _, labels = self._bond_graph.connected_components(ignore_bond=(atom1, atom2))
+            if labels[atom1-1] == labels[atom2-1]:
+                raise ValueError(f"Atom {atom1} and atom {atom2} are in a ring or otherwise connected!")
+            atoms = np.arange(1, len(labels) + 1)
+            fragment1, fragment2 = atoms[labels == labels[atom1-1]].tolist(), atoms[labels == labels[atom2-1]].tolist()
+            fragments[(atom1, atom2)] = (tuple(fragment1), tuple(fragment2))
+            fragments[(atom2, atom1)] = (tuple(fragment2), tuple(fragment1))
+
+        if (atom1, atom2) not in fragments:
+            bridges, _, _ = self._get_rings()
+            if frozenset((atom1, atom2)) not in bridges:
+                raise ValueError(f"Atom {atom1} and atom {atom2} are in a ring or otherwise connected!")
+
+            #### breaking a bridge splits its component in two
+            fragment1 = nx.node_connected_component(nx.restricted_view(self._bonds, [], [(atom1, atom2)]), atom1)
+            components, component_of = self._get_components()
+            fragment2 = components[component_of[atom1]] - fragment1
+            fragments[(atom1, atom2)] = (tuple(sorted(fragment1)), tuple(sorted(fragment2)))
+            fragments[(atom2, atom1)] = (tuple(sorted(fragment2)), tuple(sorted(fragment1)))
+
+        fragment1, fragment2 = fragments[(atom1, atom2)]
+        return list(fragment1), list(fragment2)
+
     def _get_fragment_containing(self, atom):
         """
         Get the fragment containing the atom with number ``atom``.
@@ -380,11 +626,101 @@ class Molecule:
 
         self._check_atom_number(atom)
 
-        fragments = nx.connected_components(self.bonds)
+        components, component_of = self._get_components()
+        return list(components[component_of[atom]])
 
-        for fragment in fragments:
-            if atom in fragment:
-                return list(fragment)
+    def _get_atoms_to_move(self, atoms, move):
+        """
+        Determines which atoms move when a distance, angle, or dihedral angle is adjusted.
+        The last atom (and whatever is attached to it, depending on ``move``) is moved and the rest are held constant.
+
+        Args:
+            atoms (list): 2, 3, or 4 atom numbers
+            move (str): determines how fragment moving is handled (see ``set_distance``, ``set_angle``, and ``set_dihedral``)
+
+        Returns:
+            list of atom numbers to move
+        """
+        if len(atoms) == 2:
+            atom1, atom2 = atoms
+            if move == "group":
+                if self.get_bond_order(atom1, atom2):
+                    _, atoms_to_move = self._get_bond_fragments(atom1, atom2)
+                else:
+                    atoms_to_move = self._get_fragment_containing(atom2)
+            elif move == "atom":
+                atoms_to_move = [atom2]
+            else:
+                raise ValueError(f"Invalid option {move} for parameter 'move'!")
+
+            if (atom1 in atoms_to_move and atom2 in atoms_to_move) and move == "group":
+                raise ValueError('both our atoms are connected which will preclude any movement with ``move`` set to "group"')
+        elif len(atoms) == 3:
+            atom1, atom2, atom3 = atoms
+            if move == "group":
+                if self.get_bond_order(atom2, atom3):
+                    _, atoms_to_move = self._get_bond_fragments(atom2, atom3)
+                elif self.are_connected(atom2, atom3):
+                    raise ValueError(
+                        f"atom {atom2} and atom {atom3} are connected but not bonded -- cannot adjust angle! try manually removing one or more bonds."
+                    )
+                else:
+                    atoms_to_move = self._get_fragment_containing(atom3)
+            elif move == "atom":
+                atoms_to_move = [atom3]
+            else:
+                raise ValueError(f"Invalid option {move} for parameter 'move'!")
+
+            if atom1 in atoms_to_move:
+                raise ValueError(
+                    f"atom {atom1} and atom {atom3} are connected in multiple ways -- cannot adjust angle! try manually removing one or more bonds."
+                )
+        elif len(atoms) == 4:
+            atom1, atom2, atom3, atom4 = atoms
+            if move == "group34":
+                #### add atom3's fragment to atom4
+                if self.get_bond_order(atom2, atom3):
+                    _, atoms_to_move = self._get_bond_fragments(atom2, atom3)
+                elif self.are_connected(atom2, atom3):
+                    raise ValueError(
+                        f"atom {atom2} and atom {atom3} are connected but not bonded -- cannot adjust dihedral angle! try manually removing one or more bonds."
+                    )
+                else:
+                    atoms_to_move = self._get_fragment_containing(atom3)
+
+                #### and make sure atom4 is in there too!
+                if atom4 not in atoms_to_move:
+                    atoms_to_move += self._get_fragment_containing(atom4)
+            elif move == "group4":
+                if self.get_bond_order(atom3, atom4):
+                    _, atoms_to_move = self._get_bond_fragments(atom3, atom4)
+                elif self.are_connected(atom3, atom4):
+                    raise ValueError(
+                        f"atom {atom3} and atom {atom4} are connected but not bonded -- cannot adjust dihedral angle! try manually removing one or more bonds."
+                    )
+                else:
+                    atoms_to_move = self._get_fragment_containing(atom4)
+            elif move == "atom":
+                atoms_to_move = [atom4]
+            else:
+                raise ValueError(f"Invalid option {move} for parameter 'move'!")
+
+            if atom1 in atoms_to_move:
+                raise ValueError(
+                    f"atom {atom1} and atom {atom4} are connected in multiple ways -- cannot adjust dihedral angle! try manually removing one or more bonds."
+                )
+
+            if atom2 in atoms_to_move:
+                raise ValueError(
+                    f"atom {atom2} and atom {atom4} are connected in multiple ways -- cannot adjust dihedral angle! try manually removing one or more bonds."
+                )
+
+            if atom4 not in atoms_to_move:
+                raise ValueError(f"atom {atom4} is not going to be moved... this operation is doomed to fail!")
+        else:
+            raise ValueError(f"need 2, 3, or 4 atoms, but got {len(atoms)}")
+
+        return atoms_to_move
 
     def set_distance(self, atom1=None, atom2=None, distance=None, move="group", atoms=None):
         """
@@ -419,19 +755,7 @@ class Molecule:
         if (not isinstance(distance, float)) or (distance < 0):
             raise ValueError(f"invalid value {distance} for distance!")
 
-        atoms_to_move = []
-        if move == "group":
-            if self.get_bond_order(atom1, atom2):
-                _, atoms_to_move = self._get_bond_fragments(atom1, atom2)
-            else:
-                atoms_to_move = self._get_fragment_containing(atom2)
-        elif move == "atom":
-            atoms_to_move = [atom2]
-        else:
-            raise ValueError(f"Invalid option {move} for parameter 'move'!")
-
-        if (atom1 in atoms_to_move and atom2 in atoms_to_move) and move == "group":
-            raise ValueError('both our atoms are connected which will preclude any movement with ``move`` set to "group"')
+        atoms_to_move = self._get_atoms_to_move([atom1, atom2], move)
 
         current_distance = self.get_distance(atom1, atom2)
 
@@ -509,25 +833,7 @@ class Molecule:
         if (not isinstance(angle, float)) or ((angle < 0) or (angle > 360)):
             raise ValueError(f"invalid value {angle} for angle!")
 
-        atoms_to_move = []
-        if move == "group":
-            if self.get_bond_order(atom2, atom3):
-                _, atoms_to_move = self._get_bond_fragments(atom2, atom3)
-            elif self.are_connected(atom2, atom3):
-                raise ValueError(
-                    f"atom {atom2} and atom {atom3} are connected but not bonded -- cannot adjust angle! try manually removing one or more bonds."
-                )
-            else:
-                atoms_to_move = self._get_fragment_containing(atom3)
-        elif move == "atom":
-            atoms_to_move = [atom3]
-        else:
-            raise ValueError(f"Invalid option {move} for parameter 'move'!")
-
-        if atom1 in atoms_to_move:
-            raise ValueError(
-                f"atom {atom1} and atom {atom3} are connected in multiple ways -- cannot adjust angle! try manually removing one or more bonds."
-            )
+        atoms_to_move = self._get_atoms_to_move([atom1, atom2, atom3], move)
 
         current_angle = self.get_angle(atom1, atom2, atom3)
         delta = angle - current_angle
@@ -602,7 +908,7 @@ class Molecule:
         self._check_atom_number(atom4)
 
         # check there is bond connectivity information
-        assert len(self.bonds) > 0, "no bond connectivity information"
+        assert len(self._bond_backend()) > 0, "no bond connectivity information"
 
         # check for collinearity
         angle = self.get_angle(atom1, atom2, atom3, check=False)
@@ -626,47 +932,7 @@ class Molecule:
         if (not isinstance(dihedral, float)) or ((dihedral < 0) or (dihedral > 360)):
             raise ValueError(f"invalid value {dihedral} for dihedral angle!")
 
-        atoms_to_move = []
-        if move == "group34":
-            #### add atom3's fragment to atom4
-            if self.get_bond_order(atom2, atom3):
-                _, atoms_to_move = self._get_bond_fragments(atom2, atom3)
-            elif self.are_connected(atom2, atom3):
-                raise ValueError(
-                    f"atom {atom2} and atom {atom3} are connected but not bonded -- cannot adjust dihedral angle! try manually removing one or more bonds."
-                )
-            else:
-                atoms_to_move = self._get_fragment_containing(atom3)
-
-            #### and make sure atom4 is in there too!
-            if atom4 not in atoms_to_move:
-                atoms_to_move += self._get_fragment_containing(atom4)
-        elif move == "group4":
-            if self.get_bond_order(atom3, atom4):
-                _, atoms_to_move = self._get_bond_fragments(atom3, atom4)
-            elif self.are_connected(atom3, atom4):
-                raise ValueError(
-                    f"atom {atom3} and atom {atom4} are connected but not bonded -- cannot adjust dihedral angle! try manually removing one or more bonds."
-                )
-            else:
-                atoms_to_move = self._get_fragment_containing(atom4)
-        elif move == "atom":
-            atoms_to_move = [atom4]
-        else:
-            raise ValueError(f"Invalid option {move} for parameter 'move'!")
-
-        if atom1 in atoms_to_move:
-            raise ValueError(
-                f"atom {atom1} and atom {atom4} are connected in multiple ways -- cannot adjust dihedral angle! try manually removing one or more bonds."
-            )
-
-        if atom2 in atoms_to_move:
-            raise ValueError(
-                f"atom {atom2} and atom {atom4} are connected in multiple ways -- cannot adjust dihedral angle! try manually removing one or more bonds."
-            )
-
-        if atom4 not in atoms_to_move:
-            raise ValueError(f"atom {atom4} is not going to be moved... this operation is doomed to fail!")
+        atoms_to_move = self._get_atoms_to_move([atom1, atom2, atom3, atom4], move)
 
         current_dihedral = self.get_dihedral(atom1, atom2, atom3, atom4, check=False)
         delta = (dihedral - current_dihedral) % 360
@@ -698,6 +964,99 @@ class Molecule:
 
         return self
 
+    def scan(self, coordinates, values, move=None):
+        """
+        Generates a grid of geometries with fixed distances, angles, and/or dihedral angles in one vectorized pass.
+
+        Each grid point is equivalent to calling ``set_distance``, ``set_angle``, or ``set_dihedral`` for every coordinate (in order) on a copy of this molecule,
+        but the moving fragments are only determined once and all grid points are rotated at the same time.
+
+        Args:
+            coordinates (list): list of atom-number tuples -- 2 atoms for a distance, 3 for an angle, 4 for a dihedral angle
+            values (list): list of target values for each coordinate (Å or degrees); every combination is generated
+            move (list): how fragment moving is handled for each coordinate (defaults to "group" for distances and angles and "group34" for dihedral angles)
+
+        Returns:
+            ``ConformationalEnsemble`` with one conformer per grid point (the last coordinate varies fastest), sharing one bond graph.
+            The target values of each conformer are stored in the ``scan_values`` property.
+        """
+        assert isinstance(coordinates, (list, tuple)) and len(coordinates) > 0, "need a list of coordinates to scan"
+        assert isinstance(values, (list, tuple)) and len(values) == len(coordinates), "need a list of values for every coordinate"
+        if move is None:
+            move = ["group34" if len(c) == 4 else "group" for c in coordinates]
+        assert len(move) == len(coordinates), "need a move option for every coordinate"
+
+        # check there is bond connectivity information
+        assert len(self._bond_backend()) > 0, "no bond connectivity information"
+
+        atom_indices = [self._atom_index_array(c, len(c))[0] for c in coordinates]
+        for atoms, target_values in zip(coordinates, values):
+            if len(atoms) not in [2, 3, 4]:
+                raise ValueError(f"need 2, 3, or 4 atoms per coordinate, but got {atoms}")
+            if len(atoms) > 2:
+                angle = self.get_angle(*atoms[:3], check=False)
+                assert 0.0001 < angle < 179.9999, f"atoms {atoms[:3]} are collinear (angle={angle:.8f})"
+            if len(atoms) == 4:
+                angle = self.get_angle(*atoms[1:], check=False)
+                assert 0.0001 < angle < 179.9999, f"atoms {atoms[1:]} are collinear (angle={angle:.8f})"
+
+            target_values = np.asarray(target_values, dtype=np.float64)
+            assert target_values.ndim == 1 and len(target_values) > 0, f"need a list of values for coordinate {atoms}"
+            if (np.min(target_values) < 0) or ((len(atoms) > 2) and (np.max(target_values) > 360)):
+                raise ValueError(f"invalid values {target_values} for coordinate {atoms}!")
+
+        #### the moving fragments only depend on the topology, so find them once
+        moving_atoms = [np.array(self._get_atoms_to_move(list(c), m)) - 1 for c, m in zip(coordinates, move)]
+
+        grid = np.stack([np.ravel(g) for g in np.meshgrid(*values, indexing="ij")], axis=-1).astype(np.float64)
+        geometries = self._scan_geometries(atom_indices, moving_atoms, grid)
+
+        template = cctk.ConformationalEnsemble(name=self.name)
+        template.add_molecule(Molecule(self.atomic_numbers, self.geometry, name=self.name, bonds=self.bonds.copy(), charge=self.charge, multiplicity=self.multiplicity, checks=False))
+        ensemble = template._new_from_geometries(geometries, indices=[0] * len(grid))
+        for properties, scan_values in zip(ensemble.properties_list(), grid):
+            properties["scan_values"] = scan_values
+
+        return ensemble
+
+    def _scan_geometries(self, atom_indices, moving_atoms, grid):
+        """
+        Helper method which applies every row of ``grid`` to a copy of this molecule's coordinates at once (see ``scan``).
+
+        Args:
+            atom_indices (list): 0-indexed atom numbers of each coordinate
+            moving_atoms (list): 0-indexed atom numbers that move with each coordinate
+            grid (np.ndarray): target values, shape ``(n_points, n_coordinates)``
+
+        Returns:
+            ``np.ndarray`` of coordinates, shape ``(n_points, n_atoms, 3)``
+        """
+        geometries = np.repeat(self.geometry.view(np.ndarray)[np.newaxis].astype(np.float64), len(grid), axis=0)
+
+        for k, (indices, moving) in enumerate(zip(atom_indices, moving_atoms)):
+            current = compute_internal_coordinates(geometries, indices[np.newaxis])[:, 0]
+            points = [geometries[:, i] for i in indices]
+
+            if len(indices) == 2:
+                unit_vectors = (points[1] - points[0]) / np.linalg.norm(points[1] - points[0], axis=-1, keepdims=True)
+                geometries[:, moving] += ((grid[:, k] - current)[:, np.newaxis] * unit_vectors)[:, np.newaxis]
+                continue
+
+            if len(indices) == 3:
+                origins = points[1]
+                rot_axes = np.cross(points[0] - origins, points[2] - origins)
+                deltas = grid[:, k] - current
+            else:
+                origins = points[2]
+                rot_axes = origins - points[1]
+                deltas = (grid[:, k] - current) % 360
+
+            rot_matrices = compute_rotation_matrices(rot_axes, deltas)
+            centered = geometries[:, moving] - origins[:, np.newaxis]
+            geometries[:, moving] = np.einsum("pij,pmj->pmi", rot_matrices, centered) + origins[:, np.newaxis]
+
+        return geometries
+
     def translate_molecule(self, vector):
         """
         Translates the whole molecule by the given vector.
@@ -805,12 +1164,54 @@ class Molecule:
         if not isinstance(symbol, str):
             raise TypeError(f"symbol {symbol} must be a string!")
 
-        number = get_number(symbol)
-        self.atomic_numbers = np.append(self.atomic_numbers, [number]).astype(np.int8).view(cctk.OneIndexedArray)
-        self.geometry = np.append(self.geometry, [coordinates], axis=0).view(cctk.OneIndexedArray)
-        self.bonds.add_node(self.num_atoms())
+        return self.add_atoms([get_number(symbol)], [coordinates])
 
-        return self
+    def add_atoms(self, atomic_numbers, coordinates, return_mapping=False):
+        """
+        Add many atoms at once, appended to the end of the atom list. The arrays and the bond graph are each resized only once.
+
+        Args:
+            atomic_numbers (list or np.ndarray): atomic numbers (or symbols) of the new atoms
+            coordinates (list or np.ndarray): coordinates of the new atoms, shape ``(k, 3)``
+            return_mapping (bool): whether or not to return the numbers assigned to the new atoms
+
+        Returns:
+            the Molecule object
+
+            (optional) list of the new 1-indexed atom numbers, in the order given
+        """
+        atomic_numbers = [get_number(z) if isinstance(z, str) else z for z in atomic_numbers]
+        try:
+            atomic_numbers = np.array(atomic_numbers, dtype=np.int8).reshape(-1)
+        except Exception as e:
+            raise TypeError("atomic_numbers must be castable to integers!")
+
+        try:
+            coordinates = np.array(coordinates).reshape(-1, 3)
+            assert np.issubdtype(coordinates.dtype, np.number)
+        except Exception as e:
+            raise TypeError("coordinates must be numbers, with shape (k, 3)!")
+
+        if len(coordinates) != len(atomic_numbers):
+            raise ValueError(f"got {len(atomic_numbers)} atomic numbers but {len(coordinates)} sets of coordinates!")
+
+        n_atoms = self.num_atoms()
+        new_atoms = list(range(n_atoms + 1, n_atoms + len(atomic_numbers) + 1))
+
+        self.atomic_numbers = np.concatenate([self.atomic_numbers.view(np.ndarray), atomic_numbers]).view(cctk.OneIndexedArray)
+        self.geometry = np.concatenate([self.geometry.view(np.ndarray), coordinates]).view(cctk.OneIndexedArray)
+
+        if self._bonds is None:
+            edges, orders = self._bond_graph.edges()
+            self.bonds = BondGraph(n_atoms + len(new_atoms), edges, orders)
+        else:
+            self.bonds.add_nodes_from(new_atoms)
+        self._invalidate_topology()
+
+        if return_mapping:
+            return self, new_atoms
+        else:
+            return self
 
     def remove_atom(self, number):
         """
@@ -824,18 +1225,53 @@ class Molecule:
         """
 
         self._check_atom_number(number)
+        return self.remove_atoms([number])
 
-        try:
-            self.bonds.remove_node(number)
-            self.geometry = np.delete(self.geometry, number - 1, axis=0).view(cctk.OneIndexedArray)
-            self.atomic_numbers = np.delete(self.atomic_numbers, number - 1).view(cctk.OneIndexedArray)
+    def remove_atoms(self, numbers, return_mapping=False):
+        """
+        Remove many atoms at once. The remaining atoms keep their order and are renumbered to fill the gaps;
+        the arrays are rebuilt and the bond graph relabeled only once.
+
+        Args:
+            numbers (list or np.ndarray): numbers of the atoms to remove
+            return_mapping (bool): whether or not to return a dictionary mapping old atom numbers to new atom numbers
 
-            #### need to renumber to fill gaps
-            self.bonds = nx.convert_node_labels_to_integers(self.bonds, first_label=1, ordering="sorted")
+        Returns:
+            the Molecule object
+
+            (optional) dictionary mapping old atom numbers (key) to new atom numbers (val), or ``None`` for removed atoms
+        """
+        numbers = np.unique(np.asarray(numbers, dtype=np.int64).reshape(-1))
+        for number in numbers:
+            self._check_atom_number(int(number))
 
+        n_atoms = self.num_atoms()
+        keep = np.ones(shape=n_atoms, dtype=bool)
+        keep[numbers - 1] = False
+        new_numbers = np.zeros(shape=n_atoms + 1, dtype=np.int64)
+        new_numbers[1:][keep] = np.arange(1, np.count_nonzero(keep) + 1)
+
+        self.geometry = self.geometry.view(np.ndarray)[keep].view(cctk.OneIndexedArray)
+        self.atomic_numbers = self.atomic_numbers.view(np.ndarray)[keep].view(cctk.OneIndexedArray)
+
+        #### relabel the bond graph in one pass (without touching a graph that might be shared with a clone)
+        if self._bonds is None:
+            edges, orders = self._bond_graph.edges()
+            edges = new_numbers[edges]
+            kept = np.all(edges > 0, axis=1)
+            self.bonds = BondGraph(len(self.atomic_numbers), edges[kept], orders[kept])
+        else:
+            relabel = new_numbers.tolist()
+            graph = nx.Graph()
+            graph.add_nodes_from((relabel[n], d) for n, d in sorted(self._bonds.nodes(data=True)) if relabel[n])
+            graph.add_edges_from((relabel[i], relabel[j], d) for i, j, d in self._bonds.edges(data=True) if relabel[i] and relabel[j])
+            self.bonds = graph
+        self._invalidate_topology()
+
+        if return_mapping:
+            return self, {old: (new or None) for old, new in enumerate(new_numbers.tolist()[1:], start=1)}
+        else:
             return self
-        except Exception as e:
-            raise ValueError("removing atom {number} failed!")
 
     def get_atomic_number(self, atom):
         """
@@ -1053,6 +1489,42 @@ class Molecule:
             self.get_vector(atom4, check=False),
         )
 
+    def get_distances(self, atoms):
+        """
+        Computes many distances at once.
+
+        Args:
+            atoms (np.ndarray): 1-indexed atom numbers, shape ``(k, 2)``
+
+        Returns:
+            ``np.ndarray`` of distances in Angstroms, shape ``(k,)``
+        """
+        return compute_internal_coordinates(self.geometry.view(np.ndarray), self._atom_index_array(atoms, 2))
+
+    def get_angles(self, atoms):
+        """
+        Computes many angles at once.
+
+        Args:
+            atoms (np.ndarray): 1-indexed atom numbers, shape ``(k, 3)``
+
+        Returns:
+            ``np.ndarray`` of angles in degrees, shape ``(k,)``
+        """
+        return compute_internal_coordinates(self.geometry.view(np.ndarray), self._atom_index_array(atoms, 3))
+
+    def get_dihedrals(self, atoms):
+        """
+        Computes many dihedral angles at once.
+
+        Args:
+            atoms (np.ndarray): 1-indexed atom numbers, shape ``(k, 4)``
+
+        Returns:
+            ``np.ndarray`` of dihedral angles in degrees, shape ``(k,)``
+        """
+        return compute_internal_coordinates(self.geometry.view(np.ndarray), self._atom_index_array(atoms, 4))
+
     def get_bond_order(self, atom1, atom2):
         """
         Wrapper to get bond order between two atoms.
@@ -1067,8 +1539,11 @@ class Molecule:
         self._check_atom_number(atom1)
         self._check_atom_number(atom2)
 
-        if self.bonds.has_edge(atom1, atom2):
-            return self.bonds[atom1][atom2]["weight"]
+        if self._bonds is None:
+            return self._bond_graph.bond_order(atom1, atom2)
+
+        if self._bonds.has_edge(atom1, atom2):
+            return self._bonds[atom1][atom2]["weight"]
         else:
             return 0
 
@@ -1079,10 +1554,8 @@ class Molecule:
         self._check_atom_number(atom1)
         self._check_atom_number(atom2)
 
-        if atom1 in self._get_fragment_containing(atom2):
-            return True
-        else:
-            return False
+        _, component_of = self._get_components()
+        return component_of[atom1] == component_of[atom2]
 
     def get_atoms_by_symbol(self, symbol):
         """
@@ -1123,7 +1596,7 @@ class Molecule:
 
         self._check_atom_number(atom)
 
-        return list(self.bonds.neighbors(atom))
+        return [int(a) for a in self._bond_backend().neighbors(atom)]
 
     def num_atoms(self):
         return len(self.atomic_numbers)
@@ -1141,9 +1614,9 @@ class Molecule:
 
         return math.sqrt(distance) / self.num_atoms()
 
-    def optimize_dihedral(self, atom1, atom2, atom3, atom4, step=10):
+    def optimize_dihedral(self, atom1, atom2, atom3, atom4, step=10, score="rms"):
         """
-        Minimizes the value of ``self.rms_distance_between_atoms`` for the given dihedral, in one-degree increments.
+        Minimizes steric clashes for the given dihedral by trying every angle from 0 to 360 at once (see ``optimize_dihedrals``).
         A cheap alternative to geometry optimization using *ab initio* methods or density functional theory.
 
         Args:
@@ -1152,26 +1625,81 @@ class Molecule:
             atom3 (int): atom number of the third atom in the dihedral
             atom4 (int): atom number of the fourth atom in the dihedral
             step (float): explore angles from 0 to 360 with this stepsize in degrees
+            score (str): "rms" to maximize ``self.rms_distance_between_atoms``, or "clash" to minimize a van der Waals repulsion term
 
         Returns:
             the final value of the angle
         """
-        self._check_atom_number(atom1)
-        self._check_atom_number(atom2)
-        self._check_atom_number(atom3)
-        self._check_atom_number(atom4)
+        return self.optimize_dihedrals([(atom1, atom2, atom3, atom4)], step=step, score=score)[0]
 
-        best_angle = 0
-        best_dist = 0
+    def optimize_dihedrals(self, dihedrals, step=10, score="rms", max_pairs=2**22):
+        """
+        Jointly optimizes several dihedral angles, scoring every combination of angles in vectorized batches.
 
-        for angle in range(0, 360, step):
-            self.set_dihedral(atom1, atom2, atom3, atom4, angle)
-            if self.rms_distance_between_atoms() > best_dist:
-                best_dist = self.rms_distance_between_atoms()
-                best_angle = angle
+        The moving fragments are found once, and only atom pairs whose distance can change (i.e. pairs split by at least one rotation) are scored:
+            - "rms" maximizes the sum of squared distances, which is equivalent to maximizing ``self.rms_distance_between_atoms``
+            - "clash" minimizes the sum of ``((r_i + r_j) / d_ij) ** 12`` with van der Waals radii ``r``
 
-        self.set_dihedral(atom1, atom2, atom3, atom4, best_angle)
-        return best_angle
+        Args:
+            dihedrals (list): list of 4-atom tuples
+            step (float): explore angles from 0 to 360 with this stepsize in degrees
+            score (str): "rms" or "clash"
+            max_pairs (int): approximate number of pair distances to evaluate per batch
+
+        Returns:
+            list of the final values of the angles
+        """
+        if score not in ["rms", "clash"]:
+            raise ValueError(f"Invalid option {score} for parameter 'score'!")
+        assert isinstance(dihedrals, (list, tuple)) and len(dihedrals) > 0, "need a list of dihedrals to optimize"
+        for atoms in dihedrals:
+            assert len(atoms) == 4, "need 4 atom numbers per dihedral"
+            for atom in atoms:
+                self._check_atom_number(atom)
+
+        angles = np.arange(0, 360, step)
+        atom_indices = [np.array(atoms) - 1 for atoms in dihedrals]
+        moving_atoms = [np.array(self._get_atoms_to_move(list(atoms), "group34")) - 1 for atoms in dihedrals]
+
+        #### only pairs that are split by at least one rotation change distance
+        n_atoms = self.num_atoms()
+        in_fragment = np.zeros(shape=(n_atoms, len(dihedrals)), dtype=bool)
+        for k, moving in enumerate(moving_atoms):
+            in_fragment[moving, k] = True
+        i, j = np.triu_indices(n_atoms, k=1)
+        varies = np.any(in_fragment[i] != in_fragment[j], axis=-1)
+        i, j = i[varies], j[varies]
+
+        if score == "clash":
+            vdw_radii = {z: get_vdw_radius(z) for z in set(self.atomic_numbers)}
+            radii = np.array([vdw_radii[z] for z in self.atomic_numbers])
+            contact_sq = (radii[i] + radii[j]) ** 2
+
+        grid_shape = [len(angles)] * len(dihedrals)
+        n_points = int(np.prod(grid_shape))
+        batch_size = max(1, max_pairs // max(len(i), n_atoms))
+
+        best_value, best_point = -np.inf, 0
+        for start in range(0, n_points, batch_size):
+            points = np.arange(start, min(start + batch_size, n_points))
+            grid = angles[np.stack(np.unravel_index(points, grid_shape), axis=-1)]
+            geometries = self._scan_geometries(atom_indices, moving_atoms, grid)
+
+            sq_distances = np.sum((geometries[:, i] - geometries[:, j]) ** 2, axis=-1)
+            if score == "rms":
+                values = np.sum(sq_distances, axis=-1)
+            else:
+                values = -1 * np.sum((contact_sq / sq_distances) ** 6, axis=-1)
+
+            best = np.argmax(values)
+            if values[best] > best_value:
+                best_value, best_point = values[best], points[best]
+
+        best_angles = angles[np.array(np.unravel_index(best_point, grid_shape))].tolist()
+        for atoms, angle in zip(dihedrals, best_angles):
+            self.set_dihedral(*atoms, angle)
+
+        return best_angles
 
     def atom_string(self, atom):
         """
@@ -1245,45 +1773,26 @@ class Molecule:
 
         return Molecule(atoms, geoms, charge=charge, multiplicity=multiplicity)
 
-    def volume(self, pts_per_angstrom=10, qhull=False):
+    def volume(self, pts_per_angstrom=10, qhull=False, nprocs=1):
         """
-        Returns volume calculated using the Gavezotti algorithm (JACS, 1983, 105, 5220). Relatively slow.
+        Returns volume calculated using the Gavezotti algorithm (JACS, 1983, 105, 5220).
+        The grid is evaluated in slabs, with each atom only testing nearby grid points, so memory use stays bounded.
         If MemoryError, defaults to a qhull-based approach (accurate in the limit as number of atoms goes to infinity)
 
         Args:
             pts_per_angstrom (int): how many grid points to use per Å - time scales as O(n**3) so be careful!
             qhull (bool): use faster QHull algorithm
+            nprocs (int): number of threads to spread grid slabs over
 
         Returns:
             volume in Å**3
         """
         if not qhull:
             try:
-                assert isinstance(pts_per_angstrom, int), "Need an integer number of pts per Å!"
-                assert pts_per_angstrom > 0, "Need a positive integer of pts per Å!"
-
-                box_max = np.max(self.geometry.view(np.ndarray), axis=0) + 4
-                box_min = np.min(self.geometry.view(np.ndarray), axis=0) - 4
-
-                box_volume = (box_max[0] - box_min[0]) * (box_max[1] - box_min[1]) * (box_max[2] - box_min[2])
-
-                x_vals = np.linspace(box_min[0], box_max[0], int((box_max[0] - box_min[0]) * pts_per_angstrom))
-                y_vals = np.linspace(box_min[1], box_max[1], int((box_max[1] - box_min[1]) * pts_per_angstrom))
-                z_vals = np.linspace(box_min[2], box_max[2], int((box_max[2] - box_min[2]) * pts_per_angstrom))
-
-                # h4ck3r
-                box_pts = np.stack([np.ravel(a) for a in np.meshgrid(x_vals, y_vals, z_vals)], axis=-1)
-
                 # caching to speed call
                 vdw_radii = {z: get_vdw_radius(z) for z in set(self.atomic_numbers)}
-                radii_per_atom = np.array([vdw_radii[z] for z in self.atomic_numbers]).reshape(-1,1)
-
-                # this is the slow part since it's approximately a zillion operations
-                dists_per_atom = cdist(self.geometry.view(np.ndarray), box_pts)
-                occupied = np.sum(np.max(dists_per_atom < radii_per_atom, axis=0))
-
-                percent_occupied = occupied / box_pts.shape[0]
-                return percent_occupied * box_volume
+                radii_per_atom = np.array([vdw_radii[z] for z in self.atomic_numbers])
+                return compute_grid_volume(self.geometry.view(np.ndarray), radii_per_atom, pts_per_angstrom=pts_per_angstrom, nprocs=nprocs)
             except MemoryError:
                 qhull = True
 
@@ -1305,7 +1814,7 @@ class Molecule:
         """
         self._check_atom_number(atom1)
         self._check_atom_number(atom2)
-        mol = copy.deepcopy(self)
+        mol = self.clone()
 
         z1 = mol.atomic_numbers[atom1]
         z2 = mol.atomic_numbers[atom2]
@@ -1339,7 +1848,7 @@ class Molecule:
         self._check_atom_number(substituent1)
         self._check_atom_number(substituent2)
 
-        assert self.bonds.number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
+        assert self._bond_backend().number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
 
         adj = self.get_adjacent_atoms(center_atom)
         assert len(adj) == 4, "center atom must be making 4 bonds!"
@@ -1366,6 +1875,8 @@ class Molecule:
         """
         Renumbers atoms to match ``model`` (must have isomorphic bond graph). Returns a copy of ``self`` with renumbered atoms.
 
+        Canonical colors are cached on ``model``, so renumbering many structures against the same model is fast.
+
         Args:
             model (cctk.Molecule): isomorphic molecule to renumber by
             check_chirality (list of atomic numbers): atomic numbers to check, to prevent inversion due to graph isomorphism.
@@ -1375,21 +1886,16 @@ class Molecule:
             new ``Molecule`` object
         """
 
-        assert self.bonds.number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
+        assert self._bond_backend().number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
 
-        #### use networkx to generate mapping
-        #### you need the node matcher to distinguish between e.g. H, F, Cl
-        self._add_atomic_numbers_to_nodes()
-        model._add_atomic_numbers_to_nodes()
-        nm = nx.algorithms.isomorphism.categorical_node_match("atomic_number", 0)
-
-        match = nx.algorithms.isomorphism.GraphMatcher(model.bonds, self.bonds, node_match=nm)
-        assert match.is_isomorphic(), "can't renumber non-isomorphic graphs!"
-        new_ordering = [match.mapping[x] for x in range(1, self.num_atoms() + 1)]
-        inv_mapping = {v:k  for k,v in match.mapping.items()} # bit kludgy but works
+        #### canonical colors (cached on each molecule) distinguish between e.g. H, F, Cl and settle most atoms without any graph search
+        mapping = top.find_isomorphism(model, self)
+        assert mapping is not None, "can't renumber non-isomorphic graphs!"
+        new_ordering = [mapping[x] for x in range(1, self.num_atoms() + 1)]
+        inv_mapping = {v:k  for k,v in mapping.items()} # bit kludgy but works
 
         #### create renumbered molecule
-        mol = copy.deepcopy(self)
+        mol = self.clone()
         mol.atomic_numbers = self.atomic_numbers[new_ordering]
         mol.geometry = self.geometry[new_ordering]
         mol.bonds = nx.relabel_nodes(self.bonds, mapping=inv_mapping, copy=True)
@@ -1436,26 +1942,107 @@ class Molecule:
         nx.set_node_attributes(self.bonds, {z: {"atomic_number": self.atomic_numbers[z]} for z in range(1, self.num_atoms() +  1)})
 
     def is_atom_in_ring(self, atom):
-        assert self.bonds.number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
-        cycles = nx.cycle_basis(self.bonds, root=atom)
-        for cycle in cycles:
-            if atom in cycle:
-                return True
-        return False
+        """
+        Returns ``True`` if ``atom`` is part of at least one ring.
+        """
+        assert self._bond_backend().number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
+        _, _, ring_atoms = self._get_rings()
+        return atom in ring_atoms
 
     def get_components(self):
         """
         Returns a list of all the connected components in a molecule.
         """
-        assert self.bonds.number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
-        fragments = nx.connected_components(self.bonds)
-        return [list(f) for f in list(fragments)]
+        assert self._bond_backend().number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
+        components, _ = self._get_components()
+        return [list(f) for f in components]
+
+    def _get_component_labels(self):
+        """
+        Helper method which returns the cached index of each atom's connected component, as an array of shape ``(num_atoms,)`` (0-indexed, so ``labels[atom-1]``).
+        Components are numbered in the same order as ``get_components()``.
+        """
+        topology = self._get_topology()
+        if "component_labels" not in topology:
+            components, _ = self._get_components()
+            labels = np.zeros(shape=self.num_atoms(), dtype=np.int64)
+            for idx, component in enumerate(components):
+                labels[np.fromiter(component, dtype=np.int64) - 1] = idx
+            topology["component_labels"] = labels
+        return topology["component_labels"]
+
+    def _slice_atoms(self, atoms):
+        """
+        Helper method which returns a new molecule containing only ``atoms`` (in the order given), built in one pass instead of repeated ``remove_atom()`` calls.
+        Bonds between kept atoms are preserved and renumbered; vibrational modes are not carried over.
+
+        Args:
+            atoms (np.ndarray): 1-indexed atom numbers to keep
+
+        Returns:
+            new ``Molecule`` object
+        """
+        atoms = np.asarray(atoms, dtype=np.int64)
+        new_numbers = np.zeros(shape=self.num_atoms() + 1, dtype=np.int64)
+        new_numbers[atoms] = np.arange(1, len(atoms) + 1)
+
+        if self._bonds is None:
+            edges, orders = self._bond_graph.edges()
+        else:
+            edge_list = list(self._bonds.edges(data="weight", default=1))
+            edges = np.array([e[:2] for e in edge_list], dtype=np.int64).reshape(-1, 2)
+            orders = np.array([e[2] for e in edge_list], dtype=np.int8)
+        edges = new_numbers[edges]
+        kept = np.all(edges > 0, axis=1)
+
+        bonds = BondGraph(len(atoms), edges[kept], orders[kept])
+        if self._bonds is not None:
+            bonds = bonds.to_networkx()
+
+        return Molecule(self.atomic_numbers.view(np.ndarray)[atoms - 1], self.geometry.view(np.ndarray)[atoms - 1], name=self.name, bonds=bonds, charge=self.charge, multiplicity=self.multiplicity, checks=False)
+
+    def _solvent_shell_mask(self, geometry, labels, solute=0, num_atoms=0, num_solvents=10, distance_from_atom=None):
+        """
+        Helper method for ``limit_solvent_shell()``, which works on one set of coordinates and precomputed component labels (so the labels can be reused across frames).
+
+        Args:
+            geometry (np.ndarray): coordinates, shape ``(num_atoms, 3)``
+            labels (np.ndarray): component index of every atom, shape ``(num_atoms,)``
+
+        Returns:
+            boolean mask of atoms to keep, shape ``(num_atoms,)``
+        """
+        n_fragments = int(labels.max()) + 1
+        is_solute = labels == solute
+        if distance_from_atom:
+            solute_x = geometry[[distance_from_atom - 1]]
+        else:
+            solute_x = geometry[is_solute]
+
+        #### minimum distance from every solvent atom to the solute, then the minimum over each fragment
+        distances = np.full(n_fragments, np.inf)
+        if np.any(~is_solute):
+            atom_distances, _ = cKDTree(solute_x).query(geometry[~is_solute])
+            np.minimum.at(distances, labels[~is_solute], atom_distances)
+        distances[solute] = 0
+
+        #### reverse order - farthest away comes first
+        order = np.argsort(distances)[::-1]
+
+        #### find the first point at which enough fragments have been removed
+        remaining_atoms = len(labels) - np.cumsum(np.bincount(labels, minlength=n_fragments)[order])
+        remaining_solvents = n_fragments - 1 - np.arange(1, n_fragments + 1)
+        stop = np.flatnonzero((remaining_atoms <= num_atoms) | (remaining_solvents == num_solvents))
+        assert len(stop), "can't satisfy the requested number of atoms or solvents"
+
+        return ~np.isin(labels, order[:stop[0] + 1])
 
     def limit_solvent_shell(self, solute=0, num_atoms=0, num_solvents=10, distance_from_atom=None, return_idxs=False):
         """
         Automatically detects solvent molecules and removes them until you have a set number of solvents or atoms.
 
         The "distance" between molecules is the minimum of the pairwise atomic distances, to emphasize inner-sphere interactions.
+        All fragment-to-solute distances are found with one k-d tree query, and the new molecule is built in a single slice.
 
         Args:
             solute (int): which fragment is the solute, 0-indexed
@@ -1470,70 +2057,75 @@ class Molecule:
         """
         assert isinstance(num_atoms, int)
         assert isinstance(num_solvents, int)
+        assert self._bond_backend().number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
 
-        fragments = self.get_components()
-        solute_x = self.geometry[fragments[solute]].view(np.ndarray)
-
+        labels = self._get_component_labels()
         if distance_from_atom:
-            assert distance_from_atom in fragments[solute], f"{distance_from_atom} is not in the solute fragment"
-            solute_x = self.geometry[[distance_from_atom]].view(np.ndarray)
+            self._check_atom_number(distance_from_atom)
+            assert labels[distance_from_atom - 1] == solute, f"{distance_from_atom} is not in the solute fragment"
 
-        distances = np.zeros(shape=len(fragments))
-        for i, f in enumerate(fragments):
-            if i == solute:
-                distances[i] = 0
-            else:
-                solvent_x = self.geometry[f].view(np.ndarray)
-                # cdist is absurdly fast
-                pairwise_distances = cdist(solvent_x, solute_x)
-                distances[i] = np.min(pairwise_distances)
+        keep = self._solvent_shell_mask(self.geometry.view(np.ndarray), labels, solute=solute, num_atoms=num_atoms, num_solvents=num_solvents, distance_from_atom=distance_from_atom)
+        idxs = np.flatnonzero(keep) + 1
 
-        mol = copy.deepcopy(self)
-
-        #### reverse order - farthest away comes first
-        order = np.argsort(distances)[::-1]
-
-        current_num_solvents = len(fragments) - 1
-        current_num_atoms = mol.num_atoms()
-
-        to_remove = []
-        for i in order:
-            for j in fragments[i]:
-                to_remove.append(j)
-                current_num_atoms += -1
-            current_num_solvents += -1
-
-            if current_num_atoms <= num_atoms or num_solvents == current_num_solvents:
-                if return_idxs:
-                    all_idxs = set(range(1,self.num_atoms()))
-                    return list(all_idxs - set(to_remove))
-                else:
-                    #### have to remove in reverse direction for indexing consistency
-                    for j in sorted(to_remove, reverse=True):
-                        mol.remove_atom(j)
-                    return mol
-
-    def center_periodic(self, center, side_length):
+        if return_idxs:
+            return idxs.tolist()
+        else:
+            return self._slice_atoms(idxs)
+
+    def _get_bond_tree(self):
+        """
+        Helper method which returns a cached breadth-first spanning tree of the bonds, as a list of ``(children, parents)`` arrays of 0-indexed atoms (one entry per depth).
+        Used to unwrap fragments split across a periodic boundary.
+        """
+        topology = self._get_topology()
+        if "bond_tree" not in topology:
+            n_atoms = self.num_atoms()
+            graph = self._bond_graph if self._bonds is None else BondGraph.from_networkx(self._bonds, n_atoms)
+            csr = graph.to_csr()
+            labels = self._get_component_labels()
+
+            #### a virtual root bonded to the first atom of every fragment, so one search covers everything
+            _, roots = np.unique(labels, return_index=True)
+            rows = np.concatenate([np.full(len(roots), n_atoms), roots])
+            cols = np.concatenate([roots, np.full(len(roots), n_atoms)])
+            root_edges = scipy.sparse.csr_matrix((np.ones(2 * len(roots)), (rows, cols)), shape=(n_atoms + 1, n_atoms + 1))
+            csr = scipy.sparse.bmat([[csr, None], [None, scipy.sparse.csr_matrix((1, 1))]]).tocsr() + root_edges
+            order, predecessors = scipy.sparse.csgraph.breadth_first_order(csr, n_atoms, directed=False, return_predecessors=True)
+
+            depth = np.zeros(shape=n_atoms + 1, dtype=np.int64)
+            for atom in order[1:]:
+                depth[atom] = depth[predecessors[atom]] + 1
+
+            atoms = np.arange(n_atoms)
+            tree = list()
+            for d in range(2, int(depth.max()) + 1):
+                children = atoms[depth[:n_atoms] == d]
+                tree.append((children, predecessors[children]))
+            topology["bond_tree"] = tree
+        return topology["bond_tree"]
+
+    def center_periodic(self, center, side_length, unwrap=True):
         """
         Adjusts a molecule to be in the center of a cube, moving all other molecules accordingly. Bonded subgroups will be moved as a unit.
 
-        For analysis of MD files with periodic boundary conditions.
+        For analysis of MD files with periodic boundary conditions. Every fragment is wrapped at once, based on cached fragment labels.
 
         Args:
             center (int): atomic number to center
-            side_length (float): length of side, in Å
+            side_length (float or np.ndarray): length of side, in Å -- or the three side lengths of an orthorhombic box, or a 3x3 matrix of box vectors
+            unwrap (bool): whether to first rejoin fragments that are split across the box boundary (requires bonds assigned with ``periodic_boundary_conditions``)
+
+        Returns:
+            the Molecule object
         """
         self._check_atom_number(center)
-        assert isinstance(side_length, (int, float))
-        assert side_length > 0
-
-        #### Center the atom of interest
-        self.geometry += -1 * self.geometry[center]
-        self.geometry += side_length / 2
+        if isinstance(side_length, (int, float)):
+            assert side_length > 0
 
-        for f in self.get_components():
-            centroid = np.mean(self.geometry[f], axis=0)
-            self.geometry[f] += -1 * np.floor_divide(centroid, side_length) * side_length
+        labels = self._get_component_labels()
+        tree = self._get_bond_tree() if unwrap else None
+        geometry = compute_periodic_centering(self.geometry.view(np.ndarray), labels, side_length, center - 1, tree=tree)
+        self.geometry = geometry.astype(self.geometry.dtype).view(cctk.OneIndexedArray)
 
         return self
 
@@ -1586,11 +2178,15 @@ class Molecule:
     def fragment(self):
         """
         Returns list of ``cctk.Molecule`` objects based on the bond-connected components of ``self``.
+
+        Each fragment keeps its bonds from ``self``, so connectivity isn't reassigned.
         """
         fragments = list()
-        indices = self.get_components()
-        for idx in indices:
-            mol = cctk.Molecule(self.atomic_numbers[idx], self.geometry[idx]).assign_connectivity()
+        for component in self.get_components():
+            mol = self._slice_atoms(sorted(component))
+
+            #### fragments don't inherit the overall charge or multiplicity
+            mol.name, mol.charge, mol.multiplicity = None, 0, 1
             fragments.append(mol)
         return fragments
 
@@ -1802,6 +2398,107 @@ class Molecule:
         except Exception as e:
             raise ValueError(f"this stringified Molecule fails import: {e}")
 
+    def to_bytes(self, properties=None):
+        """
+        Saves the molecule in a compact, versioned binary format, for storage in databases or key-value stores (see ``from_bytes()``).
+
+        The format is a fixed 32-byte header followed by raw little-endian arrays: atomic numbers, coordinates, the bond list with bond orders,
+        and vibrational modes (displacements are stored as 32-bit floats, like the coordinates).
+        A dict of properties can be included too (see ``helper_functions.properties_to_bytes()``).
+
+        Args:
+            properties (dict): optional properties to store alongside the molecule
+
+        Returns:
+            bytes
+        """
+        graph = self._bond_backend()
+        if isinstance(graph, BondGraph):
+            edges, orders = graph.edges()
+        else:
+            edges = np.array([(i, j) for i, j, w in graph.edges(data="weight", default=1)], dtype=np.uint32).reshape(-1, 2)
+            orders = np.array([w for i, j, w in graph.edges(data="weight", default=1)], dtype=np.int8)
+
+        name = b"" if self.name is None else self.name.encode("utf-8")
+        flags = (BINARY_HAS_NAME if self.name is not None else 0) | (BINARY_HAS_PROPERTIES if properties is not None else 0)
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_FORMAT_VERSION, flags, self.charge, self.multiplicity, self.num_atoms(), len(edges), len(self.vibrational_modes), len(name))
+
+        chunks = [
+            header,
+            name,
+            self.atomic_numbers.view(np.ndarray).astype(np.int8).tobytes(),
+            self.geometry.view(np.ndarray).astype("<f4").tobytes(),
+            np.asarray(edges, dtype="<u4").tobytes(),
+            np.asarray(orders, dtype=np.int8).tobytes(),
+        ]
+
+        if len(self.vibrational_modes):
+            modes = self.vibrational_modes
+            chunks.append(np.array([[m.frequency, m.force_constant, m.reduced_mass, m.intensity] for m in modes], dtype="<f8").tobytes())
+            chunks.append(np.stack([m.displacements.view(np.ndarray) for m in modes]).astype("<f4").tobytes())
+
+        if properties is not None:
+            chunks.append(properties_to_bytes(properties))
+
+        return b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data, return_properties=False, compact_bonds=False):
+        """
+        Loads a ``cctk.Molecule`` object saved with ``to_bytes()``.
+
+        Args:
+            data (bytes): the encoded molecule
+            return_properties (bool): whether to also return the stored properties (``None`` if there were none)
+            compact_bonds (bool): keep the bonds as a ``BondGraph`` (faster, see ``compact_bonds()``) instead of building a ``networkx.Graph``
+
+        Returns:
+            new ``Molecule`` object (and properties dict, if ``return_properties``)
+        """
+        if len(data) < BINARY_HEADER.size:
+            raise ValueError("this binary Molecule is truncated")
+        magic, version, flags, charge, multiplicity, n_atoms, n_bonds, n_modes, name_length = BINARY_HEADER.unpack_from(data, 0)
+        if magic != BINARY_MAGIC:
+            raise ValueError("this is not a binary cctk Molecule")
+        if version > BINARY_FORMAT_VERSION:
+            raise ValueError(f"binary Molecule format version {version} is newer than this version of cctk supports ({BINARY_FORMAT_VERSION})")
+
+        def take(dtype, count, offset):
+            dtype = np.dtype(dtype)
+            if offset + count * dtype.itemsize > len(data):
+                raise ValueError("this binary Molecule is truncated")
+            return np.frombuffer(data, dtype=dtype, count=count, offset=offset), offset + count * dtype.itemsize
+
+        offset = BINARY_HEADER.size
+        name = bytes(data[offset:offset+name_length]).decode("utf-8") if flags & BINARY_HAS_NAME else None
+        offset += name_length
+
+        atomic_numbers, offset = take(np.int8, n_atoms, offset)
+        geometry, offset = take("<f4", 3 * n_atoms, offset)
+        edges, offset = take("<u4", 2 * n_bonds, offset)
+        orders, offset = take(np.int8, n_bonds, offset)
+
+        bonds = BondGraph(n_atoms, edges.reshape(-1, 2), orders)
+        if not compact_bonds:
+            bonds = bonds.to_networkx()
+
+        mol = cls(atomic_numbers.copy(), geometry.reshape(-1, 3), name=name, bonds=bonds, charge=charge, multiplicity=multiplicity, checks=False)
+
+        if n_modes:
+            mode_values, offset = take("<f8", 4 * n_modes, offset)
+            displacements, offset = take("<f4", 3 * n_atoms * n_modes, offset)
+            displacements = displacements.astype(np.float64).reshape(n_modes, n_atoms, 3)
+            for (frequency, force_constant, reduced_mass, intensity), displacement in zip(mode_values.reshape(-1, 4).tolist(), displacements):
+                mol.vibrational_modes.append(cctk.VibrationalMode(frequency, force_constant, reduced_mass, intensity, displacement.view(cctk.OneIndexedArray)))
+
+        if return_properties:
+            properties = None
+            if flags & BINARY_HAS_PROPERTIES:
+                properties, offset = bytes_to_properties(data, offset)
+            return mol, properties
+
+        return mol
+
     def coulomb_analysis(self, atoms1, atoms2, charges):
         """
         Computes the net Coulomb forces between atoms ``atoms1`` and atoms ``atoms2``.
@@ -43,7 +43,7 @@ def get_quasiclassical_perturbation(molecule, temperature=298, return_velocities
     assert len(molecule.vibrational_modes) > 0, "molecule needs to have vibrational modes (try running a ``freq`` job)"
     assert isinstance(temperature, (int, float)), "temperature must be numeric"
 
-    mol = copy.deepcopy(molecule)
+    mol = molecule.clone()
     total_PE = 0
     total = 0
 
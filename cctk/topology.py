@@ -6,16 +6,145 @@ Moved out of ``cctk.Molecule`` because the file was getting unwieldy.
 
 import numpy as np
 import networkx as nx
-import copy
 
 from cctk.helper_functions import (
     compute_chirality,
 )
+from cctk.bond_graph import BondGraph
+
+def _mix_colors(colors):
+    """
+    Scrambles an array of ``np.uint64`` colors (the "splitmix64" finalizer), so that sums of colors rarely collide.
+    Arithmetic wraps around modulo 2**64.
+    """
+    colors = (colors ^ (colors >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    colors = (colors ^ (colors >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return colors ^ (colors >> np.uint64(31))
+
+def refine_colors(indptr, indices, seeds):
+    """
+    Weisfeiler–Lehman color refinement: every atom's color is repeatedly replaced by a hash of its color and the multiset of its neighbors' colors,
+    until the number of distinct colors stops growing.
+
+    The colors depend only on the seeds and the graph, not on the atom numbering, so isomorphic molecules end up with the same multiset of colors
+    (and atoms that can be mapped onto each other get the same color).
+
+    Args:
+        indptr (np.ndarray): CSR row pointers of the bond graph, shape ``(n_atoms + 1,)``
+        indices (np.ndarray): 0-indexed neighbors of every atom
+        seeds (np.ndarray): initial color of every atom (e.g. atomic numbers), shape ``(n_atoms,)``
+
+    Returns:
+        ``np.ndarray`` of ``np.uint64`` colors, shape ``(n_atoms,)``
+    """
+    colors = _mix_colors(np.asarray(seeds).astype(np.uint64) + np.uint64(1))
+    n_colors = len(np.unique(colors))
+    for _ in range(len(colors)):
+        #### sum of scrambled neighbor colors, from differences of a (wrapping) cumulative sum
+        totals = np.concatenate([[np.uint64(0)], np.cumsum(_mix_colors(colors[indices]), dtype=np.uint64)])
+        neighbor_sums = totals[indptr[1:]] - totals[indptr[:-1]]
+        new_colors = _mix_colors(colors ^ _mix_colors(neighbor_sums + np.uint64(0x9e3779b97f4a7c15)))
+
+        new_n_colors = len(np.unique(new_colors))
+        if new_n_colors <= n_colors:
+            break
+        colors, n_colors = new_colors, new_n_colors
+    return colors
+
+def get_canonical_colors(mol):
+    """
+    Returns the Weisfeiler–Lehman colors of every atom (see ``refine_colors()``), seeded with atomic numbers. Bond orders are ignored.
+
+    The colors are cached with the rest of the molecule's topology, and recomputed if the bonds or atomic numbers change.
+
+    Args:
+        mol (cctk.Molecule): molecule of interest
+
+    Returns:
+        ``np.ndarray`` of ``np.uint64`` colors, shape ``(n_atoms,)`` (0-indexed, so ``colors[atom-1]``)
+    """
+    topology = mol._get_topology()
+    key = mol.atomic_numbers.view(np.ndarray).tobytes()
+    if topology.get("canonical_colors", (None, None))[0] != key:
+        n_atoms = mol.num_atoms()
+        graph = mol._bond_graph if mol._bonds is None else BondGraph.from_networkx(mol._bonds, n_atoms)
+        colors = refine_colors(graph.indptr, graph.indices - 1, mol.atomic_numbers.view(np.ndarray))
+        topology["canonical_colors"] = (key, colors)
+    return topology["canonical_colors"][1]
+
+def get_graph_hash(mol):
+    """
+    Returns a hash of the bond graph and atomic numbers which doesn't depend on the atom numbering. Isomorphic molecules always have the same hash;
+    molecules with different hashes are never isomorphic.
+
+    Args:
+        mol (cctk.Molecule): molecule of interest
+
+    Returns:
+        hash (int)
+    """
+    return hash((mol.num_atoms(), mol._bond_backend().number_of_edges(), np.sort(get_canonical_colors(mol)).tobytes()))
+
+class _ColorMatcher(nx.algorithms.isomorphism.GraphMatcher):
+    """
+    ``GraphMatcher`` which only pairs atoms with the same canonical color, so that the search only branches between truly ambiguous atoms.
+    """
+    def __init__(self, graph1, graph2, colors1, colors2):
+        super().__init__(graph1, graph2)
+        self.colors1 = colors1
+        self.colors2 = colors2
+
+    def semantic_feasibility(self, G1_node, G2_node):
+        return self.colors1[G1_node - 1] == self.colors2[G2_node - 1]
+
+def find_isomorphism(mol1, mol2):
+    """
+    Finds a mapping between the atoms of two molecules with isomorphic bond graphs (comparing atomic numbers - not bond orders!).
+
+    Canonical colors (see ``get_canonical_colors()``) are compared first, so most non-isomorphic pairs are rejected without any search.
+    If every color is unique, the mapping is read off directly; otherwise ``networkx`` only has to choose between atoms of the same color.
+
+    Args:
+        mol1 (cctk.Molecule):
+        mol2 (cctk.Molecule):
+
+    Returns:
+        dictionary mapping atom numbers of ``mol1`` (key) to atom numbers of ``mol2`` (val), or ``None`` if the molecules aren't isomorphic
+    """
+    if mol1.num_atoms() != mol2.num_atoms():
+        return None
+    if mol1._bond_backend().number_of_edges() != mol2._bond_backend().number_of_edges():
+        return None
+
+    colors1 = get_canonical_colors(mol1)
+    colors2 = get_canonical_colors(mol2)
+    order1 = np.argsort(colors1, kind="stable")
+    order2 = np.argsort(colors2, kind="stable")
+    if not np.array_equal(colors1[order1], colors2[order2]):
+        return None
+
+    #### every atom is unique, so there's only one candidate mapping
+    if len(np.unique(colors1)) == len(colors1):
+        mapping = np.zeros(shape=len(colors1) + 1, dtype=np.int64)
+        mapping[order1 + 1] = order2 + 1
+
+        edges1, _ = (mol1._bond_graph if mol1._bonds is None else BondGraph.from_networkx(mol1._bonds, mol1.num_atoms())).edges()
+        graph2 = mol2._bond_graph if mol2._bonds is None else BondGraph.from_networkx(mol2._bonds, mol2.num_atoms())
+        if all(graph2.has_edge(int(a), int(b)) for a, b in mapping[edges1]):
+            return {atom: int(mapping[atom]) for atom in range(1, len(colors1) + 1)}
+        return None
+
+    match = _ColorMatcher(mol1.bonds, mol2.bonds, colors1, colors2)
+    if match.is_isomorphic():
+        return match.mapping
+    return None
 
 def are_isomorphic(mol1, mol2, return_ordering=False):
     """
     Checks if two molecules are isomorphic (by comparing bond graphs and atomic numbers - not bond orders!).
 
+    Uses ``find_isomorphism()``, so non-isomorphic pairs are usually rejected immediately.
+
     Args:
         mol1 (cctk.Molecule):
         mol2 (cctk.Molecule):
@@ -25,18 +154,14 @@ def are_isomorphic(mol1, mol2, return_ordering=False):
         Boolean denoting if the molecules are isomorphic
         (optional) mapping list
     """
-    assert mol1.bonds.number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
-    assert mol2.bonds.number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
-
-    mol1._add_atomic_numbers_to_nodes()
-    mol2._add_atomic_numbers_to_nodes()
+    assert mol1._bond_backend().number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
+    assert mol2._bond_backend().number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
 
-    nm = nx.algorithms.isomorphism.categorical_node_match("atomic_number", 0)
-    match = nx.algorithms.isomorphism.GraphMatcher(mol1.bonds, mol2.bonds, node_match=nm)
+    mapping = find_isomorphism(mol1, mol2)
 
-    if match.is_isomorphic():
+    if mapping is not None:
         if return_ordering:
-            new_ordering = [match.mapping[x] for x in range(1, mol1.num_atoms() + 1)]
+            new_ordering = [mapping[x] for x in range(1, mol1.num_atoms() + 1)]
             return True, new_ordering
         else:
             return True
@@ -46,6 +171,58 @@ def are_isomorphic(mol1, mol2, return_ordering=False):
         else:
             return False
 
+def get_symmetry_classes(mol, atoms=None, return_bonds=False):
+    """
+    Groups ``atoms`` into classes of symmetry-equivalent atoms (e.g. the hydrogens of a methyl group, or the two ortho carbons of a phenyl ring).
+
+    Classes are found by color refinement (see ``refine_colors()``) on the bond graph induced by ``atoms``. To keep atoms that only look equivalent within this subgraph apart,
+    each atom is seeded with its atomic number and the atomic numbers of its neighbors outside ``atoms``. The whole automorphism group is never enumerated,
+    so the cost doesn't depend on how many symmetric groups the molecule has.
+
+    Args:
+        mol (cctk.Molecule): molecule of interest
+        atoms (list): 1-indexed atom numbers to consider (defaults to all atoms)
+        return_bonds (bool): whether to also return the bonds of the induced subgraph
+
+    Returns:
+        list of ``np.ndarray`` positions in ``atoms`` (0-indexed), one per class with more than one member
+        (if ``return_bonds``) ``np.ndarray`` of bonded pairs of positions, shape ``(n_bonds, 2)``
+    """
+    assert mol._bond_backend().number_of_edges() > 0, "need a bond graph to perform this operation -- try calling self.assign_connectivity()!"
+
+    n_atoms = mol.num_atoms()
+    if atoms is None:
+        atoms = np.arange(1, n_atoms + 1)
+    atoms = np.asarray(atoms, dtype=np.int64)
+    position = np.full(n_atoms + 1, -1, dtype=np.int64)
+    position[atoms] = np.arange(len(atoms))
+
+    graph = mol._bond_graph if mol._bonds is None else BondGraph.from_networkx(mol._bonds, n_atoms)
+    sources = np.repeat(np.arange(1, n_atoms + 1), np.diff(graph.indptr))
+    targets = graph.indices
+    source_inside = position[sources] >= 0
+    target_inside = position[targets] >= 0
+
+    #### seed each atom with its atomic number and the (order-independent) sum of its outside neighbors' scrambled atomic numbers
+    atomic_numbers = mol.atomic_numbers.view(np.ndarray).astype(np.uint64)
+    outside = source_inside & ~target_inside
+    outside_sums = np.zeros(len(atoms), dtype=np.uint64)
+    np.add.at(outside_sums, position[sources[outside]], _mix_colors(atomic_numbers[targets[outside] - 1] + np.uint64(1)))
+    seeds = _mix_colors(atomic_numbers[atoms - 1]) ^ _mix_colors(outside_sums)
+
+    #### CSR arrays of the induced subgraph, in the numbering of ``atoms``
+    inside = source_inside & target_inside
+    rows, cols = position[sources[inside]], position[targets[inside]]
+    order = np.argsort(rows, kind="stable")
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(atoms)))])
+    colors = refine_colors(indptr, cols[order], seeds)
+
+    _, labels, counts = np.unique(colors, return_inverse=True, return_counts=True)
+    classes = [np.nonzero(labels == label)[0] for label in np.nonzero(counts > 1)[0]]
+    if return_bonds:
+        return classes, np.stack([rows, cols], axis=1)[rows < cols]
+    return classes
+
 def flip_meso_rings(mol, atoms):
     """
     Returns a list of permuted molecules with various ``meso`` rings renumbered.
@@ -58,7 +235,7 @@ def flip_meso_rings(mol, atoms):
         list of ``Molecule`` objects
     """
     #### get all rings in graph
-    returns = [copy.deepcopy(mol)]
+    returns = [mol.clone()]
     for center in atoms:
         cycles = nx.cycle_basis(mol.bonds, root=center)
         for cycle in cycles:
@@ -82,7 +259,7 @@ def flip_meso_rings(mol, atoms):
             #### cut fragment bonds, depending on if we have even- or odd-numbered ring
             new_returns = []
             for mol in returns:
-                cpy = copy.deepcopy(mol)
+                cpy = mol.clone()
                 cpy.remove_bond(frag1[0], cycle[0])
                 cpy.remove_bond(frag2[0], cycle[0])
                 if len(cycle) == 1:
@@ -143,7 +320,7 @@ def exchange_identical_substituents(mol, center, self_permutations=None):
     mol._add_atomic_numbers_to_nodes()
     neighbors = list(mol.bonds[center])
 
-    returns = [copy.deepcopy(mol)]
+    returns = [mol.clone()]
     if self_permutations is not None:
         returns = self_permutations
 
@@ -161,7 +338,7 @@ def exchange_identical_substituents(mol, center, self_permutations=None):
                 match = nx.algorithms.isomorphism.GraphMatcher(graph1, graph2, node_match=nm)
                 if match.is_isomorphic():
                     for m in returns:
-                        new_mol = copy.deepcopy(m)
+                        new_mol = m.clone()
                         for k,v in match.mapping.items():
                             new_mol = new_mol.swap_atom_numbers(k, v)
                         if self_permutations is None:
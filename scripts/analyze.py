@@ -1,5 +1,4 @@
 import sys, re, glob, cctk, argparse
-import pandas as pd
 import multiprocessing as mp
 
 from tabulate import tabulate
@@ -80,11 +79,7 @@ def main():
     else:
         property_names = ["filename", "iters", "energy", "enthalpy", "gibbs_free_energy", "rms_force", "rms_displacement", "success", "imaginary", "ts_atoms"]
 
-    values = results[:, property_names]
-    if not isinstance(values[0], list):
-        values = [values]
-
-    df = pd.DataFrame(values, columns=property_names)
+    df = results.to_dataframe(property_names)
     df.sort_values("filename", inplace=True)
 
     if args["correct_gibbs"]:
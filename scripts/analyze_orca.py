@@ -1,6 +1,5 @@
 import sys, re, glob, cctk, argparse
 import numpy as np
-import pandas as pd
 
 from tabulate import tabulate
 from tqdm import tqdm
@@ -56,11 +55,7 @@ if len(results) == 0:
 
 print("\n\n\033[3manalysis:\033[0m\n")
 property_names = ["filename", "iters", "energy", "enthalpy", "quasiharmonic_gibbs_free_energy", "rms_step", "rms_gradient", "success", "imaginary"]
-values = results[:, property_names]
-if not isinstance(values[0], list):
-    values = [values]
-
-df = pd.DataFrame(values, columns=property_names).fillna("")
+df = results.to_dataframe(property_names).fillna("")
 
 if args["g"]:
     df["rel_energy"] = (df.quasiharmonic_gibbs_free_energy- df.quasiharmonic_gibbs_free_energy.min()) * 627.509469
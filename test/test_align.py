@@ -2,6 +2,17 @@ import unittest, sys, os, io, copy
 import numpy as np
 import cctk
 import glob as glob
+from scipy.spatial.distance import pdist, squareform
+from scipy.cluster.hierarchy import linkage, fcluster
+import networkx as nx
+
+def substituents(center, bond, length):
+    """ positions of three substituents of ``center``, tetrahedral with ``bond`` """
+    axis = -bond / np.linalg.norm(bond)
+    perp = np.cross(axis, [0.3, 0.5, 0.8])
+    perp /= np.linalg.norm(perp)
+    perp2 = np.cross(axis, perp)
+    return [center + length * (axis / 3 + np.sqrt(8 / 9) * (np.cos(t) * perp + np.sin(t) * perp2)) for t in (0, 2 * np.pi / 3, 4 * np.pi / 3)]
 
 # python -m unittest test.test_align.TestAlign
 class TestAlign(unittest.TestCase):
@@ -34,6 +45,7 @@ class TestAlign(unittest.TestCase):
 
         ensemble2, rmsds = aligned_ensemble.eliminate_redundant(RMSD_cutoff=0.5, comparison_atoms="heavy", return_RMSD=True)
         self.assertEqual(len(ensemble2), 3)
+        self.assertTrue(any(ensemble2.get_properties_dict(0) is p for p in aligned_ensemble.properties_list()))
 
         cctk.GaussianFile.write_ensemble_to_file("test/static/phenylpropane_aligned2.gjf", ensemble2, "#p")
         ensemble3 = aligned_ensemble.eliminate_redundant(RMSD_cutoff=0.5, comparison_atoms=comparison_atoms)
@@ -43,5 +55,283 @@ class TestAlign(unittest.TestCase):
         cctk.MOL2File.write_ensemble_to_file("test/static/phenylpropane_aligned.mol2", aligned_ensemble)
 
 
+    def test_batched_align(self):
+        conformational_ensemble = cctk.ConformationalEnsemble()
+        for filename in sorted(glob.glob("test/static/phenylpropane*.out")):
+            ensemble = cctk.GaussianFile.read_file(filename).ensemble
+            molecule = ensemble.molecules[-1]
+            conformational_ensemble.add_molecule(molecule, ensemble.get_properties_dict(molecule))
+
+        aligned_ensemble, before_RMSD, after_RMSD = conformational_ensemble.align(to_geometry=2, comparison_atoms="heavy", compute_RMSD=True)
+        self.assertEqual(len(aligned_ensemble), len(conformational_ensemble))
+        self.assertTrue(aligned_ensemble.contiguous)
+
+        # compare against one-at-a-time alignment
+        heavy = np.array(conformational_ensemble.molecules[0].get_heavy_atoms())
+        template = conformational_ensemble.molecules[2].geometry[heavy].view(np.ndarray).astype(np.float64)
+        template = template - template.mean(axis=0)
+        for molecule, aligned, after in zip(conformational_ensemble.molecules, aligned_ensemble.molecules, after_RMSD):
+            geometry = molecule.geometry.view(np.ndarray).astype(np.float64)
+            geometry = geometry - geometry[heavy - 1].mean(axis=0)
+            expected = cctk.helper_functions.align_matrices(geometry[heavy - 1], geometry, template)
+            self.assertTrue(np.allclose(aligned.geometry.view(np.ndarray), expected, atol=1e-4))
+            self.assertAlmostEqual(after, cctk.helper_functions.compute_RMSD(aligned.geometry[heavy], template.view(cctk.OneIndexedArray), checks=False), places=4)
+
+            # topology is shared, not copied
+            self.assertIs(aligned.bonds, molecule.bonds)
+            self.assertEqual(aligned.name, molecule.name)
+
+        self.assertLess(after_RMSD[2], 0.0001)
+        for before, after in zip(before_RMSD, after_RMSD):
+            self.assertLessEqual(after, before + 1e-6)
+
+        # the original ensemble is untouched
+        self.assertFalse(np.allclose(conformational_ensemble.molecules[0].geometry, aligned_ensemble.molecules[0].geometry))
+        self.assertEqual(aligned_ensemble[:, "energy"], conformational_ensemble[:, "energy"])
+
+
+    def test_eliminate_redundant(self):
+        conformational_ensemble = cctk.ConformationalEnsemble()
+        for filename in sorted(glob.glob("test/static/phenylpropane*.out")):
+            ensemble = cctk.GaussianFile.read_file(filename).ensemble
+            molecule = ensemble.molecules[-1]
+            conformational_ensemble.add_molecule(molecule, ensemble.get_properties_dict(molecule))
+
+        for cutoff, expected in zip([0.1, 0.3, 0.5, 1.0], [5, 4, 3, 1]):
+            ensemble1, rmsds1 = conformational_ensemble.eliminate_redundant(RMSD_cutoff=cutoff, return_RMSD=True)
+            ensemble2, rmsds2 = conformational_ensemble.eliminate_redundant(RMSD_cutoff=cutoff, return_RMSD=True, block_size=2, nprocs=2)
+            self.assertEqual(len(ensemble1), expected)
+            self.assertEqual(len(ensemble2), expected)
+            self.assertTrue(np.allclose(rmsds1, rmsds2))
+            self.assertListEqual([p["filename"] for p in ensemble1.properties_list()], [p["filename"] for p in ensemble2.properties_list()])
+
+            energies = [p["energy"] for p in ensemble1.properties_list()]
+            self.assertListEqual(energies, sorted(energies))
+
+        # a tiny energy window means nothing gets compared
+        ensemble3 = conformational_ensemble.eliminate_redundant(RMSD_cutoff=1.0, energy_window=1e-8)
+        self.assertEqual(len(ensemble3), len(conformational_ensemble))
+        ensemble4 = conformational_ensemble.eliminate_redundant(RMSD_cutoff=1.0, energy_window=1.0)
+        self.assertEqual(len(ensemble4), 1)
+
+
+    def test_rmsd_matrix(self):
+        conformational_ensemble = cctk.ConformationalEnsemble()
+        for filename in sorted(glob.glob("test/static/phenylpropane*.out")):
+            ensemble = cctk.GaussianFile.read_file(filename).ensemble
+            molecule = ensemble.molecules[-1]
+            conformational_ensemble.add_molecule(molecule, ensemble.get_properties_dict(molecule))
+
+        n = len(conformational_ensemble)
+        condensed = conformational_ensemble.rmsd_matrix(comparison_atoms="heavy")
+        self.assertEqual(condensed.dtype, np.float32)
+        self.assertEqual(len(condensed), n * (n - 1) // 2)
+
+        # same as aligning to each conformer in turn
+        matrix = squareform(condensed)
+        for i in range(n):
+            _, _, after_RMSD = conformational_ensemble.align(to_geometry=i, comparison_atoms="heavy", compute_RMSD=True)
+            self.assertTrue(np.allclose(matrix[i], after_RMSD, atol=1e-4))
+
+        # tiling and multiprocessing don't change anything
+        self.assertTrue(np.allclose(conformational_ensemble.rmsd_matrix(block_size=2), condensed, atol=1e-6))
+        self.assertTrue(np.allclose(conformational_ensemble.rmsd_matrix(block_size=4, nprocs=2), condensed, atol=1e-6))
+
+        # without superposition, the matrix matches pdist on the raw coordinates
+        geometries = conformational_ensemble.geometries().reshape(n, -1).astype(np.float64)
+        unaligned = conformational_ensemble.rmsd_matrix(comparison_atoms="all", aligned=False, block_size=3)
+        self.assertTrue(np.allclose(unaligned, pdist(geometries) / np.sqrt(geometries.shape[1] / 3), atol=1e-4))
+
+
+    def test_cluster(self):
+        conformational_ensemble = cctk.ConformationalEnsemble()
+        for filename in sorted(glob.glob("test/static/phenylpropane*.out")):
+            ensemble = cctk.GaussianFile.read_file(filename).ensemble
+            molecule = ensemble.molecules[-1]
+            conformational_ensemble.add_molecule(molecule, ensemble.get_properties_dict(molecule))
+
+        # sparse neighbors agree with the dense matrix
+        matrix = squareform(conformational_ensemble.rmsd_matrix())
+        neighbors = conformational_ensemble.rmsd_neighbors(0.4)
+        expected = (matrix < 0.4) & ~np.eye(len(matrix), dtype=bool)
+        self.assertTrue(np.array_equal(neighbors.toarray() > 0, expected))
+        self.assertTrue(np.allclose(neighbors.toarray()[expected], matrix[expected], atol=1e-6))
+
+        for method in ["butina", "average"]:
+            centroids, labels = conformational_ensemble.cluster(cutoff=0.4, method=method, return_labels=True)
+            self.assertListEqual(list(labels), [0, 0, 0, 0, 1, 0])
+            self.assertEqual(len(centroids), 2)
+            self.assertListEqual(centroids[:, "cluster_size"], [5, 1])
+            self.assertAlmostEqual(sum(centroids[:, "boltzmann_population"]), 1.0)
+            self.assertIn("energy", centroids.get_properties_dict(0))
+
+        # Butina centroid is the conformer with the most neighbors
+        centroids = conformational_ensemble.cluster(cutoff=0.4, method="butina")
+        self.assertTrue(np.allclose(centroids.molecules[0].geometry, conformational_ensemble.molecules[3].geometry))
+
+        # compare average linkage against scipy on well-separated synthetic clusters
+        rng = np.random.default_rng(0)
+        template = conformational_ensemble.molecules[0]
+        centers = [template.geometry.view(np.ndarray) + rng.normal(scale=1.0, size=template.geometry.shape) for _ in range(8)]
+        synthetic = cctk.ConformationalEnsemble()
+        for i in range(80):
+            geometry = centers[i % 8] + rng.normal(scale=0.1, size=template.geometry.shape)
+            synthetic.add_molecule(cctk.Molecule(template.atomic_numbers, geometry, bonds=template.bonds), checks=False)
+
+        expected = fcluster(linkage(synthetic.rmsd_matrix(), "average"), 0.5, "distance")
+        expected = {frozenset(np.nonzero(expected == x)[0]) for x in set(expected)}
+        for method in ["butina", "average"]:
+            centroids, labels = synthetic.cluster(cutoff=0.5, method=method, block_size=32, return_labels=True)
+            self.assertEqual(len(centroids), 8)
+            self.assertEqual({frozenset(np.nonzero(labels == x)[0]) for x in set(labels)}, expected)
+
+
+    def test_symmetric_rmsd(self):
+        conformational_ensemble = cctk.ConformationalEnsemble()
+        for filename in sorted(glob.glob("test/static/phenylpropane*.out")):
+            ensemble = cctk.GaussianFile.read_file(filename).ensemble
+            molecule = ensemble.molecules[-1]
+            conformational_ensemble.add_molecule(molecule, ensemble.get_properties_dict(molecule))
+        conformational_ensemble = conformational_ensemble.assign_connectivity()
+        molecule = conformational_ensemble.molecules[0]
+
+        # ortho and meta carbons of the phenyl ring; then their hydrogens, the methyl hydrogens, and the two pairs of methylene hydrogens
+        heavy_atoms = np.array(molecule.get_heavy_atoms())
+        classes = cctk.topology.get_symmetry_classes(molecule, atoms=heavy_atoms)
+        self.assertEqual(sorted(len(c) for c in classes), [2, 2])
+        for c in classes:
+            self.assertEqual(len(set(molecule.atomic_numbers[heavy_atoms[c]])), 1)
+        self.assertEqual(sorted(len(c) for c in cctk.topology.get_symmetry_classes(molecule)), [2, 2, 2, 2, 2, 2, 3])
+
+        # add a copy of the first conformer with its methyl hydrogens renumbered
+        hydrogens = [a for a in molecule.bonds[18] if molecule.atomic_numbers[a] == 1]
+        self.assertEqual(len(hydrogens), 3)
+        geometry = molecule.geometry.view(np.ndarray).copy()
+        geometry[np.array(hydrogens) - 1] = geometry[np.roll(hydrogens, 1) - 1]
+        properties = conformational_ensemble.get_properties_dict(molecule).copy()
+        properties["energy"] += 1e-6
+        conformational_ensemble.add_molecule(cctk.Molecule(molecule.atomic_numbers, geometry, bonds=molecule.bonds), properties)
+
+        matrix = squareform(conformational_ensemble.rmsd_matrix(comparison_atoms="all"))
+        symmetric_matrix = squareform(conformational_ensemble.rmsd_matrix(comparison_atoms="all", symmetric=True, block_size=4))
+        self.assertGreater(matrix[0, -1], 0.5)
+        self.assertLess(symmetric_matrix[0, -1], 1e-4)
+        self.assertTrue(np.all(symmetric_matrix <= matrix + 1e-5))
+
+        self.assertEqual(len(conformational_ensemble.eliminate_redundant(RMSD_cutoff=0.1, comparison_atoms="all")), 6)
+        self.assertEqual(len(conformational_ensemble.eliminate_redundant(RMSD_cutoff=0.1, comparison_atoms="all", symmetric=True)), 5)
+        self.assertEqual(len(conformational_ensemble.cluster(cutoff=0.1, comparison_atoms="all", symmetric=True)), 5)
+
+        # symmetry classes are only computed once
+        self.assertEqual(len(conformational_ensemble._symmetry_classes), 1)
+
+    def test_symmetric_rmsd_many_methyls(self):
+        # 2,2,3,3-tetramethylbutane: six methyl groups, far too many automorphisms to enumerate
+        centers = [np.zeros(3), np.array([1.54, 0, 0])]
+        atomic_numbers, geometry = [6, 6], list(centers)
+        for center, other in [(centers[0], centers[1]), (centers[1], centers[0])]:
+            for methyl in substituents(center, other - center, 1.54):
+                atomic_numbers.append(6)
+                geometry.append(methyl)
+                for hydrogen in substituents(methyl, center - methyl, 1.09):
+                    atomic_numbers.append(1)
+                    geometry.append(hydrogen)
+        geometry = np.array(geometry)
+        molecule = cctk.Molecule(atomic_numbers, geometry).assign_connectivity()
+        self.assertEqual(sorted(len(c) for c in cctk.topology.get_symmetry_classes(molecule)), [2, 6, 18])
+
+        # rotate every methyl group, then the whole molecule
+        hydrogens = np.nonzero(np.array(atomic_numbers) == 1)[0]
+        rotated = geometry.copy()
+        for k in range(6):
+            methyl_hydrogens = hydrogens[3 * k:3 * k + 3]
+            rotated[methyl_hydrogens] = geometry[np.roll(methyl_hydrogens, k % 3)]
+        theta = 0.7
+        rotation = np.array([[np.cos(theta), -np.sin(theta), 0], [np.sin(theta), np.cos(theta), 0], [0, 0, 1]])
+
+        ensemble = cctk.ConformationalEnsemble()
+        ensemble.add_molecule(molecule, {"energy": 0.0})
+        ensemble.add_molecule(cctk.Molecule(atomic_numbers, rotated, bonds=molecule.bonds), {"energy": 1e-6})
+        ensemble.add_molecule(cctk.Molecule(atomic_numbers, rotated @ rotation.T + 3, bonds=molecule.bonds), {"energy": 2e-6})
+
+        self.assertGreater(ensemble.rmsd_matrix(comparison_atoms="all")[0], 0.5)
+        self.assertTrue(np.all(ensemble.rmsd_matrix(comparison_atoms="all", symmetric=True) < 1e-4))
+        self.assertLess(ensemble.rmsd_matrix(comparison_atoms="all", aligned=False, symmetric=True)[0], 1e-4)
+        self.assertEqual(len(ensemble.eliminate_redundant(RMSD_cutoff=0.1, comparison_atoms="all", symmetric=True)), 1)
+
+    def test_symmetric_rmsd_automorphisms(self):
+        # propane: two equivalent methyls, whose hydrogens share one symmetry class but can't be exchanged between methyls
+        atomic_numbers, geometry = [6, 6], [np.zeros(3), np.array([1.54, 0, 0])]
+        methyl, hydrogen, hydrogen2 = substituents(geometry[0], geometry[1] - geometry[0], 1.54)
+        atomic_numbers += [6, 1, 1]
+        geometry += [methyl, hydrogen * 1.09 / 1.54, hydrogen2 * 1.09 / 1.54]
+        for methyl in (1, 2):
+            atomic_numbers += [1, 1, 1]
+            geometry += substituents(geometry[methyl], geometry[0] - geometry[methyl], 1.09)
+        geometry = np.array(geometry)
+        molecule = cctk.Molecule(atomic_numbers, geometry).assign_connectivity()
+        classes, bonds = cctk.topology.get_symmetry_classes(molecule, return_bonds=True)
+        self.assertEqual(sorted(len(c) for c in classes), [2, 2, 6])
+        self.assertEqual(len(bonds), 10)
+
+        # every automorphism of the bond graph, as renumberings
+        graph = molecule.bonds.copy()
+        nx.set_node_attributes(graph, {i: z for i, z in enumerate(atomic_numbers, start=1)}, "z")
+        matcher = nx.algorithms.isomorphism.GraphMatcher(graph, graph, node_match=lambda a, b: a["z"] == b["z"])
+        automorphisms = np.array([[mapping[i] - 1 for i in range(1, len(atomic_numbers) + 1)] for mapping in matcher.isomorphisms_iter()])
+        self.assertEqual(len(automorphisms), 144)
+
+        # rotate one methyl, exchange hydrogens between the methyls, and scramble noisy copies
+        first, second = np.arange(8, 11), np.arange(5, 8)
+        rotated, swapped = geometry.copy(), geometry.copy()
+        rotated[first] = geometry[np.roll(first, 1)]
+        swapped[first], swapped[second] = geometry[second], geometry[first]
+        rng = np.random.default_rng(0)
+        hydrogens = np.nonzero(np.array(atomic_numbers) == 1)[0]
+        conformers = [rotated, swapped]
+        for noise in (0.05, 0.2, 0.5):
+            for _ in range(4):
+                conformer = geometry + rng.normal(scale=noise, size=geometry.shape)
+                conformer[hydrogens] = conformer[rng.permutation(hydrogens)]
+                conformers.append(conformer)
+        conformers = np.array(conformers)
+
+        for align in (True, False):
+            symmetric = cctk.helper_functions.compute_pairwise_RMSDs(conformers, geometry[np.newaxis], align=align, symmetry_classes=classes, bonds=bonds)[:, 0]
+            brute_force = np.min([cctk.helper_functions.compute_pairwise_RMSDs(conformers[:, ordering], geometry[np.newaxis], align=align)[:, 0] for ordering in automorphisms], axis=0)
+            plain = cctk.helper_functions.compute_pairwise_RMSDs(conformers, geometry[np.newaxis], align=align)[:, 0]
+            self.assertTrue(np.all(symmetric >= brute_force - 1e-6))
+            self.assertTrue(np.all(symmetric <= plain + 1e-6))
+            self.assertLess(symmetric[0], 1e-4)
+            self.assertGreater(symmetric[1], 0.1)
+            if not align:
+                self.assertTrue(np.allclose(symmetric, brute_force))
+
+        # so the methyl-swapped conformer is kept apart from the original
+        ensemble = cctk.ConformationalEnsemble()
+        for i, conformer in enumerate([geometry, rotated, swapped]):
+            ensemble.add_molecule(cctk.Molecule(atomic_numbers, conformer, bonds=molecule.bonds), {"energy": i * 1e-6})
+        self.assertEqual(len(ensemble.eliminate_redundant(RMSD_cutoff=0.05, comparison_atoms="all", symmetric=True)), 2)
+
+        # benzene with two neighboring CH groups exchanged: the closest renumbering of the carbons doesn't follow the ring
+        angles = np.arange(6) * np.pi / 3
+        ring = np.stack([np.cos(angles), np.sin(angles), np.zeros(6)], axis=1)
+        benzene = np.concatenate([1.39 * ring, 2.48 * ring])
+        molecule = cctk.Molecule([6] * 6 + [1] * 6, benzene).assign_connectivity()
+        classes, bonds = cctk.topology.get_symmetry_classes(molecule, return_bonds=True)
+        exchanged = benzene[[1, 0, 2, 3, 4, 5, 7, 6, 8, 9, 10, 11]]
+
+        graph = molecule.bonds.copy()
+        nx.set_node_attributes(graph, {i: z for i, z in enumerate(molecule.atomic_numbers, start=1)}, "z")
+        matcher = nx.algorithms.isomorphism.GraphMatcher(graph, graph, node_match=lambda a, b: a["z"] == b["z"])
+        automorphisms = [[mapping[i] - 1 for i in range(1, 13)] for mapping in matcher.isomorphisms_iter()]
+        self.assertEqual(len(automorphisms), 12)
+        for align in (True, False):
+            symmetric = cctk.helper_functions.compute_pairwise_RMSDs(exchanged[np.newaxis], benzene[np.newaxis], align=align, symmetry_classes=classes, bonds=bonds)[0, 0]
+            brute_force = min(cctk.helper_functions.compute_pairwise_RMSDs(exchanged[np.newaxis, ordering], benzene[np.newaxis], align=align)[0, 0] for ordering in automorphisms)
+            self.assertGreater(brute_force, 0.1)
+            self.assertGreaterEqual(symmetric, brute_force - 1e-6)
+
+
 if __name__ == '__main__':
     unittest.main()
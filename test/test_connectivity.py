@@ -1,5 +1,6 @@
-import unittest, sys, os, io, copy
+import unittest, sys, os, io, copy, pickle
 import numpy as np
+import networkx as nx
 import cctk
 
 import cctk.helper_functions as helper
@@ -13,5 +14,69 @@ class TestConnectivity(unittest.TestCase):
         mol = cctk.GaussianFile.read_file("test/static/renumber_0.gjf").get_molecule()
         mol.assign_connectivity(0.1)
         self.assertEqual(len(mol.bonds.edges()), 31)
+
+    def test_compact_bonds(self):
+        mol = cctk.GaussianFile.read_file("test/static/LSD_custom.out").get_molecule().assign_connectivity()
+        mol.add_bond(1, 2, 2)
+        reference = copy.deepcopy(mol)
+
+        mol.compact_bonds()
+        self.assertTrue(isinstance(mol._bond_graph, cctk.BondGraph))
+        self.assertEqual(mol._bond_graph.number_of_edges(), reference.bonds.number_of_edges())
+        for atom in range(1, mol.num_atoms() + 1):
+            self.assertListEqual(mol.get_adjacent_atoms(atom), sorted(reference.get_adjacent_atoms(atom)))
+        self.assertEqual(mol.get_bond_order(1, 2), 2)
+        self.assertEqual(mol.get_bond_order(2, 1), 2)
+        self.assertEqual(mol.get_bond_order(1, 39), 0)
+        self.assertListEqual(mol.get_components(), reference.get_components())
+
+        #### fragments come straight from the arrays, so nothing is converted
+        for edge in reference.bonds.edges():
+            try:
+                expected = [sorted(f) for f in reference._get_bond_fragments(*edge)]
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    mol._get_bond_fragments(*edge)
+                continue
+            self.assertListEqual(list(mol._get_bond_fragments(*edge)), expected)
+        self.assertTrue(mol._bonds is None)
+
+        #### rings and bridges come from the arrays too
+        for atom in range(1, mol.num_atoms() + 1):
+            self.assertEqual(mol.is_atom_in_ring(atom), reference.is_atom_in_ring(atom))
+        self.assertTrue(mol._bonds is None)
+
+        #### pickling keeps the compact backend, and the (read-only) networkx view is built on demand
+        mol = pickle.loads(pickle.dumps(mol))
+        self.assertTrue(mol._bonds is None)
+        self.assertListEqual(sorted(mol.bonds.edges(data="weight")), sorted(reference.bonds.edges(data="weight")))
+        self.assertTrue(isinstance(mol._bond_graph, cctk.BondGraph))
+        with self.assertRaises(nx.NetworkXError):
+            mol.bonds.add_edge(1, 39)
+
+        #### edits go to the arrays, in place
+        mol.remove_bond(1, 2)
+        self.assertEqual(mol.get_bond_order(1, 2), 0)
+        self.assertFalse(mol.bonds.has_edge(1, 2))
+        self.assertTrue(mol._bonds is None)
+
+    def test_compact_ensemble(self):
+        conformers = cctk.XYZFile.read_ensemble("test/static/methane_traj.xyz", conformational=True).ensemble
+        conformers.assign_connectivity()
+        conformers.compact_bonds()
+        self.assertTrue(isinstance(conformers, cctk.ConformationalEnsemble))
+        self.assertTrue(all([m._bond_graph is conformers.molecules[0]._bond_graph for m in conformers.molecules]))
+
+        #### the networkx view is shared too, and survives reads, new members, and edits
+        graphs = [m.bonds for m in conformers.molecules]
+        self.assertTrue(graphs[0] is graphs[1])
+        conformers.molecules[0].is_atom_in_ring(1)
+        conformers.add_molecule(conformers.molecules[0].clone())
+        self.assertTrue(all([m._bond_graph is conformers.molecules[0]._bond_graph for m in conformers.molecules]))
+
+        conformers.molecules[1].remove_bond(1, 2)
+        self.assertEqual(conformers.molecules[0].get_bond_order(1, 2), 0)
+        self.assertTrue(conformers.molecules[0].bonds is conformers.molecules[2].bonds)
+
 if __name__ == '__main__':
     unittest.main()
@@ -120,6 +120,34 @@ class TestEnsemble(unittest.TestCase):
         self.assertTrue(len(ensemble)==3)
         self.assertListEqual(list(ensemble[:,"test_property"]), [0, 1, 2])
 
+    def test_positional_access(self):
+        conformational_ensemble = self.build_test_ensemble()
+        molecules = conformational_ensemble.molecule_list()
+        self.assertListEqual(conformational_ensemble._molecules, list(conformational_ensemble._items.keys()))
+
+        # re-adding a molecule replaces its properties but keeps its position
+        conformational_ensemble.add_molecule(molecules[2], {"energy": 1.0})
+        self.assertEqual(len(conformational_ensemble), 6)
+        self.assertIs(conformational_ensemble.molecules[2], molecules[2])
+        self.assertEqual(conformational_ensemble[2, "energy"], 1.0)
+        self.assertDictEqual(conformational_ensemble.get_properties_dict(molecules[2]), {"energy": 1.0})
+
+        # sub-ensembles keep order, share molecules and property dicts, and drop repeats
+        sub_ensemble = conformational_ensemble[[3, 1, 3, -1]]
+        self.assertIsInstance(sub_ensemble, cctk.ConformationalEnsemble)
+        self.assertListEqual(sub_ensemble.molecule_list(), [molecules[3], molecules[1], molecules[5]])
+        self.assertIs(sub_ensemble.properties_list()[0], conformational_ensemble.properties_list()[3])
+        self.assertEqual(conformational_ensemble[[3, 3], "filename"], "test/static/phenylpropane_4.out")
+        self.assertListEqual(conformational_ensemble[4:1:-1, "filename"], ["test/static/phenylpropane_5.out", "test/static/phenylpropane_4.out", None])
+
+        with self.assertRaises(IndexError):
+            conformational_ensemble[6]
+        with self.assertRaises(ValueError):
+            conformational_ensemble[cctk.Molecule([1], [[0, 0, 0]]), "energy"]
+
+        joined = cctk.Ensemble.join_ensembles([conformational_ensemble[0:2], conformational_ensemble[1:4]])
+        self.assertListEqual(joined.molecule_list(), molecules[0:4])
+
     def test_ensemble_properties(self):
         filename = "test/static/gaussian_file.out"
         gaussian_file = cctk.GaussianFile.read_file(filename)
@@ -156,6 +184,277 @@ class TestEnsemble(unittest.TestCase):
         energy0 = sorted_ensemble.get_property(lowest_molecule, "energy")
         self.assertEqual(energy0, 0.0140132996483)
 
+    def test_columns(self):
+        conformational_ensemble = self.build_test_ensemble()
+        energies = [0.0140132996483, 0.0163679933924, 0.0213666533731, 0.0180903133947, 0.0547890926923, 0.0182782865186]
+
+        values, missing = conformational_ensemble.get_column("energy")
+        self.assertEqual(values.dtype, np.float64)
+        self.assertFalse(np.any(missing))
+        self.assertListEqual(list(values), energies)
+        self.assertIs(conformational_ensemble.get_column("energy")[0], values)
+
+        conformational_ensemble[:, "index"] = list(range(6))
+        conformational_ensemble[:, "flag"] = True
+        self.assertEqual(conformational_ensemble.get_column("index")[0].dtype, np.int64)
+        self.assertEqual(conformational_ensemble.get_column("flag")[0].dtype, bool)
+        self.assertEqual(conformational_ensemble.get_column("filename")[0].dtype, object)
+
+        # fixed-shape arrays get stacked, with nan for missing entries
+        conformational_ensemble[0:5, "vector"] = [np.arange(3) + i for i in range(5)]
+        vectors, missing = conformational_ensemble.get_column("vector")
+        self.assertEqual(vectors.shape, (6, 3))
+        self.assertListEqual(list(missing), [False] * 5 + [True])
+        self.assertTrue(np.all(np.isnan(vectors[5])))
+
+        # editing a property dict directly invalidates the cached columns
+        conformational_ensemble.get_properties_dict(3)["energy"] = -1.0
+        self.assertEqual(conformational_ensemble.get_column("energy")[0][3], -1.0)
+        self.assertIs(conformational_ensemble.lowest_molecules("energy"), conformational_ensemble.molecules[3])
+        del conformational_ensemble.get_properties_dict(3)["energy"]
+        self.assertTrue(conformational_ensemble.get_column("energy")[1][3])
+        self.assertIsNone(conformational_ensemble[3, "energy"])
+        conformational_ensemble[3, "energy"] = energies[3]
+
+        # top-k and filtering
+        lowest = conformational_ensemble.lowest_molecules("energy", 3)
+        self.assertListEqual([conformational_ensemble[m, "energy"] for m in lowest], sorted(energies)[:3])
+        filtered = conformational_ensemble.filter_by("energy", lambda e: e < 0.018)
+        self.assertIsInstance(filtered, cctk.ConformationalEnsemble)
+        self.assertListEqual(filtered[:, "energy"], [0.0140132996483, 0.0163679933924])
+
+        df = conformational_ensemble.to_dataframe(["filename", "energy", "vector"])
+        self.assertListEqual(list(df.columns), ["filename", "energy", "vector"])
+        self.assertListEqual(list(df.energy), energies)
+
+        # the frame is a copy, and cached columns can't be edited
+        df.loc[0, "energy"] = 99
+        self.assertListEqual(conformational_ensemble[:, "energy"], energies)
+        with self.assertRaises(ValueError):
+            conformational_ensemble.get_column("energy")[0][0] = 99
+
+        # zero-copy export wraps the read-only cached columns
+        df = conformational_ensemble.to_dataframe(["energy"], copy=False)
+        self.assertTrue(np.shares_memory(df["energy"].to_numpy(), conformational_ensemble.get_column("energy")[0]))
+        with self.assertRaises(ValueError):
+            df.loc[0, "energy"] = 99
+
+        # property dicts from an ensemble are stored as-is; plain dicts are copied
+        shared = cctk.ConformationalEnsemble()
+        molecule = conformational_ensemble.molecules[0]
+        properties = conformational_ensemble.get_properties_dict(molecule)
+        shared.add_molecule(molecule, properties)
+        self.assertIs(shared.get_properties_dict(0), properties)
+        plain = {"energy": -1.0}
+        shared.add_molecule(conformational_ensemble.molecules[1], plain)
+        self.assertIsNot(shared.get_properties_dict(1), plain)
+        self.assertEqual(shared[1, "energy"], -1.0)
+
+        # ints with missing entries come back as ints
+        conformational_ensemble[:, "iters"] = [5, 7, None, 2, 3, 4]
+        self.assertListEqual(conformational_ensemble[:, "iters"], [5, 7, None, 2, 3, 4])
+        self.assertIsInstance(conformational_ensemble[:, "iters"][0], int)
+
+        # editing another ensemble's properties doesn't invalidate this ensemble's cache
+        other = self.build_test_ensemble()
+        other.get_column("energy")
+        version = conformational_ensemble._properties_version
+        other[0, "energy"] = 1.0
+        self.assertEqual(conformational_ensemble._properties_version, version)
+        self.assertEqual(other.get_column("energy")[0][0], 1.0)
+
+        # ...but editing a shared property dict through a subset does
+        subset = conformational_ensemble[[0, 1]]
+        subset[0, "energy"] = -5.0
+        self.assertEqual(conformational_ensemble.get_column("energy")[0][0], -5.0)
+
+    def test_query(self):
+        conformational_ensemble = self.build_test_ensemble()
+        energies = np.array([0.0140132996483, 0.0163679933924, 0.0213666533731, 0.0180903133947, 0.0547890926923, 0.0182782865186])
+        conformational_ensemble[:, "rms_force"] = [1e-5, 2e-4, 3e-5, 5e-5, 1e-6, 6e-4]
+
+        for indexed in [False, True]:
+            if indexed:
+                conformational_ensemble.create_index("energy")
+                conformational_ensemble.create_index("rms_force")
+
+            self.assertEqual(conformational_ensemble.property_range("energy"), (energies.min(), energies.max()))
+
+            # within 3 kcal/mol of the minimum, and converged
+            window = conformational_ensemble.query(energy=(None, energies.min() + 3 / 627.509), rms_force=(None, 1e-4))
+            self.assertIsInstance(window, cctk.ConformationalEnsemble)
+            self.assertListEqual(list(window[:, "energy"]), list(energies[[0, 3]]))
+            self.assertIs(window.molecules[0], conformational_ensemble.molecules[0])
+            self.assertIs(window.get_properties_dict(0), conformational_ensemble.get_properties_dict(0))
+
+            self.assertListEqual(list(conformational_ensemble.query(energy=(0.016, 0.0181))[:, "energy"]), list(energies[[1, 3]]))
+            self.assertEqual(len(conformational_ensemble.query(energy=(1.0, None))), 0)
+
+            self.assertListEqual(conformational_ensemble.top_k("energy", 2)[:, "energy"], sorted(energies)[:2])
+            self.assertListEqual(conformational_ensemble.top_k("energy", 2, largest=True)[:, "energy"], sorted(energies)[::-1][:2])
+
+        # indexes stay correct when properties change
+        conformational_ensemble[5, "energy"] = None
+        conformational_ensemble[4, "energy"] = 0.0
+        self.assertEqual(conformational_ensemble.top_k("energy", 1)[0, "energy"], 0.0)
+        self.assertEqual(len(conformational_ensemble.query(energy=(None, None))), 5)
+
+        conformational_ensemble.drop_index("energy")
+        self.assertEqual(len(conformational_ensemble.query(energy=(None, None))), 5)
+        with self.assertRaises(AssertionError):
+            conformational_ensemble.create_index("filename")
+
+    def test_join(self):
+        conformational_ensemble = self.build_test_ensemble()
+        parts = [conformational_ensemble[0:2], conformational_ensemble[2:3], cctk.ConformationalEnsemble(), conformational_ensemble[3:6]]
+
+        joined = cctk.ConformationalEnsemble.join_ensembles(parts, name="joined")
+        self.assertEqual(joined.name, "joined")
+        self.assertListEqual(joined.molecule_list(), conformational_ensemble.molecule_list())
+        self.assertListEqual(joined[:, "energy"], conformational_ensemble[:, "energy"])
+
+        copied = cctk.ConformationalEnsemble.join_ensembles(parts, copy=True)
+        self.assertTrue(copied.contiguous)
+        self.assertEqual(len(copied), 6)
+        self.assertTrue(np.array_equal(copied.geometries(), conformational_ensemble.geometries()))
+        self.assertListEqual(copied[:, "filename"], conformational_ensemble[:, "filename"])
+        for old_molecule, new_molecule in zip(conformational_ensemble.molecules, copied.molecules):
+            self.assertIsNot(old_molecule, new_molecule)
+            self.assertIs(new_molecule.bonds, copied.molecules[0].bonds)
+            self.assertIsNot(new_molecule.bonds, old_molecule.bonds)
+
+        # the copies are independent, and can keep growing
+        copied.molecules[0].geometry[1] = [0, 0, 0]
+        self.assertFalse(np.allclose(conformational_ensemble.molecules[0].geometry[1], 0))
+        copied.add_molecule(conformational_ensemble.molecules[0], copy=True)
+        self.assertEqual(len(copied.geometries()), 7)
+
+        # incompatible ensembles are rejected
+        other = cctk.ConformationalEnsemble()
+        other.add_molecule(cctk.Molecule([6, 1, 1, 1, 1], np.zeros(shape=(5, 3))))
+        with self.assertRaises(ValueError):
+            cctk.ConformationalEnsemble.join_ensembles([conformational_ensemble, other])
+
+    def test_bulk_geometry(self):
+        conformational_ensemble = self.build_test_ensemble()
+
+        self.assertEqual(conformational_ensemble.geometries().shape, (6, 21, 3))
+
+        dihedrals = conformational_ensemble.get_dihedrals([[1,2,7,8], [2,7,8,9]])
+        self.assertEqual(dihedrals.shape, (6, 2))
+        for i, molecule in enumerate(conformational_ensemble.molecules):
+            self.assertAlmostEqual(dihedrals[i][0], molecule.get_dihedral(1,2,7,8), places=3)
+            self.assertAlmostEqual(dihedrals[i][1], molecule.get_dihedral(2,7,8,9), places=3)
+
+        distances = conformational_ensemble.get_distances([[1,2], [7,8]])
+        angles = conformational_ensemble.get_angles([[1,2,7]])
+        self.assertEqual(distances.shape, (6, 2))
+        self.assertEqual(angles.shape, (6, 1))
+        self.assertAlmostEqual(angles[3][0], conformational_ensemble.molecules[3].get_angle(1,2,7), places=3)
+
+    def test_contiguous(self):
+        reference = self.build_test_ensemble()
+        ensemble = cctk.ConformationalEnsemble(contiguous=True)
+        for molecule, properties in reference.items():
+            ensemble.add_molecule(copy.deepcopy(molecule), properties)
+
+        # growing past the initial capacity should keep every molecule attached to the shared array
+        geometries = ensemble.geometries()
+        self.assertEqual(geometries.shape, (6, 21, 3))
+        self.assertTrue(np.array_equal(geometries, reference.geometries()))
+        for i, molecule in enumerate(ensemble.molecules):
+            self.assertTrue(isinstance(molecule.geometry, cctk.OneIndexedArray))
+            self.assertTrue(np.shares_memory(molecule.geometry, geometries[i]))
+
+        # in-place changes go both ways
+        ensemble.molecules[1].translate_molecule(np.array([1.0, 0, 0]))
+        self.assertAlmostEqual(ensemble.geometries()[1][0][0], reference.geometries()[1][0][0] + 1.0, places=4)
+        ensemble.geometries()[2] += 1.0
+        self.assertAlmostEqual(ensemble.molecules[2].geometry[1][1], reference.molecules[2].geometry[1][1] + 1.0, places=4)
+
+        # reassigned geometries are copied back in
+        ensemble.molecules[3].geometry = reference.molecules[0].geometry
+        self.assertTrue(np.array_equal(ensemble.geometries()[3], reference.geometries()[0]))
+
+        self.assertEqual(ensemble.get_distances([[1, 2]]).shape, (6, 1))
+        self.assertFalse(ensemble[0].contiguous)
+
+        ensemble2 = copy.deepcopy(ensemble)
+        ensemble2.molecules[0].translate_molecule(np.array([0, 0, 5.0]))
+        self.assertAlmostEqual(ensemble2.geometries()[0][0][2], ensemble.geometries()[0][0][2] + 5.0, places=4)
+
+    def test_geometric_parameters(self):
+        conformational_ensemble = self.build_test_ensemble()
+
+        distances = conformational_ensemble.get_geometric_parameters("distance", 1, 2)
+        self.assertTrue(isinstance(distances, list))
+        self.assertEqual(len(distances), 6)
+        self.assertAlmostEqual(distances[2], conformational_ensemble.molecules[2].get_distance(1, 2), places=4)
+
+        dihedrals = conformational_ensemble.get_geometric_parameters("dihedral", 1, 2, 7, 8)
+        self.assertAlmostEqual(dihedrals[4], conformational_ensemble.molecules[4].get_dihedral(1, 2, 7, 8), places=3)
+
+        with self.assertRaises(ValueError):
+            conformational_ensemble.get_geometric_parameters("angle", 1, 2)
+        with self.assertRaises(ValueError):
+            conformational_ensemble.get_geometric_parameters("potato", 1, 2)
+
+        params = conformational_ensemble.get_geometric_parameters([("dihedral", 1, 2, 7, 8), (1, 2), ("angle", 1, 2, 7), (2, 7, 8, 9)])
+        self.assertEqual(params.shape, (6, 4))
+        for i, molecule in enumerate(conformational_ensemble.molecules):
+            self.assertAlmostEqual(params[i][0], molecule.get_dihedral(1, 2, 7, 8), places=3)
+            self.assertAlmostEqual(params[i][1], molecule.get_distance(1, 2), places=4)
+            self.assertAlmostEqual(params[i][2], molecule.get_angle(1, 2, 7), places=3)
+            self.assertAlmostEqual(params[i][3], molecule.get_dihedral(2, 7, 8, 9), places=3)
+
+        with self.assertRaises(ValueError):
+            conformational_ensemble.get_geometric_parameters([("distance", 1, 2, 3)])
+
+    def test_volumes(self):
+        conformational_ensemble = self.build_test_ensemble()
+        volumes = conformational_ensemble.volumes(pts_per_angstrom=5)
+        self.assertEqual(volumes.shape, (6,))
+        for volume, molecule in zip(volumes, conformational_ensemble.molecules):
+            self.assertEqual(volume, molecule.volume(pts_per_angstrom=5))
+        self.assertTrue(np.array_equal(conformational_ensemble.volumes(pts_per_angstrom=5, nprocs=2), volumes))
+
+    def test_limit_solvent_shell(self):
+        mol = cctk.XYZFile.read_file("test/static/acetone_water.xyz").get_molecule()
+        mol.assign_connectivity()
+
+        frames = cctk.ConformationalEnsemble()
+        rng = np.random.default_rng(0)
+        for i in range(3):
+            frame = mol.clone()
+            frame.geometry += rng.normal(scale=0.3, size=frame.geometry.shape)
+            frames.add_molecule(frame, {"step": i})
+
+        shells = frames.limit_solvent_shell(num_solvents=10)
+        self.assertEqual(len(shells), 3)
+        idxs = frames.limit_solvent_shell(num_solvents=10, return_idxs=True)
+
+        for i, (frame, shell) in enumerate(zip(frames.molecules, shells.molecules)):
+            self.assertEqual(shell.num_atoms(), 40)
+            self.assertEqual(shells.get_property(i, "step"), i)
+            self.assertListEqual(idxs[i], frame.limit_solvent_shell(num_solvents=10, return_idxs=True))
+            self.assertTrue(cctk.Molecule.equal(shell, frame.limit_solvent_shell(num_solvents=10)))
+
+    def test_center_periodic(self):
+        mol = cctk.GaussianFile.read_file("test/static/periodic.gjf").get_molecule()
+        mol.assign_connectivity(periodic_boundary_conditions=np.array([20, 20, 20]))
+
+        frames = cctk.ConformationalEnsemble(contiguous=True)
+        rng = np.random.default_rng(0)
+        for i in range(3):
+            frame = mol.clone()
+            frame.geometry += rng.normal(scale=0.05, size=frame.geometry.shape)
+            frames.add_molecule(frame)
+
+        expected = [m.clone().center_periodic(5, 20).geometry for m in frames.molecules]
+        frames.center_periodic(5, 20)
+        for geometry, frame in zip(expected, frames.molecules):
+            self.assertTrue(np.allclose(geometry, frame.geometry, atol=1e-4))
+
     def test_boltzmann_weighting(self):
         conformational_ensemble = self.build_test_ensemble()
 
@@ -172,6 +471,38 @@ class TestEnsemble(unittest.TestCase):
             ce2.add_molecule(molecule,properties_dict)
         enthalpy = ce2.boltzmann_average("enthalpy")
         self.assertTrue(enthalpy - .10722 < 0.0001)
+        self.assertIsInstance(enthalpy, float)
+        self.assertEqual(np.ndim(enthalpy), 0)
+
+    def test_boltzmann_averages(self):
+        conformational_ensemble = self.build_test_ensemble()
+        n_atoms = conformational_ensemble.molecules[0].num_atoms()
+        conformational_ensemble[:, "charges"] = [np.arange(n_atoms) * (i + 1) for i in range(6)]
+        conformational_ensemble[:, "couplings"] = [np.ones(shape=(2, 2)) * i for i in range(6)]
+
+        temps = [100, 298, 1000]
+        weights = conformational_ensemble.boltzmann_weights(temps=temps)
+        self.assertEqual(weights.shape, (3, 6))
+        self.assertTrue(np.allclose(weights.sum(axis=1), 1))
+        self.assertTrue(np.allclose(weights[1], conformational_ensemble.boltzmann_weights(temps=298)))
+
+        # flatter distribution at higher temperature
+        self.assertGreater(weights[0].max(), weights[2].max())
+
+        averages = conformational_ensemble.boltzmann_averages(["energy", "charges", "couplings"], temps=temps)
+        self.assertEqual(averages["energy"].shape, (3,))
+        self.assertEqual(averages["charges"].shape, (3, n_atoms))
+        self.assertEqual(averages["couplings"].shape, (3, 2, 2))
+
+        for i, temp in enumerate(temps):
+            for name in ["energy", "charges", "couplings"]:
+                single = conformational_ensemble.boltzmann_average(name, temp=temp)
+                self.assertTrue(np.allclose(averages[name][i], single))
+            self.assertAlmostEqual(averages["energy"][i], np.dot(weights[i], conformational_ensemble[:, "energy"]))
+
+        conformational_ensemble[2, "charges"] = None
+        with self.assertRaises(AssertionError):
+            conformational_ensemble.boltzmann_averages("charges")
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,4 @@
-import unittest, sys, os, io, copy, math
+import unittest, sys, os, io, copy, math, pickle
 import numpy as np
 import networkx as nx
 import cctk
@@ -83,6 +83,209 @@ class TestMolecule(unittest.TestCase):
             mol.set_dihedral(1, 3, 5, 7, t)
             self.assertEqual(int(round(mol.get_dihedral(1,3,5,7))), t)
 
+    def test_scan(self):
+        mol = self.load_molecule()
+        mol.assign_connectivity()
+
+        coordinates = [(1, 3, 5, 7), (1, 3, 5), (6, 9, 11, 13), (1, 2)]
+        values = [[0, 120, 240], [105, 115], [60, 180], [1.1]]
+        ensemble = mol.scan(coordinates, values)
+        self.assertTrue(isinstance(ensemble, cctk.ConformationalEnsemble))
+        self.assertEqual(len(ensemble), 12)
+        self.assertListEqual(list(ensemble[2, "scan_values"]), [0, 115, 60, 1.1])
+
+        #### the original molecule is untouched, and the conformers share one bond graph
+        self.assertEqual(int(round(mol.get_dihedral(1,3,5,7))), 60)
+        self.assertTrue(ensemble.molecules[0].bonds is ensemble.molecules[-1].bonds)
+        self.assertFalse(ensemble.molecules[0].bonds is mol.bonds)
+
+        for conformer, scan_values in zip(ensemble.molecules, ensemble[:, "scan_values"]):
+            reference = copy.deepcopy(mol)
+            reference.set_dihedral(1, 3, 5, 7, scan_values[0])
+            reference.set_angle(1, 3, 5, scan_values[1])
+            reference.set_dihedral(6, 9, 11, 13, scan_values[2])
+            reference.set_distance(1, 2, scan_values[3])
+            #### set_dihedral and set_angle can translate the whole molecule, so compare all interatomic distances
+            geometry, reference_geometry = conformer.geometry.view(np.ndarray), reference.geometry.view(np.ndarray)
+            distances = np.linalg.norm(geometry[:, np.newaxis] - geometry[np.newaxis], axis=-1)
+            reference_distances = np.linalg.norm(reference_geometry[:, np.newaxis] - reference_geometry[np.newaxis], axis=-1)
+            self.assertTrue(np.allclose(distances, reference_distances, atol=1e-3))
+            self.assertAlmostEqual(conformer.get_dihedral(6, 9, 11, 13), scan_values[2], places=3)
+
+        with self.assertRaises(ValueError):
+            mol.scan([(1, 3, 5, 7)], [[400]])
+
+    def test_optimize_dihedral(self):
+        mol = self.load_molecule()
+        mol.assign_connectivity()
+
+        #### brute force over the same angles
+        rotamers = mol.scan([(1, 3, 5, 7)], [list(range(0, 360, 10))])
+        rms_distances = [m.rms_distance_between_atoms() for m in rotamers.molecules]
+        expected_angle = list(range(0, 360, 10))[int(np.argmax(rms_distances))]
+
+        self.assertEqual(mol.optimize_dihedral(1, 3, 5, 7), expected_angle)
+        self.assertEqual(int(round(mol.get_dihedral(1, 3, 5, 7))) % 360, expected_angle)
+
+        angle = mol.optimize_dihedral(1, 3, 5, 7, step=30, score="clash")
+        self.assertEqual(angle % 30, 0)
+        with self.assertRaises(ValueError):
+            mol.optimize_dihedral(1, 3, 5, 7, score="potato")
+
+        angles = mol.optimize_dihedrals([(1, 3, 5, 7), (6, 9, 11, 13)], step=30)
+        self.assertEqual(len(angles), 2)
+        best = mol.rms_distance_between_atoms()
+        for a, b in [(0, 0), (90, 180), (angles[0], (angles[1] + 30) % 360)]:
+            other = copy.deepcopy(mol)
+            other.set_dihedral(1, 3, 5, 7, a)
+            other.set_dihedral(6, 9, 11, 13, b)
+            self.assertLessEqual(other.rms_distance_between_atoms(), best + 1e-5)
+
+    def test_topology_cache(self):
+        mol = cctk.GaussianFile.read_file("test/static/LSD_custom.out").get_molecule().assign_connectivity()
+
+        in_ring = set([atom for cycle in nx.cycle_basis(mol.bonds) for atom in cycle])
+        for atom in range(1, mol.num_atoms() + 1):
+            self.assertEqual(mol.is_atom_in_ring(atom), atom in in_ring)
+        self.assertEqual(len(mol.get_components()), 1)
+
+        #### opening a ring bond makes it a bridge, so its fragments become available
+        ring_bond = next(iter(e for e in mol.bonds.edges() if e[0] in in_ring and e[1] in in_ring))
+        with self.assertRaises(ValueError):
+            mol._get_bond_fragments(*ring_bond)
+
+        chain_bond = next(iter(e for e in mol.bonds.edges() if not mol.is_atom_in_ring(e[1])))
+        fragment1, fragment2 = mol._get_bond_fragments(*chain_bond)
+        self.assertEqual(len(fragment1) + len(fragment2), mol.num_atoms())
+        fragment1.append(0)
+        self.assertNotIn(0, mol._get_bond_fragments(*chain_bond)[0])
+
+        #### edits invalidate the cache
+        mol.remove_bond(*chain_bond)
+        self.assertEqual(len(mol.get_components()), 2)
+        self.assertFalse(mol.are_connected(*chain_bond))
+        mol.add_bond(*chain_bond)
+        self.assertTrue(mol.are_connected(*chain_bond))
+
+        mol.add_atom("He", [20.0, 0.0, 0.0])
+        self.assertEqual(len(mol.get_components()), 2)
+        self.assertFalse(mol.is_atom_in_ring(mol.num_atoms()))
+        mol.remove_atom(mol.num_atoms())
+        self.assertEqual(len(mol.get_components()), 1)
+
+        #### edits which keep the number of bonds constant are seen by every molecule sharing the graph
+        for compact in [False, True]:
+            a = cctk.Molecule([6, 6, 6, 6], [[0, 0, 0], [1.5, 0, 0], [1.5, 1.5, 0], [3, 1.5, 0]], bonds=[(1, 2), (2, 3), (3, 4)])
+            if compact:
+                a.compact_bonds()
+            b = cctk.Molecule(a.atomic_numbers, a.geometry + 0.1)
+            b.bonds = a.bonds
+
+            self.assertTrue(b.are_connected(1, 4))
+            self.assertFalse(b.is_atom_in_ring(1))
+            colors = top.get_canonical_colors(b)
+            self.assertEqual(colors[0], colors[3])
+
+            a.remove_bond(3, 4)
+            a.add_bond(1, 3)
+            self.assertFalse(b.are_connected(1, 4))
+            self.assertTrue(b.is_atom_in_ring(1))
+            colors = top.get_canonical_colors(b)
+            self.assertEqual(colors[0], colors[2])
+            self.assertNotEqual(colors[0], colors[3])
+
+        #### so are direct edits to the graph, and the version counter stays out of the graph's attributes
+        a = cctk.Molecule([6, 6, 6, 6], [[0, 0, 0], [1.5, 0, 0], [1.5, 1.5, 0], [3, 1.5, 0]], bonds=[(1, 2), (2, 3), (3, 4)])
+        b = cctk.Molecule(a.atomic_numbers, a.geometry + 0.1)
+        b.bonds = a.bonds
+        self.assertTrue(b.are_connected(1, 4))
+        a.bonds.remove_edge(3, 4)
+        a.bonds.add_edge(1, 3, weight=1)
+        self.assertFalse(b.are_connected(1, 4))
+        self.assertTrue(b.is_atom_in_ring(1))
+        self.assertDictEqual(a.bonds.graph, {})
+
+    def test_clone(self):
+        mol = self.load_molecule()
+        mol.assign_connectivity()
+        clone = mol.clone()
+
+        self.assertTrue(cctk.Molecule.equal(mol, clone))
+
+        #### the bond graph is shared until one side writes to it (or hands it out)
+        self.assertIs(clone._bond_backend(), mol._bond_backend())
+        self.assertTrue(clone.is_atom_in_ring(5) == mol.is_atom_in_ring(5))
+        self.assertIs(clone._bond_backend(), mol._bond_backend())
+        self.assertFalse(clone.bonds is mol.bonds)
+
+        #### coordinates and atomic numbers are independent
+        clone.geometry[1] = [10, 10, 10]
+        clone.atomic_numbers[1] = 6
+        self.assertFalse(np.array_equal(mol.geometry[1], clone.geometry[1]))
+        self.assertEqual(mol.atomic_numbers[1], 7)
+
+        #### bonds are independent, on either side
+        clone.remove_bond(1, 2)
+        self.assertEqual(clone.get_bond_order(1, 2), 0)
+        self.assertEqual(mol.get_bond_order(1, 2), 1)
+
+        other = mol.clone()
+        mol.add_bond(1, 31)
+        self.assertEqual(other.get_bond_order(1, 31), 0)
+        self.assertEqual(mol.get_bond_order(1, 31), 1)
+        self.assertEqual(len(other.get_components()), 1)
+
+        #### cloning a member of a conformational ensemble doesn't detach it, and the clone doesn't see later edits
+        ensemble = cctk.ConformationalEnsemble()
+        ensemble.add_molecule(self.load_molecule().assign_connectivity())
+        ensemble.add_molecule(self.load_molecule())
+        a, b = ensemble.molecules[0], ensemble.molecules[1]
+        clone = a.clone()
+        self.assertTrue(clone._topology_cache is None)
+        b.add_bond(1, 4)
+        self.assertTrue(a.bonds is b.bonds)
+        self.assertEqual(a.get_bond_order(1, 4), 1)
+        self.assertEqual(clone.get_bond_order(1, 4), 0)
+
+        #### a clone pickled together with its original stays independent
+        clone = mol.clone()
+        mol2, clone2 = pickle.loads(pickle.dumps([mol, clone]))
+        mol2.add_bond(2, 31)
+        self.assertEqual(clone2.get_bond_order(2, 31), 0)
+
+        #### compact bond graphs share their read-only arrays
+        mol.compact_bonds()
+        clone = mol.clone()
+        self.assertIs(clone._bond_graph.indices, mol._bond_graph.indices)
+        self.assertFalse(clone._bond_graph.indices.flags.writeable)
+        clone.add_bond(2, 31)
+        self.assertEqual(mol.get_bond_order(2, 31), 0)
+        self.assertEqual(clone.get_bond_order(2, 31), 1)
+
+    def test_bulk_geometry(self):
+        mol = self.load_molecule()
+
+        distances = mol.get_distances([[1,2], [1,3], [1,9]])
+        self.assertEqual(distances.shape, (3,))
+        for (a1, a2), d in zip([[1,2], [1,3], [1,9]], distances):
+            self.assertAlmostEqual(d, mol.get_distance(a1, a2), places=4)
+
+        angles = mol.get_angles(np.array([[1,3,5], [3,5,7], [5,7,9]]))
+        for (a1, a2, a3), a in zip([[1,3,5], [3,5,7], [5,7,9]], angles):
+            self.assertAlmostEqual(a, mol.get_angle(a1, a2, a3), places=3)
+
+        dihedrals = mol.get_dihedrals([[1,3,5,7], [16,14,17,18], [31,28,1,2]])
+        for (a1, a2, a3, a4), d in zip([[1,3,5,7], [16,14,17,18], [31,28,1,2]], dihedrals):
+            self.assertAlmostEqual(d, mol.get_dihedral(a1, a2, a3, a4), places=3)
+
+        self.assertEqual(mol.get_distances([1,2]).shape, (1,))
+        with self.assertRaises(ValueError):
+            mol.get_distances([[1,2,3]])
+        with self.assertRaises(ValueError):
+            mol.get_angles([[0,1,2]])
+        with self.assertRaises(TypeError):
+            mol.get_dihedrals([[1.5,2,3,4]])
+
     def test_fragment(self):
         mol = self.load_molecule()
         mol.assign_connectivity()
@@ -113,6 +316,38 @@ class TestMolecule(unittest.TestCase):
         self.assertEqual(mol.num_atoms(), 4)
         self.assertListEqual(list(mol.get_vector(4)), [2, 0, 0])
 
+    def test_bulk_add_remove(self):
+        mol = self.load_molecule()
+        mol.assign_connectivity()
+        num_atoms, num_bonds = mol.num_atoms(), mol.bonds.number_of_edges()
+
+        mol, new_atoms = mol.add_atoms(["He", 18], [[20, 0, 0], [30, 0, 0]], return_mapping=True)
+        self.assertListEqual(new_atoms, [num_atoms + 1, num_atoms + 2])
+        self.assertListEqual(mol.atomic_numbers[new_atoms].tolist(), [2, 18])
+        self.assertListEqual(list(mol.get_vector(num_atoms + 2)), [30, 0, 0])
+        self.assertEqual(mol.bonds.number_of_nodes(), num_atoms + 2)
+
+        with self.assertRaises(ValueError):
+            mol.add_atoms([2], [[0, 0, 0], [1, 0, 0]])
+
+        #### removing several atoms at once should match removing them one at a time
+        mol2 = mol.clone()
+        for atom in [24, 3, 1]:
+            mol2.remove_atom(atom)
+
+        mol3, mapping = mol.clone().remove_atoms([1, 3, 24], return_mapping=True)
+        self.assertTrue(cctk.Molecule.equal(mol2, mol3))
+        self.assertListEqual(sorted(mol2.bonds.edges(data="weight")), sorted(mol3.bonds.edges(data="weight")))
+        self.assertIsNone(mapping[3])
+        self.assertEqual(mapping[2], 1)
+        self.assertEqual(mapping[num_atoms + 2], num_atoms - 1)
+        self.assertEqual(mol3.atomic_numbers[mapping[25]], mol.atomic_numbers[25])
+
+        mol4 = mol.clone().compact_bonds().remove_atoms([1, 3, 24])
+        self.assertListEqual(sorted(mol4.bonds.edges(data="weight")), sorted(mol3.bonds.edges(data="weight")))
+        self.assertEqual(mol.num_atoms(), num_atoms + 2)
+        self.assertEqual(mol.bonds.number_of_edges(), num_bonds)
+
     def test_mass_spec(self):
         mol = cctk.Molecule(np.array([11], dtype=np.int8), [[0, 0, 0]])
         masses, weights = mol.calculate_mass_spectrum()
@@ -155,6 +390,17 @@ class TestMolecule(unittest.TestCase):
         mol = cctk.Molecule.new_from_name("acetone")
         self.assertTrue(abs(mol.volume() - 62) < 1)
 
+    def test_grid_volume(self):
+        mol = cctk.GaussianFile.read_file("test/static/LSD_custom.out").get_molecule()
+        volume = mol.volume()
+        self.assertTrue(abs(volume - 253) < 1)
+        self.assertEqual(mol.volume(nprocs=2), volume)
+
+        #### thin slabs must give exactly the same count
+        radii = [cctk.helper_functions.get_vdw_radius(z) for z in mol.atomic_numbers]
+        self.assertEqual(cctk.helper_functions.compute_grid_volume(mol.geometry, radii, max_points=1000), volume)
+        self.assertTrue(mol.volume(qhull=True) < volume)
+
     def test_renumber(self):
         mol = self.load_molecule()
         mol2 = mol.swap_atom_numbers(1, 2)
@@ -194,6 +440,32 @@ class TestMolecule(unittest.TestCase):
         m4 = m2.limit_solvent_shell(num_solvents=10, distance_from_atom=1)
         self.assertEqual(m4.num_atoms(), 83)
 
+    def test_center_periodic(self):
+        m1 = cctk.GaussianFile.read_file("test/static/periodic.gjf").get_molecule()
+        m1 = m1.assign_connectivity(periodic_boundary_conditions=np.array([20, 20, 20]))
+        m1.center_periodic(1, 20)
+
+        #### every bond should be whole after unwrapping
+        edges = np.array(list(m1.bonds.edges()))
+        bond_lengths = np.linalg.norm(m1.geometry[edges[:,0]] - m1.geometry[edges[:,1]], axis=-1)
+        self.assertTrue(np.max(bond_lengths) < 2)
+
+        #### moving fragments by whole box lengths shouldn't matter
+        m2 = m1.clone()
+        rng = np.random.default_rng(0)
+        for fragment in m2.get_components():
+            m2.geometry[fragment] += rng.integers(-2, 3, size=3) * 20
+        m2.center_periodic(1, 20)
+        self.assertTrue(np.allclose(m1.geometry, m2.geometry, atol=1e-3))
+
+        m3 = m1.clone().center_periodic(1, np.eye(3) * 20)
+        self.assertTrue(np.allclose(m1.geometry, m3.geometry, atol=1e-3))
+
+        fragments = m1.fragment()
+        self.assertEqual(len(fragments), len(m1.get_components()))
+        self.assertEqual(sum([f.num_atoms() for f in fragments]), m1.num_atoms())
+        self.assertEqual(sum([f.bonds.number_of_edges() for f in fragments]), m1.bonds.number_of_edges())
+
     def test_rdkit(self):
         mol = cctk.Molecule.new_from_name("acetone")
         self.assertEqual(len(mol.atomic_numbers), 10)
@@ -219,6 +491,50 @@ class TestMolecule(unittest.TestCase):
         mol2 = cctk.Molecule.from_string(saved)
         self.assertTrue(cctk.Molecule.equal(mol, mol2))
 
+    def test_to_bytes(self):
+        mol = self.load_molecule()
+        mol.assign_connectivity()
+        mol.add_bond(1, 2, 2)
+        mol.name = "peptide"
+
+        data = mol.to_bytes()
+        mol2 = cctk.Molecule.from_bytes(data)
+        self.assertTrue(cctk.Molecule.equal(mol, mol2))
+        self.assertEqual(mol2.name, "peptide")
+        self.assertListEqual(sorted(mol2.bonds.edges(data="weight")), sorted(mol.bonds.edges(data="weight")))
+        self.assertEqual(len(data), 32 + 7 + 31 * 13 + 30 * 9)
+
+        mol3 = cctk.Molecule.from_bytes(mol.compact_bonds().to_bytes(), compact_bonds=True)
+        self.assertTrue(isinstance(mol3._bond_graph, cctk.BondGraph))
+        self.assertEqual(mol3.get_bond_order(1, 2), 2)
+
+        #### vibrational modes and properties
+        ensemble = cctk.GaussianFile.read_file("test/static/methane2.out")[0].ensemble
+        mol = ensemble.molecules[-1]
+        properties = ensemble.get_properties_dict(mol)
+        properties["note"] = "test"
+        properties["missing"] = None
+        properties["converged"] = True
+        mol2, properties2 = cctk.Molecule.from_bytes(mol.to_bytes(properties), return_properties=True)
+
+        self.assertEqual(len(mol2.vibrational_modes), len(mol.vibrational_modes))
+        for mode, mode2 in zip(mol.vibrational_modes, mol2.vibrational_modes):
+            self.assertEqual(mode.frequency, mode2.frequency)
+            self.assertEqual(mode.reduced_mass, mode2.reduced_mass)
+            self.assertTrue(np.allclose(mode.displacements, mode2.displacements, atol=1e-6))
+
+        self.assertListEqual(sorted(properties2.keys()), sorted(properties.keys()))
+        self.assertEqual(properties2["energy"], properties["energy"])
+        self.assertEqual(properties2["note"], "test")
+        self.assertIsNone(properties2["missing"])
+        self.assertIs(properties2["converged"], True)
+
+        self.assertIsNone(cctk.Molecule.from_bytes(mol.to_bytes(), return_properties=True)[1])
+        with self.assertRaises(ValueError):
+            cctk.Molecule.from_bytes(b"XXXX" + data[4:])
+        with self.assertRaises(ValueError):
+            cctk.Molecule.from_bytes(data[:100])
+
     def test_coulomb_analysis(self):
         file = cctk.GaussianFile.read_file("test/static/HBD_dimer.out")
         mol = file.get_molecule()
@@ -195,5 +195,30 @@ class TestNMR(unittest.TestCase):
         f1 = cctk.GaussianFile.read_file("test/static/ibuprofen_solvated.out")
         f2 = cctk.GaussianFile.read_file("test/static/ibuprofen_solvated2.out")
 
+    def test_scale_conformers(self):
+        # two "conformers" of ethane with shifted shieldings and different energies
+        ensemble = cctk.GaussianFile.read_file("test/static/ethane.out")[1].ensemble
+        molecule = ensemble.molecules[-1]
+        shieldings = ensemble[-1, "isotropic_shielding"]
+
+        conformers = cctk.ConformationalEnsemble()
+        conformers.add_molecule(molecule, {"isotropic_shielding": shieldings, "energy": 0.0})
+        conformers.add_molecule(copy.deepcopy(molecule), {"isotropic_shielding": shieldings - 1.0, "energy": 0.001})
+
+        symmetrical = [[1,5],[2,3,4,6,7,8]]
+        scaled_shifts, shift_labels = cctk.helper_functions.scale_nmr_shifts(conformers, symmetrical_atom_numbers=symmetrical)
+        self.assertEqual(scaled_shifts.shape, (2, 2))
+        self.assertListEqual(list(shift_labels[0]), ["H2/3/4/6/7/8", "C1/5"])
+        self.assertTrue(np.allclose(scaled_shifts[0], [0.42845589, 0.06087379]))
+        self.assertTrue(np.allclose(scaled_shifts[1] - scaled_shifts[0], [1/1.0716, 1/1.0300]))
+
+        averaged_shifts, labels = cctk.helper_functions.scale_nmr_shifts(conformers, symmetrical_atom_numbers=symmetrical, boltzmann=True)
+        weights = conformers.boltzmann_weights()
+        self.assertTrue(np.allclose(averaged_shifts, weights @ scaled_shifts))
+        self.assertListEqual(list(labels), list(shift_labels[0]))
+
+        averaged_shifts, _ = cctk.helper_functions.scale_nmr_shifts(conformers, symmetrical_atom_numbers=symmetrical, boltzmann=True, temp=[100, 1000])
+        self.assertEqual(averaged_shifts.shape, (2, 2))
+
 if __name__ == '__main__':
     unittest.main()
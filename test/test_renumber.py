@@ -130,5 +130,37 @@ class TestRenumber(unittest.TestCase):
         self.assertTrue(np.array_equal(mol8.atomic_numbers, mol9.atomic_numbers))
         self.assertTrue(np.array_equal(mol8.geometry, mol9.geometry))
 
+    def test_canonical_colors(self):
+        mol1 = cctk.GaussianFile.read_file("test/static/renumber_0.gjf").get_molecule().assign_connectivity(cutoff=0.1)
+
+        #### renumber atoms (and bonds) by a fixed permutation
+        permutation = np.random.default_rng(0).permutation(mol1.num_atoms()) + 1
+        new_number = {int(old): new for new, old in enumerate(permutation, start=1)}
+        edges = [(new_number[a], new_number[b]) for a, b in mol1.bonds.edges()]
+        mol2 = cctk.Molecule(mol1.atomic_numbers[permutation], mol1.geometry[permutation], bonds=edges)
+
+        colors1, colors2 = top.get_canonical_colors(mol1), top.get_canonical_colors(mol2)
+        self.assertTrue(np.array_equal(colors1[permutation - 1], colors2))
+        self.assertEqual(top.get_graph_hash(mol1), top.get_graph_hash(mol2))
+
+        isomorphic, ordering = top.are_isomorphic(mol1, mol2, return_ordering=True)
+        self.assertTrue(isomorphic)
+        self.assertTrue(np.array_equal(mol1.atomic_numbers, mol2.atomic_numbers[ordering]))
+
+        mapping = top.find_isomorphism(mol1, mol2)
+        for a, b in mol1.bonds.edges():
+            self.assertTrue(mol2.bonds.has_edge(mapping[a], mapping[b]))
+
+        #### changing an element is picked up, even though the bonds are unchanged
+        mol3 = mol2.clone()
+        mol3.atomic_numbers[1] = 9 if mol3.atomic_numbers[1] != 9 else 17
+        self.assertFalse(top.are_isomorphic(mol1, mol3))
+        self.assertIsNone(top.find_isomorphism(mol1, mol3))
+        self.assertNotEqual(top.get_graph_hash(mol1), top.get_graph_hash(mol3))
+
+        mol4 = mol2.clone()
+        mol4.remove_bond(*list(mol4.bonds.edges())[0])
+        self.assertFalse(top.are_isomorphic(mol1, mol4))
+
 if __name__ == '__main__':
     unittest.main()